@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+"""
+Benchmark the StringMatcher and TokenMatcher: build time, peak build memory and find/replace throughput.
+
+Gazetteers and corpora are synthetic by default: words are drawn from a Zipf-distributed vocabulary so that
+the token frequencies look like natural language, gazetteer entries are sequences of 1 to 4 such words and a
+fraction of the corpus is made of gazetteer entries so that matches actually occur. Real corpora can be
+used instead with --corpus. All random choices use the given seed, so runs are reproducible.
+
+The result is written as a JSON report. If a baseline report is given, every metric is compared against the
+metric with the same key in the baseline and the script exits with status 1 if any metric got worse than
+the allowed tolerance.
+
+Example:
+```
+python benchmarks/bench_matchers.py --preset quick --out bench.json
+python benchmarks/bench_matchers.py --preset quick --baseline bench.json --tolerance 0.2
+```
+"""
+import sys
+import os
+import json
+import time
+import random
+import platform
+import argparse
+import datetime
+import itertools
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from matchtext.stringmatcher import StringMatcher
+from matchtext.tokenmatcher import TokenMatcher
+from matchtext.runutils import set_logger
+
+PRESETS = {
+    "quick": [10000, 100000],
+    "full": [10000, 100000, 1000000, 5000000],
+}
+
+# metrics where a bigger value is better, for all other metrics smaller is better
+HIGHER_IS_BETTER = {"find_units_per_sec", "replace_units_per_sec"}
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "si", "pe", "du", "ga", "ho", "ri", "an", "el", "or",
+             "us", "in", "be", "xa"]
+
+
+def ign_func(c):
+    """Ignore function used for benchmarking: ignore hyphens."""
+    return c == "-"
+
+
+MAPFUNCS = {"none": None, "lower": str.lower}
+IGNOREFUNCS = {"none": None, "hyphen": ign_func}
+
+
+def make_vocabulary(rnd, size):
+    """
+    Create a vocabulary of distinct pseudo words, some capitalized.
+    :param rnd: random instance
+    :param size: number of words
+    :return: list of words
+    """
+    vocab = set()
+    while len(vocab) < size:
+        word = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 4)))
+        if rnd.random() < 0.2:
+            word = word.capitalize()
+        vocab.add(word)
+    return sorted(vocab)
+
+
+class ZipfSampler:
+    """
+    Sample words from a vocabulary with Zipf distributed frequencies.
+    """
+    def __init__(self, rnd, vocab, s=1.1):
+        self.rnd = rnd
+        self.vocab = vocab
+        weights = [1.0 / (r ** s) for r in range(1, len(vocab) + 1)]
+        self.cum_weights = list(itertools.accumulate(weights))
+
+    def sample(self, k):
+        return self.rnd.choices(self.vocab, cum_weights=self.cum_weights, k=k)
+
+
+def make_gazetteer(rnd, sampler, size):
+    """
+    Create a list of size distinct entries, each a list of 1 to 4 words.
+    :param rnd: random instance
+    :param sampler: word sampler
+    :param size: number of entries
+    :return: list of entries, each entry a list of words
+    """
+    entries = []
+    seen = set()
+    while len(entries) < size:
+        words = sampler.sample(rnd.choice((1, 1, 2, 2, 2, 3, 3, 4)))
+        key = " ".join(words)
+        if key not in seen:
+            seen.add(key)
+            entries.append(words)
+    return entries
+
+
+def make_corpus(rnd, sampler, entries, ntokens, hitrate):
+    """
+    Create a list of tokens where approximately a fraction of hitrate tokens come from gazetteer entries.
+    :param rnd: random instance
+    :param sampler: word sampler
+    :param entries: gazetteer entries
+    :param ntokens: number of tokens to create
+    :param hitrate: fraction of tokens that are taken from gazetteer entries
+    :return: list of tokens
+    """
+    tokens = []
+    while len(tokens) < ntokens:
+        if rnd.random() < hitrate:
+            entry = rnd.choice(entries)
+            if rnd.random() < 0.1:
+                entry = [w.upper() for w in entry]
+            tokens.extend(entry)
+        else:
+            tokens.extend(sampler.sample(8))
+        if rnd.random() < 0.05:
+            tokens.append("-")
+    return tokens[:ntokens]
+
+
+def read_corpus(paths, maxtokens):
+    """
+    Read whitespace separated tokens from the given files.
+    :param paths: list of file paths
+    :param maxtokens: maximum number of tokens to read
+    :return: list of tokens
+    """
+    tokens = []
+    for path in paths:
+        with open(path, "rt", encoding="utf-8") as infp:
+            for line in infp:
+                tokens.extend(line.split())
+                if len(tokens) >= maxtokens:
+                    return tokens[:maxtokens]
+    return tokens
+
+
+def build(matcherclass, entries, mapfunc, ignorefunc, measure_memory):
+    """
+    Build a matcher and return the matcher, the build time and the peak memory (None if not measured).
+    Memory is measured in a separate build so that the tracemalloc overhead does not affect the build time.
+    """
+    if matcherclass is StringMatcher:
+        entries = [" ".join(e) for e in entries]
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+        matcher = matcherclass(mapfunc=mapfunc, ignorefunc=ignorefunc)
+        for i, e in enumerate(entries):
+            matcher.add(e, data=i)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del matcher
+    start = time.perf_counter()
+    matcher = matcherclass(mapfunc=mapfunc, ignorefunc=ignorefunc)
+    for i, e in enumerate(entries):
+        matcher.add(e, data=i)
+    buildtime = time.perf_counter() - start
+    return matcher, buildtime, peak
+
+
+def best_time(func, repeat):
+    """Run func repeat times, return the best elapsed time and the result of the last run."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def run_benchmarks(args, logger):
+    rnd = random.Random(args.seed)
+    sizes = PRESETS[args.preset] if args.sizes is None else [int(s) for s in args.sizes.split(",")]
+    vocab = make_vocabulary(rnd, args.vocabsize)
+    sampler = ZipfSampler(rnd, vocab)
+    results = []
+    for size in sizes:
+        logger.info(f"Creating gazetteer with {size} entries")
+        entries = make_gazetteer(rnd, sampler, size)
+        if args.corpus:
+            tokens = read_corpus(args.corpus, args.ntokens)
+        else:
+            tokens = make_corpus(rnd, sampler, entries, args.ntokens, args.hitrate)
+        text = " ".join(tokens)
+        for matchername, matcherclass in (("StringMatcher", StringMatcher), ("TokenMatcher", TokenMatcher)):
+            if matchername not in args.matchers:
+                continue
+            doc = text if matcherclass is StringMatcher else tokens
+            unit = "chars" if matcherclass is StringMatcher else "tokens"
+            for mapname, ignname in itertools.product(args.mapfuncs, args.ignorefuncs):
+                key = dict(matcher=matchername, size=size, mapfunc=mapname, ignorefunc=ignname)
+                logger.info(f"Building {key}")
+                matcher, buildtime, peak = build(matcherclass, entries, MAPFUNCS[mapname], IGNOREFUNCS[ignname],
+                                                 not args.no_memory)
+                results.append(dict(key, metric="build_seconds", value=buildtime, unit="s"))
+                if peak is not None:
+                    results.append(dict(key, metric="build_peak_bytes", value=peak, unit="bytes"))
+                for all, skip in itertools.product((False, True), (True, False)):
+                    elapsed, matches = best_time(lambda: matcher.find(doc, all=all, skip=skip), args.repeat)
+                    logger.info(f"find all={all} skip={skip}: {len(matches)} matches in {elapsed:.3f}s")
+                    results.append(dict(key, all=all, skip=skip, metric="find_units_per_sec",
+                                        value=len(doc)/elapsed, unit=f"{unit}/s", nmatches=len(matches)))
+                elapsed, _ = best_time(lambda: matcher.replace(doc), args.repeat)
+                results.append(dict(key, metric="replace_units_per_sec", value=len(doc)/elapsed, unit=f"{unit}/s"))
+                del matcher
+    return results
+
+
+def result_key(result):
+    return tuple((k, result.get(k)) for k in ("matcher", "size", "mapfunc", "ignorefunc", "all", "skip", "metric"))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results against the baseline results.
+    :param results: list of result dicts
+    :param baseline: list of result dicts from the baseline report
+    :param tolerance: allowed relative change in the bad direction, e.g. 0.2 for 20 percent
+    :return: list of comparison dicts, one per metric found in both
+    """
+    base = {result_key(r): r for r in baseline}
+    comparisons = []
+    for r in results:
+        b = base.get(result_key(r))
+        if b is None or not b["value"]:
+            continue
+        ratio = r["value"] / b["value"]
+        if r["metric"] in HIGHER_IS_BETTER:
+            regression = ratio < 1.0 - tolerance
+        else:
+            regression = ratio > 1.0 + tolerance
+        comparisons.append(dict(key=dict(result_key(r)), baseline=b["value"], value=r["value"],
+                                ratio=ratio, regression=regression))
+    return comparisons
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark the matchtext matchers")
+    parser.add_argument("--preset", choices=list(PRESETS.keys()), default="quick",
+                        help="Gazetteer sizes to use (quick)")
+    parser.add_argument("--sizes", help="Comma separated gazetteer sizes, overrides --preset")
+    parser.add_argument("--matchers", nargs="+", default=["StringMatcher", "TokenMatcher"],
+                        choices=["StringMatcher", "TokenMatcher"], help="Matchers to benchmark (both)")
+    parser.add_argument("--mapfuncs", nargs="+", default=list(MAPFUNCS.keys()), choices=list(MAPFUNCS.keys()),
+                        help="Map functions to use (all)")
+    parser.add_argument("--ignorefuncs", nargs="+", default=list(IGNOREFUNCS.keys()),
+                        choices=list(IGNOREFUNCS.keys()), help="Ignore functions to use (all)")
+    parser.add_argument("--corpus", nargs="+", help="Text files to use as corpus instead of a synthetic one")
+    parser.add_argument("--ntokens", type=int, default=200000, help="Number of corpus tokens to use (200000)")
+    parser.add_argument("--hitrate", type=float, default=0.2,
+                        help="Fraction of synthetic corpus tokens taken from entries (0.2)")
+    parser.add_argument("--vocabsize", type=int, default=50000, help="Size of synthetic vocabulary (50000)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (1)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeat find/replace, use best time (3)")
+    parser.add_argument("--no-memory", action="store_true", help="Do not measure peak build memory")
+    parser.add_argument("--out", help="File to write the JSON report to, default: stdout")
+    parser.add_argument("--baseline", help="Baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression against the baseline (0.2)")
+    parser.add_argument("-d", action="store_true", help="Debug")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    logger = set_logger(args, name="bench_matchers")
+    results = run_benchmarks(args, logger)
+    report = dict(
+        meta=dict(
+            created=datetime.datetime.now().isoformat(),
+            python=platform.python_version(),
+            implementation=platform.python_implementation(),
+            platform=platform.platform(),
+            seed=args.seed,
+            ntokens=args.ntokens,
+            hitrate=args.hitrate,
+            corpus=args.corpus,
+        ),
+        results=results,
+    )
+    status = 0
+    if args.baseline:
+        with open(args.baseline, "rt", encoding="utf-8") as infp:
+            baseline = json.load(infp)
+        comparisons = compare(results, baseline["results"], args.tolerance)
+        report["comparison"] = comparisons
+        for c in comparisons:
+            if c["regression"]:
+                logger.warning(f"REGRESSION {c['key']}: {c['baseline']:.4g} -> {c['value']:.4g}")
+                status = 1
+        logger.info(f"Compared {len(comparisons)} metrics, regressions: {sum(c['regression'] for c in comparisons)}")
+    if args.out:
+        with open(args.out, "wt", encoding="utf-8") as outfp:
+            json.dump(report, outfp, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,61 @@
 # -*- coding: utf-8 -*-
-from pkg_resources import get_distribution, DistributionNotFound
-
-try:
-    # Change here if project is renamed and does not equal the package name
-    dist_name = 'matchtext'
-    __version__ = get_distribution(dist_name).version
-except DistributionNotFound:
-    __version__ = 'unknown'
-finally:
-    del get_distribution, DistributionNotFound
+"""
+Fast text/token matching and replacement.
+
+Importing this package is cheap: the version and the submodules are only loaded when first accessed,
+e.g. `matchtext.StringMatcher` imports the stringmatcher module on first use.
+"""
+import importlib
+
+# Change here if project is renamed and does not equal the package name
+_DIST_NAME = 'matchtext'
+
+_SUBMODULES = {"stringmatcher", "tokenmatcher", "runutils", "utils", "caseconversion", "cli", "shardedmatcher",
+               "parallelbuild", "dawgmatcher", "diskmatcher", "ngrammatcher"}
+
+# names which can be accessed directly from the package and the module they get imported from
+_LAZY_NAMES = {
+    "StringMatcher": "stringmatcher",
+    "TokenMatcher": "tokenmatcher",
+    "ShardedMatcher": "shardedmatcher",
+    "DawgMatcher": "dawgmatcher",
+    "DiskMatcher": "diskmatcher",
+    "NgramMatcher": "ngrammatcher",
+    "build_parallel": "parallelbuild",
+}
+
+
+def _get_version():
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        # Python < 3.8
+        try:
+            from pkg_resources import get_distribution, DistributionNotFound
+        except ImportError:
+            return 'unknown'
+        try:
+            return get_distribution(_DIST_NAME).version
+        except DistributionNotFound:
+            return 'unknown'
+    try:
+        return version(_DIST_NAME)
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+def __getattr__(name):
+    if name == "__version__":
+        value = _get_version()
+    elif name in _SUBMODULES:
+        value = importlib.import_module("." + name, __name__)
+    elif name in _LAZY_NAMES:
+        value = getattr(importlib.import_module("." + _LAZY_NAMES[name], __name__), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES | set(_LAZY_NAMES) | {"__version__"})
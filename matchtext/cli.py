@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+Command line annotation of corpora with a gazetteer.
+
+The gazetteer is either a TSV file with one entry per line (the entry, optionally followed by a tab and the
+data for the entry) or a matcher previously saved with --save. Input is read from files or stdin, either as
+plain text (one document per line) or as JSONL (the text is taken from the field given with --field).
+For each document, one line is written: either a JSON object with the matches or the text with all
+matches replaced.
+
+Documents are processed in batches by a pool of worker processes. The output order is the input order and at
+most --maxpending batches are in flight at any time, so memory use does not depend on the size of the input.
+"""
+import sys
+import json
+import pickle
+import argparse
+from collections import deque
+from matchtext.runutils import set_logger, StageTimer
+
+MAPFUNCS = {"none": None, "lower": str.lower, "upper": str.upper, "casefold": str.casefold}
+
+# the matcher used by the functions that run in a worker process
+_matcher = None
+_config = None
+
+
+def build_matcher(args):
+    """
+    Load or build the matcher as specified by the command line arguments.
+    :param args: argparse namespace
+    :return: the matcher
+    """
+    if args.gazformat == "pickle":
+        with open(args.gazetteer, "rb") as infp:
+            return pickle.load(infp)
+    mapfunc = MAPFUNCS[args.mapfunc]
+    if args.tokens:
+        from matchtext.tokenmatcher import TokenMatcher
+        matcher = TokenMatcher(mapfunc=mapfunc)
+    else:
+        from matchtext.stringmatcher import StringMatcher
+        matcher = StringMatcher(mapfunc=mapfunc)
+    with open(args.gazetteer, "rt", encoding="utf-8") as infp:
+        for line in infp:
+            line = line.rstrip("\n\r")
+            if not line:
+                continue
+            fields = line.split("\t", 1)
+            entry = fields[0]
+            data = fields[1] if len(fields) > 1 else entry
+            if args.tokens:
+                entry = entry.split()
+                if not entry:
+                    continue
+            matcher.add(entry, data=data, append=args.append)
+    return matcher
+
+
+def _init_worker(matcher, config):
+    global _matcher, _config
+    _matcher = matcher
+    _config = config
+
+
+def _annotate_text(text):
+    config = _config
+    if config["tokens"]:
+        doc = text.split()
+    else:
+        doc = text
+    if config["replace"]:
+        rep = _matcher.replace(doc)
+        if config["tokens"]:
+            return " ".join(str(t) for t in rep)
+        return rep
+    matches = _matcher.find(doc, all=config["all"], skip=config["skip"])
+    return [dict(start=m.start, end=m.end, match=m.match, data=m.entrydata) for m in matches]
+
+
+def annotate_batch(lines):
+    """
+    Annotate a batch of input lines, return the list of output lines (without newlines) and the number of
+    characters processed. Runs in a worker process.
+    :param lines: list of input lines
+    :return: tuple of output lines, number of characters
+    """
+    config = _config
+    out = []
+    nchars = 0
+    for line in lines:
+        line = line.rstrip("\n\r")
+        if config["jsonl"]:
+            if not line.strip():
+                # blank lines, e.g. at the end of the file, are not documents
+                continue
+            obj = json.loads(line)
+            text = obj.get(config["field"], "")
+            result = _annotate_text(text)
+            if config["replace"]:
+                obj[config["field"]] = result
+            else:
+                obj[config["outfield"]] = result
+            out.append(json.dumps(obj, ensure_ascii=False, default=str))
+        else:
+            text = line
+            result = _annotate_text(text)
+            if config["replace"]:
+                out.append(result)
+            else:
+                out.append(json.dumps(dict(matches=result), ensure_ascii=False, default=str))
+        nchars += len(text)
+    return out, nchars
+
+
+def read_batches(files, batchsize):
+    """
+    Generate batches of lines from the given files or stdin if no files are given.
+    :param files: list of file paths, "-" stands for stdin
+    :param batchsize: number of lines per batch
+    :return: generator of lists of lines
+    """
+    if not files:
+        files = ["-"]
+    batch = []
+    for path in files:
+        infp = sys.stdin if path == "-" else open(path, "rt", encoding="utf-8")
+        try:
+            for line in infp:
+                batch.append(line)
+                if len(batch) >= batchsize:
+                    yield batch
+                    batch = []
+        finally:
+            if infp is not sys.stdin:
+                infp.close()
+    if batch:
+        yield batch
+
+
+def run(args, outfp, logger=None):
+    """
+    Run the annotation as specified by args and write the results to outfp.
+    :param args: argparse namespace
+    :param outfp: the output stream
+    :param logger: logger to use for progress and throughput
+    :return: the StageTimer with the "build" and "annotate" stages
+    """
+    timer = StageTimer()
+    with timer.stage("build"):
+        matcher = build_matcher(args)
+    if args.save:
+        with open(args.save, "wb") as outpfp:
+            pickle.dump(matcher, outpfp)
+    config = dict(tokens=args.tokens, jsonl=args.jsonl, field=args.field, outfield=args.outfield,
+                  replace=args.replace, all=args.all, skip=not args.noskip)
+    ndocs = 0
+    nchars = 0
+
+    def write(result):
+        nonlocal ndocs, nchars
+        lines, n = result
+        for line in lines:
+            outfp.write(line)
+            outfp.write("\n")
+        ndocs += len(lines)
+        nchars += n
+
+    with timer.stage("annotate"):
+        if args.workers <= 1:
+            _init_worker(matcher, config)
+            for batch in read_batches(args.infiles, args.batchsize):
+                write(annotate_batch(batch))
+        else:
+            import multiprocessing
+            maxpending = args.maxpending if args.maxpending else 2 * args.workers
+            with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(matcher, config)) as pool:
+                pending = deque()
+                for batch in read_batches(args.infiles, args.batchsize):
+                    if len(pending) >= maxpending:
+                        write(pending.popleft().get())
+                    pending.append(pool.apply_async(annotate_batch, (batch,)))
+                while pending:
+                    write(pending.popleft().get())
+    outfp.flush()
+    if logger:
+        st = timer.stats()
+        total = st["annotate"]["total"]
+        logger.info(f"Build time: {st['build']['total']:.3f}s")
+        logger.info(f"Annotated {ndocs} documents, {nchars} characters in {total:.3f}s: "
+                    f"{ndocs/total if total else 0:.1f} docs/s, {nchars/total if total else 0:.1f} chars/s")
+    return timer
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description="Annotate or replace gazetteer entries in a corpus")
+    parser.add_argument("infiles", nargs="*", help="Input files, stdin if none or '-'")
+    parser.add_argument("-g", "--gazetteer", required=True, help="Gazetteer TSV file or saved matcher")
+    parser.add_argument("--gazformat", choices=["tsv", "pickle"], default="tsv", help="Gazetteer format (tsv)")
+    parser.add_argument("--save", help="Save the matcher to this file for loading with --gazformat pickle")
+    parser.add_argument("--tokens", action="store_true",
+                        help="Use a TokenMatcher on whitespace separated tokens instead of a StringMatcher")
+    parser.add_argument("--mapfunc", choices=list(MAPFUNCS.keys()), default="none",
+                        help="Map characters/tokens before matching (none)")
+    parser.add_argument("--append", action="store_true", help="Keep the data of all identical entries in a list")
+    parser.add_argument("--jsonl", action="store_true", help="Input is JSONL instead of plain text lines")
+    parser.add_argument("--field", default="text", help="Field of the JSONL input containing the text (text)")
+    parser.add_argument("--outfield", default="matches", help="JSONL output field for the matches (matches)")
+    parser.add_argument("--replace", action="store_true", help="Output replaced text instead of matches")
+    parser.add_argument("--all", action="store_true", help="Find all matches, not just the longest")
+    parser.add_argument("--noskip", action="store_true", help="Also find matches overlapping a previous match")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes (1)")
+    parser.add_argument("--batchsize", type=int, default=100, help="Documents per batch (100)")
+    parser.add_argument("--maxpending", type=int, default=0,
+                        help="Maximum batches in flight, 0: twice the number of workers (0)")
+    parser.add_argument("-o", "--outfile", help="Output file, stdout if missing")
+    parser.add_argument("-d", action="store_true", help="Debug")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
+    logger = set_logger(args, name="matchtext")
+    if args.outfile:
+        with open(args.outfile, "wt", encoding="utf-8") as outfp:
+            run(args, outfp, logger=logger)
+    else:
+        run(args, sys.stdout, logger=logger)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+A StringMatcher stored as a minimal acyclic automaton (DAWG): entries which end in the same characters share
+the states for these characters, so a gazetteer with many common endings (e.g. " Inc.", " GmbH", " Ltd")
+needs far fewer states than the trie of a StringMatcher.
+
+Since a state can be reached by several entries, the data of the entries is held in a separate list indexed
+by the rank of the entry in sorted order. Each transition records how many entries are skipped by taking it,
+so the rank of an entry is obtained by summing these numbers while walking the automaton.
+
+The automaton is built incrementally from entries added in sorted order (Daciuk et al. 2000) and gets
+finalized when the first lookup or find is done, after which no entries can be added.
+"""
+from matchtext.stringmatcher import StringMatcher, Match
+from matchtext.utils import thisorthat, deep_sizeof
+
+
+class _State:
+    """
+    Automaton state: the transitions and whether an entry ends here. While building, children maps each
+    element to the next state, after finalizing it maps each element to a tuple (number of skipped entries,
+    next state).
+    """
+    __slots__ = ("children", "final", "nentries")
+
+    def __init__(self):
+        self.children = dict()
+        self.final = False
+        # number of entries ending in this state or a state reachable from it, set when finalizing
+        self.nentries = 0
+
+
+class DawgMatcher(StringMatcher):
+    """
+    A StringMatcher which stores the entries in a minimal acyclic automaton. Entries must be added in
+    sorted order of their (mapped, not ignored) characters, or all at once with DawgMatcher.build. find,
+    finditer and replace work exactly as for a StringMatcher with the same entries.
+    """
+
+    def __init__(self, ignorefunc=None, mapfunc=None, matcherdata=None, defaultdata=None,
+                 resultcache=0, resultcache_maxbytes=None, bytesmode=False, hitcounts=False):
+        """
+        Create a DawgMatcher. See StringMatcher for the parameters.
+        """
+        super().__init__(ignorefunc=ignorefunc, mapfunc=mapfunc, matcherdata=matcherdata, defaultdata=defaultdata,
+                         resultcache=resultcache, resultcache_maxbytes=resultcache_maxbytes, bytesmode=bytesmode,
+                         hitcounts=hitcounts)
+        self._root = _State()
+        # the data of all entries, in sorted order of the entries
+        self.values = []
+        self.finalized = False
+        self._previous = ()
+        self._unchecked = []  # (parent state, element, child state) not yet minimized, along the previous entry
+        self._register = dict()  # signature -> minimized state
+
+    @classmethod
+    def build(cls, entries, append=False, **kwargs):
+        """
+        Create a finalized DawgMatcher from entries in any order.
+        :param entries: iterable of (entry, data) tuples, entry is a string
+        :param append: if True, keep the data of identical entries in a list, otherwise the last data is used
+        :param kwargs: the arguments for creating the matcher
+        :return: the matcher
+        """
+        matcher = cls(**kwargs)
+        keyed = []
+        for entry, data in entries:
+            key = matcher._key(entry)
+            if key:
+                keyed.append((key, data))
+        # the sort is stable, so the data of identical entries stays in the original order
+        keyed.sort(key=lambda kd: kd[0])
+        for key, data in keyed:
+            matcher._add_key(key, data, append)
+        matcher.finalize()
+        return matcher
+
+    def _key(self, entry):
+        """
+        Return the tuple of mapped, not ignored elements of an entry.
+        """
+        if self.bytesmode and isinstance(entry, str):
+            entry = entry.encode("utf-8")
+        ignorefunc = self.ignorefunc
+        mapfunc = self.mapfunc
+        key = []
+        for el in entry:
+            if ignorefunc and ignorefunc(el):
+                continue
+            if mapfunc:
+                el = mapfunc(el)
+            key.append(el)
+        return tuple(key)
+
+    def add(self, entry, data=None, listdata=None, append=False):
+        """
+        Add a gazetteer entry or several entries if "entry" is iterable and not a string and store its data.
+        The entries must be added in sorted order of their mapped, not ignored characters. Adding the same
+        entry again replaces the data unless append is True.
+        :param entry: a string
+        :param data: the data to add for that gazetteer entry.
+        :param listdata: not used
+        :param append: if true, store data in a list and append any new data
+        :return:
+        """
+        if isinstance(entry, (str, bytes)):
+            entry = [entry]
+        for e in entry:
+            key = self._key(e)
+            if key:
+                self._add_key(key, data, append)
+
+    def __setitem__(self, key, value):
+        self.add(key, data=value)
+
+    def _add_key(self, key, data, append):
+        if self.finalized:
+            raise ValueError("No entries can be added after the DawgMatcher has been finalized")
+        if self.resultcache is not None:
+            self.resultcache.clear()
+        if key == self._previous:
+            if append:
+                self.values[-1].append(data)
+            else:
+                self.values[-1] = data
+            return
+        if key < self._previous:
+            raise ValueError("Entries must be added in sorted order, use DawgMatcher.build for unsorted entries")
+        common = 0
+        for a, b in zip(key, self._previous):
+            if a != b:
+                break
+            common += 1
+        self._minimize(common)
+        state = self._unchecked[-1][2] if self._unchecked else self._root
+        for el in key[common:]:
+            child = _State()
+            state.children[el] = child
+            self._unchecked.append((state, el, child))
+            state = child
+        state.final = True
+        self.values.append([data] if append else data)
+        self._previous = key
+        if len(key) > self.maxdepth:
+            self.maxdepth = len(key)
+
+    def _minimize(self, downto):
+        """
+        Replace each state added for the previous entry below depth downto by an equivalent registered
+        state, or register it if there is none.
+        """
+        register = self._register
+        unchecked = self._unchecked
+        while len(unchecked) > downto:
+            parent, el, child = unchecked.pop()
+            # children are already minimized, so their identity is enough to identify the suffix
+            signature = (child.final, tuple((c, id(s)) for c, s in child.children.items()))
+            state = register.get(signature)
+            if state is None:
+                register[signature] = child
+            else:
+                parent.children[el] = state
+
+    def finalize(self):
+        """
+        Minimize the remaining states and prepare the automaton for finding. This is done automatically
+        when the matcher is first used for a lookup or find. No entries can be added afterwards.
+        """
+        if self.finalized:
+            return
+        self._minimize(0)
+        self._register = None
+        self._unchecked = None
+        self._previous = None
+        # post-order over the distinct states, so the counts of the children are known before the parent's
+        order = []
+        seen = set()
+        stack = [(self._root, False)]
+        while stack:
+            state, expanded = stack.pop()
+            if expanded:
+                order.append(state)
+                continue
+            if id(state) in seen:
+                continue
+            seen.add(id(state))
+            stack.append((state, True))
+            for child in state.children.values():
+                if id(child) not in seen:
+                    stack.append((child, False))
+        for state in order:
+            state.nentries = int(state.final) + sum(child.nentries for child in state.children.values())
+        for state in order:
+            skipped = int(state.final)
+            children = dict()
+            for el, child in state.children.items():
+                children[el] = (skipped, child)
+                skipped += child.nentries
+            state.children = children
+        self.finalized = True
+
+    def _lookup(self, item):
+        """
+        Return the index of the entry in the values list or -1 if it is not an entry.
+        """
+        self.finalize()
+        state = self._root
+        index = 0
+        for el in self._key(item):
+            transition = state.children.get(el)
+            if transition is None:
+                return -1
+            index += transition[0]
+            state = transition[1]
+        if state is self._root or not state.final:
+            return -1
+        return index
+
+    def __getitem__(self, item):
+        index = self._lookup(item)
+        if index < 0:
+            raise KeyError(item)
+        return self.values[index]
+
+    def get(self, item, default=None):
+        index = self._lookup(item)
+        if index < 0:
+            return default
+        return self.values[index]
+
+    def finditer(self, text, all=False, skip=True, fromidx=None, toidx=None, matchmaker=None, maxstart=None,
+                 budget=None):
+        """
+        Find gazetteer entries in text and generate the matches, see StringMatcher.finditer.
+        """
+        if self.bytesmode and isinstance(text, str):
+            raise TypeError("A DawgMatcher in bytes mode needs a bytes-like object to search")
+        self.finalize()
+        l = len(text)
+        if fromidx is None:
+            fromidx = 0
+        if toidx is None or toidx >= l:
+            toidx = l-1
+        if fromidx > toidx:
+            return
+        if matchmaker is None:
+            matchmaker = Match
+        ignorefunc = self.ignorefunc
+        mapfunc = self.mapfunc
+        defaultdata = self.defaultdata
+        matcherdata = self.matcherdata
+        values = self.values
+        rootchildren = self._root.children
+        hitcounts = self.hitcounts
+        endidx = toidx + 1
+        startend = endidx if maxstart is None else min(maxstart + 1, endidx)
+        maxwalk = budget.max_walk_depth if budget is not None else None
+        walkend = endidx
+        i = fromidx
+        while i < startend:
+            chr = text[i]
+            if ignorefunc and ignorefunc(chr):
+                i += 1
+                continue
+            if mapfunc:
+                chr = mapfunc(chr)
+            transition = rootchildren.get(chr)
+            if transition is None:
+                i += 1
+                continue
+            index, state = transition
+            longest_end = 0
+            longest_index = -1
+            k = i
+            if maxwalk is not None:
+                walkend = min(endidx, i + maxwalk)
+            while True:
+                if state.final:
+                    # we found a match
+                    if all:
+                        if hitcounts is not None:
+                            hitcounts[index] = hitcounts.get(index, 0) + 1
+                        yield matchmaker(i, k + 1, text[i:k+1], thisorthat(values[index], defaultdata), matcherdata)
+                    else:
+                        longest_index = index
+                    longest_end = k + 1
+                if not state.children:
+                    break
+                k += 1
+                if ignorefunc:
+                    while k < walkend and ignorefunc(text[k]):
+                        k += 1
+                if k >= walkend:
+                    if walkend < endidx:
+                        budget.exceeded.add("max_walk_depth")
+                    break
+                chr = text[k]
+                if mapfunc:
+                    chr = mapfunc(chr)
+                transition = state.children.get(chr)
+                if transition is None:
+                    break
+                index += transition[0]
+                state = transition[1]
+            if longest_index >= 0:
+                if hitcounts is not None:
+                    hitcounts[longest_index] = hitcounts.get(longest_index, 0) + 1
+                yield matchmaker(i, longest_end, text[i:longest_end], thisorthat(values[longest_index], defaultdata),
+                                 matcherdata)
+            if skip and longest_end:
+                i = longest_end
+            else:
+                i += 1
+
+    def _iter_entries(self):
+        """
+        Generate tuples (key, index) for all entries, where key is the string of mapped characters (bytes in
+        bytes mode) of the entry and index its index in the values list.
+        """
+        self.finalize()
+        join = bytes if self.bytesmode else "".join
+        stack = [(self._root, (), 0)]
+        while stack:
+            state, path, index = stack.pop()
+            if state.final and path:
+                yield join(path), index
+            for el, (skipped, child) in state.children.items():
+                stack.append((child, path + (el,), index + skipped))
+
+    def stats(self, memory=True):
+        """
+        Return statistics about the automaton, see StringMatcher.stats. Nodes and edges count the distinct
+        states and transitions.
+        """
+        self.finalize()
+        nstates = 0
+        nedges = 0
+        branching = dict()
+        seen = set()
+        stack = [self._root]
+        while stack:
+            state = stack.pop()
+            if id(state) in seen:
+                continue
+            seen.add(id(state))
+            nstates += 1
+            nchildren = len(state.children)
+            nedges += nchildren
+            branching[nchildren] = branching.get(nchildren, 0) + 1
+            stack.extend(child for _, child in state.children.values())
+        depths = dict()
+        for key, _ in self._iter_entries():
+            depths[len(key)] = depths.get(len(key), 0) + 1
+        stats = dict(nodes=nstates, edges=nedges, entries=len(self.values), maxdepth=self.maxdepth,
+                     depth_histogram=dict(sorted(depths.items())), branching_histogram=dict(sorted(branching.items())))
+        if memory:
+            stats["memory"] = deep_sizeof((self._root, self.values))
+        return stats
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+A StringMatcher or TokenMatcher for gazetteers larger than the available memory, stored in an SQLite database.
+
+The trie is cut at a fixed depth, the page depth: the nodes above it are kept in memory, each subtree below
+it is stored as one page in the database and only loaded when a match is attempted through it. The
+loaded subtrees are kept in a bounded LRU cache, so only the hot parts of the gazetteer are resident.
+Apart from the page lookups, finding is done by the normal StringMatcher/TokenMatcher code, so find, finditer
+and replace work exactly as for an in-memory matcher with the same entries.
+"""
+import pickle
+import sqlite3
+from itertools import groupby
+from matchtext.stringmatcher import StringMatcher, _Node
+from matchtext.tokenmatcher import TokenMatcher
+from matchtext.parallelbuild import entry_elements, _flatten, _unflatten
+from matchtext.utils import LRUCache
+
+MATCHERS = {"string": StringMatcher, "token": TokenMatcher}
+
+# default page depth: the first character alone would give very big pages for strings
+PAGEDEPTHS = {"string": 2, "token": 1}
+
+
+class _PageStore:
+    """
+    Loads the subtrees stored in the database, through an LRU cache.
+    """
+    def __init__(self, conn, cachesize, tokens):
+        self.conn = conn
+        self.cache = LRUCache(cachesize)
+        self.tokens = tokens
+        self.nloaded = 0
+
+    def load(self, prefix):
+        pagekey = repr(prefix)
+        node = self.cache.get(pagekey)
+        if node is None:
+            row = self.conn.execute("SELECT data FROM pages WHERE pagekey = ?", (pagekey,)).fetchone()
+            if row is None:
+                raise KeyError(prefix)
+            children = dict()
+            _unflatten(pickle.loads(row[0]), children, self.tokens)
+            node = children[prefix[-1]]
+            self.nloaded += 1
+            self.cache.put(pagekey, node)
+        return node
+
+
+class _PagedChildren:
+    """
+    Read-only mapping of the children of a node at the page depth minus one: the keys are kept in memory,
+    the child nodes are loaded from the page store.
+    """
+    def __init__(self, store, prefix, keys):
+        self.store = store
+        self.prefix = prefix
+        self.keys_ = frozenset(keys)
+
+    def get(self, key, default=None):
+        if key not in self.keys_:
+            return default
+        return self.store.load(self.prefix + (key,))
+
+    def __getitem__(self, key):
+        if key not in self.keys_:
+            raise KeyError(key)
+        return self.store.load(self.prefix + (key,))
+
+    def __contains__(self, key):
+        return key in self.keys_
+
+    def __len__(self):
+        return len(self.keys_)
+
+    def __bool__(self):
+        return bool(self.keys_)
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def keys(self):
+        return self.keys_
+
+    def values(self):
+        return (self[key] for key in self.keys_)
+
+    def items(self):
+        return ((key, self[key]) for key in self.keys_)
+
+
+class DiskMatcher:
+    """
+    A read-only StringMatcher or TokenMatcher stored in an SQLite database, created with DiskMatcher.build.
+    The matcher should be closed with close() or used as a context manager.
+    """
+
+    def __init__(self, path, cachesize=1000, **matcherargs):
+        """
+        Open a matcher database created with DiskMatcher.build.
+        :param path: the database file
+        :param cachesize: maximum number of pages (subtrees) to keep in memory
+        :param matcherargs: keyword arguments for creating the matcher (ignorefunc, mapfunc, ...), ignorefunc,
+          mapfunc and bytesmode must be the same as used for building the database
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        meta = {name: pickle.loads(value) for name, value in self.conn.execute("SELECT name, value FROM meta")}
+        self.matchertype = meta["matcher"]
+        self.pagedepth = meta["pagedepth"]
+        tokens = self.matchertype == "token"
+        self.store = _PageStore(self.conn, cachesize, tokens)
+        self.matcher = MATCHERS[self.matchertype](**matcherargs)
+        # entries shorter than the page depth are held in memory
+        for entry, data in meta["short"]:
+            self.matcher.add(entry, data=data, append=meta["append"])
+        for prefix, keys in meta["index"].items():
+            children = _PagedChildren(self.store, prefix, keys)
+            if not prefix:
+                if tokens:
+                    self.matcher.nodes = children
+                else:
+                    self.matcher._root.children = children
+                continue
+            node = self._get_skeleton_node(prefix)
+            if tokens:
+                node.nodes = children
+            else:
+                node.children = children
+        self.matcher.maxdepth = meta["maxdepth"]
+        self.nentries = meta["nentries"]
+
+    def _get_skeleton_node(self, prefix):
+        """
+        Return the in-memory node for the prefix, creating the nodes on the path as needed.
+        """
+        if self.matchertype == "token":
+            node = self.matcher.nodes[prefix[0]]
+            for el in prefix[1:]:
+                if node.nodes is None:
+                    node.nodes = dict()
+                node = node.nodes.setdefault(el, type(node)())
+            return node
+        node = self.matcher._root
+        for el in prefix:
+            node = node.children.setdefault(el, _Node())
+        return node
+
+    @classmethod
+    def build(cls, path, entries, matcher="string", pagedepth=None, append=False, cachesize=1000, **matcherargs):
+        """
+        Create a matcher database from the entries and return the opened matcher. Only the entries of one page
+        are held in memory at a time, the entries are spooled to the database first.
+        :param path: the database file to create, must not exist
+        :param entries: iterable of (entry, data) tuples
+        :param matcher: "string" for a StringMatcher or "token" for a TokenMatcher
+        :param pagedepth: the number of elements of the prefix of the subtree stored in each page, if None
+          2 for strings and 1 for tokens
+        :param append: if True, add the data as with add(..., append=True)
+        :param cachesize: maximum number of pages to keep in memory when using the matcher
+        :param matcherargs: keyword arguments for creating the matcher (ignorefunc, mapfunc, ...)
+        :return: the DiskMatcher
+        """
+        if matcher not in MATCHERS:
+            raise ValueError(f"matcher must be one of {list(MATCHERS.keys())}")
+        for arg in ("radix", "prefilter", "datatable", "tokenclasses"):
+            if matcherargs.get(arg):
+                raise ValueError(f"{arg} is not supported by the DiskMatcher")
+        if pagedepth is None:
+            pagedepth = PAGEDEPTHS[matcher]
+        if pagedepth < 1:
+            raise ValueError("pagedepth must be at least 1")
+        matcherclass = MATCHERS[matcher]
+        template = matcherclass(**matcherargs)
+        tokens = matcher == "token"
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value BLOB)")
+            conn.execute("CREATE TABLE pages (pagekey TEXT PRIMARY KEY, data BLOB)")
+            conn.execute("CREATE TEMP TABLE entries (seq INTEGER PRIMARY KEY, pagekey TEXT, prefix BLOB, "
+                         "entry BLOB, data BLOB)")
+            short = []
+            maxdepth = 0
+            nentries = 0
+            rows = []
+            for entry, data in entries:
+                elements = entry_elements(template, entry)
+                if not elements:
+                    continue
+                nentries += 1
+                maxdepth = max(maxdepth, len(elements))
+                if len(elements) < pagedepth:
+                    short.append((entry, data))
+                    continue
+                prefix = elements[:pagedepth]
+                rows.append((repr(prefix), pickle.dumps(prefix), pickle.dumps(entry), pickle.dumps(data)))
+                if len(rows) >= 10000:
+                    conn.executemany("INSERT INTO entries (pagekey, prefix, entry, data) VALUES (?, ?, ?, ?)", rows)
+                    rows = []
+            conn.executemany("INSERT INTO entries (pagekey, prefix, entry, data) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("CREATE INDEX entries_pagekey ON entries (pagekey, seq)")
+            index = dict()
+            cursor = conn.execute("SELECT pagekey, prefix, entry, data FROM entries ORDER BY pagekey, seq")
+            pagerows = []
+            for pagekey, group in groupby(cursor, key=lambda row: row[0]):
+                prefix = None
+                page = matcherclass(**matcherargs)
+                for _, prefixdata, entry, data in group:
+                    prefix = pickle.loads(prefixdata)
+                    page.add(pickle.loads(entry), data=pickle.loads(data), append=append)
+                if tokens:
+                    nodes = page.nodes
+                    for el in prefix[:-1]:
+                        nodes = nodes[el].nodes
+                    node = nodes[prefix[-1]]
+                else:
+                    node = page._root
+                    for el in prefix:
+                        node = node.children[el]
+                index.setdefault(prefix[:-1], []).append(prefix[-1])
+                pagerows.append((pagekey, pickle.dumps(_flatten({prefix[-1]: node}, tokens),
+                                                       pickle.HIGHEST_PROTOCOL)))
+                if len(pagerows) >= 100:
+                    conn.executemany("INSERT INTO pages VALUES (?, ?)", pagerows)
+                    pagerows = []
+            conn.executemany("INSERT INTO pages VALUES (?, ?)", pagerows)
+            conn.execute("DROP TABLE entries")
+            meta = dict(matcher=matcher, pagedepth=pagedepth, index=index, short=short, append=append,
+                        maxdepth=maxdepth, nentries=nentries)
+            conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                             [(name, pickle.dumps(value)) for name, value in meta.items()])
+            conn.commit()
+        finally:
+            conn.close()
+        return cls(path, cachesize=cachesize, **matcherargs)
+
+    def find(self, *args, **kwargs):
+        """
+        Find gazetteer entries, see StringMatcher.find and TokenMatcher.find.
+        """
+        return self.matcher.find(*args, **kwargs)
+
+    def finditer(self, *args, **kwargs):
+        """
+        Generate the matches of gazetteer entries, see StringMatcher.finditer and TokenMatcher.finditer.
+        """
+        return self.matcher.finditer(*args, **kwargs)
+
+    def replace(self, *args, **kwargs):
+        """
+        Replace gazetteer entries, see StringMatcher.replace and TokenMatcher.replace.
+        """
+        return self.matcher.replace(*args, **kwargs)
+
+    def count(self, *args, **kwargs):
+        """
+        Count the matches, see StringMatcher.count and TokenMatcher.count.
+        """
+        return self.matcher.count(*args, **kwargs)
+
+    def contains_any(self, *args, **kwargs):
+        """
+        Check if there is any match, see StringMatcher.contains_any and TokenMatcher.contains_any.
+        """
+        return self.matcher.contains_any(*args, **kwargs)
+
+    def first(self, *args, **kwargs):
+        """
+        Return the first match, see StringMatcher.first and TokenMatcher.first.
+        """
+        return self.matcher.first(*args, **kwargs)
+
+    def cache_stats(self):
+        """
+        Return a dictionary mapping the name of each cache to its statistics: "pages" for the page cache
+        (with the additional field loaded, the number of pages read from the database) and the caches of
+        the matcher.
+        """
+        stats = self.matcher.cache_stats()
+        pages = self.store.cache.stats()
+        pages["loaded"] = self.store.nloaded
+        stats["pages"] = pages
+        return stats
+
+    def close(self):
+        """
+        Close the database.
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
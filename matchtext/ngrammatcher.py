@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+A TokenMatcher which finds entries by hashing the n-grams of the text with NumPy instead of walking the hash
+tree at every position. This is faster for gazetteers where the walks go deep and fail often, e.g. many
+entries with shared prefixes which rarely complete. Without NumPy, the tree walk of the TokenMatcher is used.
+
+Each mapped token of the entries gets an integer id. For each entry length L, the table for L maps the
+polynomial hash (modulo 2**64) of the token ids of the entries with L tokens to these entries. When finding,
+the hashes of all windows of L (not ignored) tokens of a slice of the text are computed with one vectorized
+multiply-add per window from the hashes for L-1 and looked up in the sorted hashes of the table for L, each
+hit is verified by comparing the token ids.
+
+The results are identical to those of a TokenMatcher with the same entries.
+"""
+import importlib.util
+from matchtext.tokenmatcher import TokenMatcher, PreparedTokens, Match, LazyMatch
+from matchtext.utils import thisorthat, interned_matchmaker
+
+_BASE = 1000003
+_MASK = (1 << 64) - 1
+
+# minimum number of tokens for using NumPy, for fewer tokens the overhead is bigger than the gain
+NUMPY_MIN_TOKENS = 512
+
+# number of start positions hashed at once: the matches of a slice are generated before the next slice is
+# hashed, so that e.g. first() and contains_any() stop early
+SLICE_STARTS = 8192
+
+
+class NgramMatcher(TokenMatcher):
+    """
+    A TokenMatcher which finds the entries with rolling hashes of the token n-grams if NumPy is installed.
+    All the methods of TokenMatcher can be used, finditer is replaced. Token classes are not supported.
+    """
+
+    def __init__(self, ignorefunc=None, mapfunc=None, matcherdata=None, defaultdata=None, tokencache=0,
+                 resultcache=0, resultcache_maxbytes=None, datatable=None, hitcounts=False, usenumpy=None):
+        """
+        Create an NgramMatcher. See TokenMatcher for the parameters.
+        :param usenumpy: if None, use NumPy if it is installed and the text has at least NUMPY_MIN_TOKENS tokens,
+          if True always use NumPy, if False never. Without NumPy, the tree walk of the TokenMatcher is used.
+        """
+        super().__init__(ignorefunc=ignorefunc, mapfunc=mapfunc, matcherdata=matcherdata, defaultdata=defaultdata,
+                         tokencache=tokencache, resultcache=resultcache, resultcache_maxbytes=resultcache_maxbytes,
+                         datatable=datatable, hitcounts=hitcounts)
+        self.usenumpy = usenumpy
+        # mapped token -> id, the ids start at 1, 0 is used for tokens which are not in any entry
+        self.tokenids = None
+        # entry length -> hash -> list of (tuple of token ids, node)
+        self.tables = None
+        # entry length -> sorted NumPy uint64 array of the hashes in the table, created when first needed
+        self.hasharrays = None
+
+    def add(self, entry, data=None, append=False, listdata=None):
+        """
+        Add a gazetteer entry, see TokenMatcher.add.
+        """
+        super().add(entry, data=data, append=append, listdata=listdata)
+        self.tokenids = None
+        self.tables = None
+        self.hasharrays = None
+
+    def _build_tables(self):
+        """
+        Create the token ids and hash tables from the entries of the hash tree.
+        """
+        tokenids = dict()
+        tables = dict()
+        for key, node in self._iter_entries():
+            ids = tuple(tokenids.setdefault(token, len(tokenids) + 1) for token in key)
+            h = 0
+            for tid in ids:
+                h = (h * _BASE + tid) & _MASK
+            tables.setdefault(len(ids), dict()).setdefault(h, []).append((ids, node))
+        self.tokenids = tokenids
+        self.tables = tables
+        self.hasharrays = None
+
+    def _build_hasharrays(self):
+        """
+        Create the sorted arrays of the hashes of each table for the vectorized lookup.
+        """
+        import numpy as np
+        self.hasharrays = {length: np.sort(np.fromiter(table.keys(), dtype=np.uint64, count=len(table)))
+                           for length, table in self.tables.items()}
+
+    def _window_keys(self, tokens, getter, fromidx, toidx, laststart):
+        """
+        Return the lists of positions and mapped tokens of the not ignored tokens from fromidx to toidx,
+        stopping once the tokens of the longest entry starting at laststart are included.
+        """
+        ignorefunc = self.ignorefunc
+        mapfunc = self.mapfunc
+        normalize = self._normalize if self.tokencache is not None else None
+        if isinstance(tokens, PreparedTokens):
+            self._check_prepared(tokens)
+            ignored = tokens.ignored
+            tokens = tokens.keys
+            getter = mapfunc = normalize = None
+            ignorefunc = ignored.__getitem__ if any(ignored) else None
+            usepos = True
+        else:
+            usepos = False
+        if not (getter or mapfunc or ignorefunc or normalize):
+            # every token is its own key, no need to look at the tokens one by one
+            end = min(toidx, laststart + self.maxdepth - 1) + 1
+            return range(fromidx, end), list(tokens[fromidx:end])
+        positions = []
+        keys = []
+        after = 0
+        maxafter = self.maxdepth - 1
+        for i in range(fromidx, toidx + 1):
+            if i > laststart:
+                if after >= maxafter:
+                    break
+            token = tokens[i]
+            if getter:
+                token = getter(token)
+            if normalize:
+                token, isignored = normalize(token)
+                if isignored:
+                    continue
+            else:
+                if mapfunc:
+                    token = mapfunc(token)
+                if ignorefunc and ignorefunc(i if usepos else token):
+                    continue
+            if i > laststart:
+                after += 1
+            positions.append(i)
+            keys.append(token)
+        return positions, keys
+
+    def _hits_numpy(self, ids, nstarts):
+        """
+        Return a dict mapping each start index into ids to the list of (length, node) of the entries found
+        there, in order of increasing length. Only the first nstarts indices are used as start indices.
+        """
+        import numpy as np
+        if self.hasharrays is None:
+            self._build_hasharrays()
+        hits = dict()
+        n = len(ids)
+        idarr = np.array(ids, dtype=np.uint64)
+        hashes = np.zeros(n, dtype=np.uint64)
+        base = np.uint64(_BASE)
+        for length in range(1, self.maxdepth + 1):
+            if length > n:
+                break
+            nwindows = n - length + 1
+            # uint64 arithmetic wraps around, which is the same as the modulo 2**64 of the Python hashes
+            hashes = hashes[:nwindows] * base + idarr[length - 1:]
+            keys = self.hasharrays.get(length)
+            if keys is None:
+                continue
+            table = self.tables[length]
+            starts = hashes[:min(nstarts, nwindows)]
+            # binary search of each window hash in the sorted hashes of the table
+            pos = np.searchsorted(keys, starts)
+            pos[pos == len(keys)] = 0
+            for k in np.nonzero(keys[pos] == starts)[0].tolist():
+                self._verify(hits, table[int(starts[k])], ids, k, length)
+        return hits
+
+    @staticmethod
+    def _verify(hits, candidates, ids, k, length):
+        window = tuple(ids[k:k + length])
+        for entryids, node in candidates:
+            if entryids == window:
+                hits.setdefault(k, []).append((length, node))
+                break
+
+    def finditer(self, tokens, all=False, skip=True, fromidx=None, toidx=None, getter=None, matchmaker=None,
+                 maxstart=None, budget=None):
+        """
+        Find gazetteer entries in a sequence of tokens and generate the matches, see TokenMatcher.finditer.
+        """
+        l = len(tokens)
+        if fromidx is None:
+            fromidx = 0
+        if toidx is None or toidx >= l:
+            toidx = l-1
+        usenumpy = self.usenumpy
+        if usenumpy is None:
+            usenumpy = toidx - fromidx + 1 >= NUMPY_MIN_TOKENS and _have_numpy()
+        if not usenumpy or (budget is not None and budget.max_walk_depth is not None):
+            # the walk depth is a property of the tree walk
+            yield from super().finditer(tokens, all=all, skip=skip, fromidx=fromidx, toidx=toidx, getter=getter,
+                                        matchmaker=matchmaker, maxstart=maxstart, budget=budget)
+            return
+        if fromidx > toidx or self.maxdepth == 0:
+            return
+        if self.datatable is not None:
+            matchmaker = interned_matchmaker(self.datatable, self.defaultdata, matchmaker, LazyMatch)
+        elif matchmaker is None:
+            matchmaker = Match
+        if self.tables is None:
+            self._build_tables()
+        defaultdata = self.defaultdata
+        matcherdata = self.matcherdata
+        hitcounts = self.hitcounts
+        getid = self.tokenids.get
+        laststart = toidx if maxstart is None else min(maxstart, toidx)
+        slicestart = fromidx
+        while slicestart <= laststart:
+            slicelast = min(slicestart + SLICE_STARTS - 1, laststart)
+            positions, keys = self._window_keys(tokens, getter, slicestart, toidx, slicelast)
+            nstarts = len(positions)
+            while nstarts and positions[nstarts - 1] > slicelast:
+                nstarts -= 1
+            hits = self._hits_numpy([getid(key, 0) for key in keys], nstarts)
+            nextstart = slicelast + 1
+            k = 0
+            while k < nstarts:
+                found = hits.get(k)
+                if found is None:
+                    k += 1
+                    continue
+                start = positions[k]
+                if all:
+                    for length, node in found:
+                        if hitcounts is not None:
+                            hitcounts[node] = hitcounts.get(node, 0) + 1
+                        yield matchmaker(start, positions[k + length - 1] + 1, keys[k:k + length],
+                                         thisorthat(node.data, defaultdata), matcherdata)
+                length, node = found[-1]
+                if not all:
+                    if hitcounts is not None:
+                        hitcounts[node] = hitcounts.get(node, 0) + 1
+                    yield matchmaker(start, positions[k + length - 1] + 1, keys[k:k + length],
+                                     thisorthat(node.data, defaultdata), matcherdata)
+                if skip:
+                    # the next slice starts after the longest match
+                    nextstart = max(nextstart, positions[k + length - 1] + 1)
+                    k += length
+                else:
+                    k += 1
+            slicestart = nextstart
+
+
+_HAVE_NUMPY = None
+
+
+def _have_numpy():
+    global _HAVE_NUMPY
+    if _HAVE_NUMPY is None:
+        _HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+    return _HAVE_NUMPY
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel construction of a StringMatcher or TokenMatcher from a large number of entries.
+
+The entries are partitioned by their first (mapped, not ignored) character or token. Since entries in different
+partitions never share a node below the root, each partition can be built by a separate worker process and
+the partial tries are merged by adding their root children to the root of the matcher. All entries with the
+same key end up in the same partition in their original order, so the result is the same as when adding the
+entries one by one, including the effect of append=True.
+
+The workers send back the partial tries in a flat form (labels, number of children and values in preorder),
+which is much cheaper to transfer than pickled nodes. Creating the nodes from that form still takes time in
+the main process, so the speedup is largest when adding entries is expensive, e.g. with a mapfunc or
+ignorefunc or with a DataTable.
+"""
+import os
+import zlib
+from array import array
+from collections import defaultdict
+from matchtext.stringmatcher import StringMatcher, _Node, _NOVALUE
+from matchtext.tokenmatcher import TokenMatcher, Node
+
+
+def _matcherargs(matcher):
+    """
+    Return the class and the constructor keyword arguments for building a partition of the matcher.
+    """
+    args = dict(ignorefunc=matcher.ignorefunc, mapfunc=matcher.mapfunc,
+                datatable=True if matcher.datatable is not None else None)
+    if isinstance(matcher, StringMatcher):
+        args.update(bytesmode=matcher.bytesmode, prefilter=matcher.prefilter, radix=matcher.radix)
+    elif not isinstance(matcher, TokenMatcher):
+        raise TypeError("Only StringMatcher and TokenMatcher can be built in parallel")
+    elif matcher.tokenclasses:
+        raise ValueError("A TokenMatcher with token classes cannot be built in parallel")
+    return type(matcher), args
+
+
+def first_element(matcher, entry):
+    """
+    Return the first mapped and not ignored element of the entry, as used as key in the root of the matcher,
+    or None if there is none.
+    :param matcher: a StringMatcher or TokenMatcher
+    :param entry: the entry
+    :return: the first element or None
+    """
+    mapfunc = matcher.mapfunc
+    ignorefunc = matcher.ignorefunc
+    if isinstance(matcher, TokenMatcher):
+        if isinstance(entry, str):
+            entry = [entry]
+        for el in entry:
+            if mapfunc:
+                el = mapfunc(el)
+            if ignorefunc and ignorefunc(el):
+                continue
+            return el
+        return None
+    if matcher.bytesmode and isinstance(entry, str):
+        entry = entry.encode("utf-8")
+    for el in entry:
+        if ignorefunc and ignorefunc(el):
+            continue
+        if mapfunc:
+            el = mapfunc(el)
+        return el
+    return None
+
+
+def entry_elements(matcher, entry):
+    """
+    Return the tuple of all mapped and not ignored elements of the entry, as used as keys along the path to
+    the node of the entry in the matcher.
+    :param matcher: a StringMatcher or TokenMatcher
+    :param entry: the entry
+    :return: tuple of elements
+    """
+    mapfunc = matcher.mapfunc
+    ignorefunc = matcher.ignorefunc
+    elements = []
+    if isinstance(matcher, TokenMatcher):
+        if isinstance(entry, str):
+            entry = [entry]
+        for el in entry:
+            if mapfunc:
+                el = mapfunc(el)
+            if ignorefunc and ignorefunc(el):
+                continue
+            elements.append(el)
+        return tuple(elements)
+    if matcher.bytesmode and isinstance(entry, str):
+        entry = entry.encode("utf-8")
+    for el in entry:
+        if ignorefunc and ignorefunc(el):
+            continue
+        if mapfunc:
+            el = mapfunc(el)
+        elements.append(el)
+    return tuple(elements)
+
+
+def _partition4key(key, npartitions):
+    if isinstance(key, str):
+        key = key.encode("utf-8", "surrogatepass")
+    elif isinstance(key, int):
+        key = key.to_bytes(8, "little", signed=True)
+    else:
+        key = repr(key).encode("utf-8")
+    return zlib.crc32(key) % npartitions
+
+
+# the matcher configuration used by the functions that run in a worker process
+_config = None
+
+
+def _init_worker(config):
+    global _config
+    _config = config
+
+
+def _build_partition(entries):
+    """
+    Build the matcher for one partition and return the flattened trie, maxdepth, prefilter sets and
+    data table items. Runs in a worker process.
+    """
+    matcherclass, matcherargs, append = _config
+    matcher = matcherclass(**matcherargs)
+    for entry, data in entries:
+        matcher.add(entry, data=data, append=append)
+    items = matcher.datatable.items if matcher.datatable is not None else None
+    if isinstance(matcher, StringMatcher):
+        return _flatten(matcher._root.children, False), matcher.maxdepth, matcher._bigrams, matcher._singles, items
+    return _flatten(matcher.nodes, True), matcher.maxdepth, None, None, items
+
+
+def _flatten(children, tokens):
+    """
+    Return a compact representation of the nodes below the given root children: the lists of labels,
+    number of children, values and (for a StringMatcher) radix segments of all nodes in preorder. This is much
+    faster to pickle and unpickle than the nodes themselves.
+    """
+    labels = []
+    counts = array("l")
+    values = []
+    segments = []
+    stack = list(reversed(list(children.items())))
+    while stack:
+        el, node = stack.pop()
+        labels.append(el)
+        if tokens:
+            kids = node.nodes or {}
+            values.append(node.data if node.is_match else _NOVALUE)
+        else:
+            kids = node.children
+            values.append(node.value)
+            segments.append(node.segment)
+        counts.append(len(kids))
+        if kids:
+            stack.extend(reversed(list(kids.items())))
+    return labels, counts, values, segments
+
+
+def _unflatten(flat, children, tokens):
+    """
+    Add the nodes of a flattened trie to the given root children.
+    """
+    labels, counts, values, segments = flat
+    segments = iter(segments)
+    # stack of (children dict, number of children still to add to it)
+    stack = []
+    kids = children
+    remaining = -1
+    for el, n, value in zip(labels, counts, values):
+        if tokens:
+            node = Node() if value is _NOVALUE else Node(True, value)
+        else:
+            node = _Node()
+            node.value = value
+            node.segment = next(segments)
+        kids[el] = node
+        remaining -= 1
+        if n:
+            if remaining:
+                stack.append((kids, remaining))
+            if tokens:
+                kids = node.nodes = defaultdict(Node)
+            else:
+                kids = node.children
+            remaining = n
+        elif not remaining and stack:
+            kids, remaining = stack.pop()
+
+
+def _remap(ref, handlemap):
+    if isinstance(ref, int):
+        return handlemap[ref]
+    return array("l", (handlemap[h] for h in ref))
+
+
+def _merge_partition(matcher, result):
+    flat, maxdepth, bigrams, singles, items = result
+    if matcher.datatable is not None and items:
+        handlemap = [matcher.datatable.intern(item) for item in items]
+        labels, counts, values, segments = flat
+        values = [value if value is _NOVALUE else _remap(value, handlemap) for value in values]
+        flat = labels, counts, values, segments
+    if isinstance(matcher, StringMatcher):
+        _unflatten(flat, matcher._root.children, False)
+        matcher._bigrams.update(bigrams)
+        matcher._singles.update(singles)
+        matcher._prefilter_regex = None
+    else:
+        _unflatten(flat, matcher.nodes, True)
+    if maxdepth > matcher.maxdepth:
+        matcher.maxdepth = maxdepth
+
+
+def build_parallel(matcher, entries, append=False, processes=None, npartitions=None, mp_context=None):
+    """
+    Add the entries to an empty StringMatcher or TokenMatcher, building parts of the trie in parallel in
+    several worker processes. The result is the same as adding the entries one by one with matcher.add.
+
+    The matcher's mapfunc and ignorefunc and the entry data must be picklable when the "spawn" start method
+    is used. If the matcher uses a DataTable, the data of all partitions gets interned into that table.
+
+    :param matcher: an empty StringMatcher or TokenMatcher, configured as needed
+    :param entries: iterable of (entry, data) tuples, where entry is a single entry (a string for a
+      StringMatcher, a string or list of tokens for a TokenMatcher)
+    :param append: if True, add the data as with add(..., append=True)
+    :param processes: number of worker processes, if None the number of CPUs, if 1 build in the
+      current process
+    :param npartitions: number of partitions to split the entries into, if None four times the number of
+      processes so that partitions with many entries do not leave other workers idle
+    :param mp_context: the multiprocessing context to use, if None the default context
+    :return: the matcher
+    """
+    matcherclass, matcherargs = _matcherargs(matcher)
+    if (matcher._root.children if isinstance(matcher, StringMatcher) else matcher.nodes):
+        raise ValueError("The matcher must be empty")
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if npartitions is None:
+        npartitions = 4 * processes
+    partitions = [[] for _ in range(npartitions)]
+    for entry, data in entries:
+        key = first_element(matcher, entry)
+        if key is None:
+            continue
+        partitions[_partition4key(key, npartitions)].append((entry, data))
+    partitions = [part for part in partitions if part]
+    config = (matcherclass, matcherargs, append)
+    if matcher.resultcache is not None:
+        matcher.resultcache.clear()
+    if processes <= 1 or len(partitions) <= 1:
+        _init_worker(config)
+        for part in partitions:
+            _merge_partition(matcher, _build_partition(part))
+        return matcher
+    import multiprocessing
+    context = mp_context if mp_context is not None else multiprocessing.get_context()
+    with context.Pool(min(processes, len(partitions)), initializer=_init_worker, initargs=(config,)) as pool:
+        for result in pool.imap_unordered(_build_partition, partitions):
+            _merge_partition(matcher, result)
+    return matcher
@@ -7,6 +7,12 @@ import os
 import logging
 import datetime
 import time
+import math
+import json
+import threading
+import functools
+import contextlib
+from collections import deque
 
 logger = None
 start = 0
@@ -25,7 +31,9 @@ def set_logger(args=None, name=None, file=None):
     if name is None:
         name = sys.argv[0]
     if logger:
-        raise Exception("Odd, we should not have a logger yet?")
+        # already set up, e.g. by a library function or an earlier call: keep using that logger
+        logger.debug("Logger already set up, ignoring set_logger call")
+        return logger
     logger = logging.getLogger(name)
     if args and hasattr(args, "d") and args.d:
         lvl = logging.DEBUG
@@ -43,9 +51,9 @@ def set_logger(args=None, name=None, file=None):
         dt = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         file = os.path.join(args.outdir,f"{dt}.log")
     if file:
-        hdnlr = logging.FileHandler(file)
-        hndlr.setFormatter(fmt)
-        logger.addHandler(hdnlr)
+        fhndlr = logging.FileHandler(file)
+        fhndlr.setFormatter(fmt)
+        logger.addHandler(fhndlr)
     logger.info("Started: {}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M%S")))
     if args:
         logger.info("Arguments: {}".format(args))
@@ -72,17 +80,21 @@ def run_start():
     start = time.time()
     return start
 
-def run_stop():
+def run_stop(starttime=None):
     """
     Log and return formatted elapsed run time.
+    :param starttime: if not None, the time returned by run_start() to use instead of the time of the most
+       recent run_start() call. This allows several nested or concurrent timings.
     :return: tuple of formatted run time, run time in seconds
     """
     logger = ensurelogger()
-    if start == 0:
+    if starttime is None:
+        starttime = start
+    if starttime == 0:
         logger.warning("Run timing not set up properly, no time!")
         return "",0
     stop = time.time()
-    delta = stop - start
+    delta = stop - starttime
     deltastr = str(datetime.timedelta(seconds=delta))
     logger.info(f"Runtime: {deltastr}")
     return deltastr, delta
@@ -102,3 +114,278 @@ def file4logger(thelogger, noext=False):
             break
     return lpath
 
+
+def _percentile(sortedvalues, pct):
+    """
+    Return the percentile pct (0..100) of the sorted list of values, using the nearest rank method.
+    """
+    if not sortedvalues:
+        return None
+    idx = max(0, min(len(sortedvalues) - 1, math.ceil(pct / 100.0 * len(sortedvalues)) - 1))
+    return sortedvalues[idx]
+
+
+# guards the tracemem state below, the stages of all StageTimers and threads share tracemalloc
+_tracemem_lock = threading.Lock()
+# for each active tracemem stage, a list with the highest peak seen before another stage reset the peak
+_tracemem_peaks = []
+# True if tracemalloc was started for the active tracemem stages and has to be stopped after the last one
+_tracemem_started = False
+
+
+def _tracemem_begin():
+    """
+    Start tracing memory for a tracemem stage, return the traced memory at the start and the list for the
+    carried peak of the stage.
+    """
+    global _tracemem_started
+    import tracemalloc
+    with _tracemem_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemem_started = True
+        memstart, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, "reset_peak"):
+            # the reset also loses the peak of the other active tracemem stages, keep it for them
+            for carried in _tracemem_peaks:
+                carried[0] = max(carried[0], peak)
+            tracemalloc.reset_peak()
+        carried = [0]
+        _tracemem_peaks.append(carried)
+    return memstart, carried
+
+
+def _tracemem_end(carried):
+    """
+    End tracing memory for a tracemem stage, return the traced memory at the end and the peak during the stage.
+    tracemalloc is stopped once the last stage ends if it was started by _tracemem_begin.
+    """
+    global _tracemem_started
+    import tracemalloc
+    with _tracemem_lock:
+        memend, mempeak = tracemalloc.get_traced_memory()
+        for idx, other in enumerate(_tracemem_peaks):
+            if other is carried:
+                del _tracemem_peaks[idx]
+                break
+        if not _tracemem_peaks and _tracemem_started:
+            tracemalloc.stop()
+            _tracemem_started = False
+    return memend, max(mempeak, carried[0])
+
+
+class _StageStats:
+    """
+    Aggregated timings for one named stage.
+    """
+    __slots__ = ("count", "total", "min", "max", "samples", "profile", "mem_peak", "mem_diff")
+
+    def __init__(self, maxsamples):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=maxsamples)
+        self.profile = None
+        self.mem_peak = None
+        self.mem_diff = None
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        self.samples.append(seconds)
+
+    def to_dict(self):
+        values = sorted(self.samples)
+        ret = dict(
+            count=self.count,
+            total=self.total,
+            mean=self.total / self.count if self.count else None,
+            min=self.min,
+            max=self.max,
+            p50=_percentile(values, 50),
+            p99=_percentile(values, 99),
+        )
+        if self.mem_peak is not None:
+            ret["mem_peak"] = self.mem_peak
+            ret["mem_diff"] = self.mem_diff
+        return ret
+
+
+class StageTimer:
+    """
+    Thread-safe and reentrant timing of named stages. Each stage aggregates the number of runs, the total
+    time and the p50/p99 latency of the most recent maxsamples runs. Stages can be nested and can be
+    used from several threads at the same time, each use keeps its own start time.
+
+    Example:
+    ```
+    timer = StageTimer()
+    with timer.stage("build"):
+        matcher.add(entries)
+    @timer.timed("find")
+    def annotate(doc):
+        return matcher.find(doc)
+    print(timer.to_json())
+    ```
+    """
+
+    def __init__(self, maxsamples=10000):
+        """
+        Create a stage timer.
+        :param maxsamples: maximum number of most recent durations to keep per stage for the percentiles
+        """
+        self.maxsamples = maxsamples
+        self._stages = dict()
+        self._lock = threading.Lock()
+
+    def _get_stats(self, name):
+        stats = self._stages.get(name)
+        if stats is None:
+            stats = self._stages.setdefault(name, _StageStats(self.maxsamples))
+        return stats
+
+    def add(self, name, seconds):
+        """
+        Add a duration for the named stage.
+        :param name: stage name
+        :param seconds: duration in seconds
+        :return:
+        """
+        with self._lock:
+            self._get_stats(name).add(seconds)
+
+    @contextlib.contextmanager
+    def stage(self, name, profile=False, tracemem=False):
+        """
+        Context manager that times the enclosed block as one run of the named stage.
+
+        If profile is True, the block is run under cProfile and the profile is accumulated for the stage,
+        see profile_stats(). Note that only one profiler can be active at any time, so profiled stages
+        should not be nested or run concurrently.
+        If tracemem is True, tracemalloc is used to record the peak memory and the memory difference
+        of the block (if it is not already tracing, tracemalloc is started by the first active tracemem stage
+        and stopped when the last one ends). tracemalloc traces the whole process, so the numbers also include
+        the allocations of blocks running concurrently in other threads.
+
+        :param name: stage name
+        :param profile: if True, profile the block with cProfile
+        :param tracemem: if True, record memory usage of the block with tracemalloc
+        :return: context manager
+        """
+        profiler = None
+        if tracemem:
+            memstart, carried = _tracemem_begin()
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        starttime = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - starttime
+            if profiler is not None:
+                profiler.disable()
+            if tracemem:
+                memend, mempeak = _tracemem_end(carried)
+            with self._lock:
+                stats = self._get_stats(name)
+                stats.add(elapsed)
+                if profiler is not None:
+                    import pstats
+                    if stats.profile is None:
+                        stats.profile = pstats.Stats(profiler)
+                    else:
+                        stats.profile.add(profiler)
+                if tracemem:
+                    stats.mem_peak = max(mempeak - memstart, stats.mem_peak or 0)
+                    stats.mem_diff = memend - memstart
+
+    def timed(self, name=None, profile=False, tracemem=False):
+        """
+        Decorator that times each call of the decorated function as a run of the named stage.
+        :param name: stage name, if None, the qualified name of the function is used
+        :param profile: if True, profile each call, see stage()
+        :param tracemem: if True, record memory usage for each call, see stage()
+        :return: decorator
+        """
+        def decorator(func):
+            stagename = name if name is not None else func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stagename, profile=profile, tracemem=tracemem):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self, name=None):
+        """
+        Return the aggregated statistics for a stage or for all stages.
+        :param name: stage name, if None return a dictionary mapping all stage names to their statistics
+        :return: dictionary with keys count, total, mean, min, max, p50, p99 and if memory was traced,
+           mem_peak and mem_diff (bytes)
+        """
+        with self._lock:
+            if name is not None:
+                return self._stages[name].to_dict()
+            return {n: s.to_dict() for n, s in self._stages.items()}
+
+    def profile_stats(self, name):
+        """
+        Return the accumulated pstats.Stats instance for the stage or None if the stage was never profiled.
+        :param name: stage name
+        :return: pstats.Stats or None
+        """
+        with self._lock:
+            return self._stages[name].profile
+
+    def reset(self):
+        """
+        Remove all stages and their statistics.
+        """
+        with self._lock:
+            self._stages = dict()
+
+    def to_json(self, **kwargs):
+        """
+        Return the statistics for all stages as a JSON string.
+        :param kwargs: passed on to json.dumps
+        :return: JSON string
+        """
+        return json.dumps(self.stats(), **kwargs)
+
+    def log(self, thelogger=None):
+        """
+        Log the statistics of all stages.
+        :param thelogger: logger to use, if None, the module logger
+        :return:
+        """
+        if thelogger is None:
+            thelogger = ensurelogger()
+        for name, st in self.stats().items():
+            thelogger.info(f"Stage {name}: count={st['count']} total={st['total']:.6f}s "
+                           f"p50={st['p50']:.6f}s p99={st['p99']:.6f}s")
+
+
+# the default stage timer used by the module level stage() and timed() functions
+timer = StageTimer()
+
+
+def stage(name, profile=False, tracemem=False):
+    """
+    Time a block as a run of the named stage of the default timer, see StageTimer.stage()
+    """
+    return timer.stage(name, profile=profile, tracemem=tracemem)
+
+
+def timed(name=None, profile=False, tracemem=False):
+    """
+    Decorator to time a function as a run of the named stage of the default timer, see StageTimer.timed()
+    """
+    return timer.timed(name=name, profile=profile, tracemem=tracemem)
@@ -2,10 +2,15 @@
 """
 Match strings by character: match entries character by character, optionally only at word boundaries at
 the start and/or the end of an entry.
+
+In bytes mode, entries are stored as UTF-8 byte sequences and matching is done directly on bytes-like objects
+(bytes, bytearray, memoryview, mmap) without decoding them. The offsets of the matches are then byte offsets,
+which can be converted to character offsets with utf8_char_offsets() or StringMatcher.to_char_offsets().
 """
 import sys
-from .utils import thisorthat
-from matchtext.runutils import ensurelogger, set_logger
+from .utils import thisorthat, resolve_overlaps, RESOLVE_LEFTMOST_LONGEST, LRUCache, content_key, cached, DataTable, \
+    interned_matchmaker, deep_sizeof, async_finditer, async_find, refind_matches, \
+    count_matches, _nomatch, Budget, MatchList, BUDGETS, collect_matches, moved_match
 from dataclasses import dataclass
 
 @dataclass(unsafe_hash=True, order=True)
@@ -18,23 +23,97 @@ class Match:
     matcherdata: object
 
 
-_NOVALUE = object()
+class LazyMatch(Match):
+    """
+    A Match where the entry data is only looked up in the data table of the matcher when it is accessed.
+    """
+    __slots__ = ("_ref", "_table", "_default")
+
+    def __init__(self, start, end, match, ref, matcherdata, table, default=None):
+        self.start = start
+        self.end = end
+        self.match = match
+        self.matcherdata = matcherdata
+        self._ref = ref
+        self._table = table
+        self._default = default
+
+    @property
+    def entrydata(self):
+        return thisorthat(self._table.resolve(self._ref), self._default)
+
+    def __copy__(self):
+        return type(self)(self.start, self.end, self.match, self._ref, self.matcherdata, self._table, self._default)
+
+    def __eq__(self, other):
+        # equal to a Match or LazyMatch with the same fields, so that the results of interned and plain
+        # matchers can be compared
+        if not isinstance(other, Match):
+            return NotImplemented
+        return (self.start, self.end, self.match, self.entrydata, self.matcherdata) == \
+            (other.start, other.end, other.match, other.entrydata, other.matcherdata)
+
+    __hash__ = Match.__hash__
+
+
+class _NoValue:
+    """
+    Type of the marker for nodes without a value. Pickles as a reference to the module level instance, so
+    that it is still recognized in unpickled matchers.
+    """
+    __slots__ = ()
+
+    def __reduce__(self):
+        return "_NOVALUE"
+
+    def __repr__(self):
+        return "_NOVALUE"
+
+
+_NOVALUE = _NoValue()
+
+# all UTF-8 continuation bytes, deleting them from a UTF-8 byte sequence leaves one byte per character
+_UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+
+
+def utf8_char_offsets(data, offsets):
+    """
+    Convert byte offsets into a UTF-8 encoded bytes-like object to character offsets without decoding.
+    Only the data up to the biggest offset is looked at, each part between two offsets only once.
+    :param data: bytes-like object (bytes, memoryview, mmap, ...) containing valid UTF-8
+    :param offsets: iterable of byte offsets, in any order
+    :return: list of character offsets, in the same order as the byte offsets
+    """
+    offsets = list(offsets)
+    ret = [0] * len(offsets)
+    lastbyte = 0
+    lastchar = 0
+    for idx in sorted(range(len(offsets)), key=offsets.__getitem__):
+        offset = offsets[idx]
+        if offset > lastbyte:
+            lastchar += len(bytes(data[lastbyte:offset]).translate(None, _UTF8_CONTINUATION))
+            lastbyte = offset
+        ret[idx] = lastchar
+    return ret
 
 
 class _Node:
     """
-    Trie Node: represents the value and the children.
+    Trie Node: represents the value and the children. In a radix trie, segment holds the elements (a str,
+    bytes or tuple) which follow the element of the edge leading to the node, so that a chain of nodes with a
+    single child is stored as one node.
     """
-    __slots__ = ("children", "value")
+    __slots__ = ("children", "value", "segment")
 
     def __init__(self):
         self.children = dict()
         self.value = _NOVALUE
+        self.segment = ""
 
     # Will get removed or replaced with a proper pretty-printer!
     def debug_print_node(self, file=sys.stderr):
-        if self.value == _NOVALUE:
-            print(f"Node(val=,children=[", end="", file=file)
+        if self.value is _NOVALUE:
+            print("Node(val=,children=[", end="", file=file)
         else:
             print(f"Node(val={self.value},children=[",end="", file=file)
         for c, n in self.children.items():
@@ -45,13 +124,33 @@ class _Node:
 
 class StringMatcher:
 
-    def __init__(self, ignorefunc=None, mapfunc=None, matcherdata=None, defaultdata=None):
+    def __init__(self, ignorefunc=None, mapfunc=None, matcherdata=None, defaultdata=None,
+                 resultcache=0, resultcache_maxbytes=None, datatable=None, bytesmode=False, prefilter=False,
+                 hitcounts=False, radix=False):
         """
-        Create a TokenMatcher.
+        Create a StringMatcher.
         :param ignorefunc: a predicate that returns True for any token that should be ignored.
         :param mapfunc: a function that returns the string to use for each token.
         :param matcherdata: data to add to all matches in the matcherdata field
         :param defaultdata: data to add to matches when the entry data is None
+        :param resultcache: if > 0, the maximum number of find/replace results to cache, keyed by a digest
+          of the text and the parameters of the call. The cache is cleared whenever the matcher is modified.
+          Each call gets its own copy of the cached matches.
+        :param resultcache_maxbytes: if not None, also limit the result cache to approximately that many bytes
+        :param datatable: if True, store the entry data deduplicated in a new DataTable, if a DataTable, store
+          the entry data in that (possibly shared) table. The trie nodes then only hold integer handles and
+          the entry data of the matches is looked up when it is accessed.
+        :param bytesmode: if True, entries are stored as UTF-8 bytes and find/replace expect bytes-like objects.
+          In that case ignorefunc and mapfunc get called with the integer byte values. The match field of
+          a match is a slice of the object passed to find (e.g. a memoryview for a memoryview).
+        :param prefilter: if True, keep the set of the first two characters of all entries. If there is no
+          mapfunc and ignorefunc, find then uses a regular expression built from these to jump directly to the
+          next position where a match can start instead of checking every position in Python.
+        :param hitcounts: if True, count for each entry how often it was returned in a match by find,
+          see hit_counts(). Results taken from the result cache are counted as well.
+        :param radix: if True, store chains of nodes with only one child as a single node with a segment of
+          elements, which saves memory for long entries and compares the segment at once when finding
+          if there is no mapfunc and ignorefunc.
         """
         # TODO: need to figure out how to handle word boundaries
         # TODO: need to figure out how to handle matching spaces vs. different spaces / no spaces!
@@ -61,6 +160,20 @@ class StringMatcher:
         self.defaultdata = defaultdata
         self.matcherdata = matcherdata
         self._root = _Node()
+        self.datatable = DataTable() if datatable is True else datatable
+        self.resultcache = LRUCache(resultcache, resultcache_maxbytes) if resultcache > 0 else None
+        self.bytesmode = bytesmode
+        # maximum number of (mapped, not ignored) characters of an entry
+        self.maxdepth = 0
+        self.prefilter = prefilter
+        self._bigrams = dict()  # first character -> set of second characters
+        self._singles = set()   # entries of length one
+        self._prefilter_regex = None
+        # node -> number of matches returned for the entry of the node
+        self.hitcounts = dict() if hitcounts else None
+        self.radix = radix
+        # how often find stopped early or cut walks short because of each budget
+        self.budgets_exceeded = dict.fromkeys(BUDGETS, 0)
 
     def add(self, entry, data=None, listdata=None, append=False):
         """
@@ -78,14 +191,27 @@ class StringMatcher:
         :param append: if true and data is not None, store data in a list and append any new data
         :return:
         """
-        if isinstance(entry, str):
+        if self.resultcache is not None:
+            self.resultcache.clear()
+        if isinstance(entry, (str, bytes)):
             entry = [entry]
+        table = self.datatable
+        if table is not None:
+            data = table.intern(data)
         for e in entry:
             node = self._get_node(e, create=True)
             if node == self._root:
                 # empty string not allowed
                 continue
-            if node.value == _NOVALUE:
+            if table is not None:
+                if append:
+                    if node.value is _NOVALUE:
+                        node.value = table.new_list(data)
+                    else:
+                        node.value.append(data)
+                else:
+                    node.value = data
+            elif node.value is _NOVALUE:
                 if append:
                     node.value = [data]
                 else:
@@ -96,100 +222,363 @@ class StringMatcher:
                 else:
                     node.value = data
 
-    def find(self, text, all=False, skip=True, fromidx=None, toidx=None, matchmaker=None):
+    def finditer(self, text, all=False, skip=True, fromidx=None, toidx=None, matchmaker=None, maxstart=None,
+                 budget=None):
         """
-        Find gazetteer entries in text.
-        ignored.
+        Find gazetteer entries in text and generate the matches in order of their start offset (and
+        for the same start offset, in order of increasing length).
         :param text: string to search
         :param all: return all matches, if False only return longest match
         :param skip: skip forward over longest match (do not return contained/overlapping matches)
-        :param fromidx: index where to start finding in tokens
-        :param toidx: index where to stop finding in tokens (this is the last index actually used)
-        :return: an iterable of Match. The start/end fields of each Match are the character offsets if
-        text is a string, otherwise are the token offsets.
-        """
-        logger = ensurelogger()
-        logger.debug("CALL")
-        matches = []
+        :param fromidx: index where to start finding in text
+        :param toidx: index where to stop finding in text (this is the last index actually used)
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :param maxstart: if not None, the last index where a match can start, the match can still extend up to
+          toidx
+        :param budget: if not None, a utils.Budget limiting the number of characters examined for the matches at
+          each start position, "max_walk_depth" is added to budget.exceeded if a walk was cut short
+        :return: a generator of Match. The start/end fields of each Match are the character offsets of the
+        match in the text (byte offsets in bytes mode).
+        """
+        if self.bytesmode and isinstance(text, str):
+            raise TypeError("A StringMatcher in bytes mode needs a bytes-like object to search")
         l = len(text)
         if fromidx is None:
             fromidx = 0
-        if toidx is None:
-            toidx = l-1
-        if fromidx >= l:
-            return matches
-        if toidx >= l:
+        if toidx is None or toidx >= l:
             toidx = l-1
         if fromidx > toidx:
-            return matches
+            return
+        if self.datatable is not None:
+            matchmaker = interned_matchmaker(self.datatable, self.defaultdata, matchmaker, LazyMatch)
+        elif matchmaker is None:
+            matchmaker = Match
+        ignorefunc = self.ignorefunc
+        mapfunc = self.mapfunc
+        defaultdata = self.defaultdata
+        matcherdata = self.matcherdata
+        rootchildren = self._root.children
+        hitcounts = self.hitcounts
+        # segments of radix nodes can be compared directly with the text if the text elements are used as is
+        fastsegments = not (ignorefunc or mapfunc)
+        endidx = toidx + 1
+        startend = endidx if maxstart is None else min(maxstart + 1, endidx)
+        maxwalk = budget.max_walk_depth if budget is not None else None
+        walkend = endidx
         i = fromidx
-        logger.debug(f"From index {i} to index {toidx} for {text}")
-        while i < toidx:
+        search = None
+        if self.prefilter and not ignorefunc and not mapfunc and isinstance(text, str):
+            regex = self._get_prefilter_regex()
+            if regex is None:
+                return
+            search = regex.search
+        while i < startend:
             chr = text[i]
-            if self.ignorefunc and self.ignorefunc(chr):
+            if ignorefunc and ignorefunc(chr):
                 i += 1
                 continue
-            if self.mapfunc:
-                chr = self.mapfunc(chr)
-            longest_len = 0
-            longest_match = None
-            node = self._root
-            node = node.children.get(chr)
-            k = 0
-            while node is not None:
-                if node.value != _NOVALUE:
+            if mapfunc:
+                chr = mapfunc(chr)
+            node = rootchildren.get(chr)
+            if node is None:
+                if search is not None:
+                    # jump to the next position where a match can start
+                    candidate = search(text, i + 1, endidx)
+                    if candidate is None:
+                        return
+                    i = candidate.start()
+                else:
+                    i += 1
+                continue
+            longest_end = 0
+            longest_node = None
+            k = i
+            if maxwalk is not None:
+                walkend = min(endidx, i + maxwalk)
+            while True:
+                if node.segment:
+                    segstart = k
+                    k = self._match_segment(node.segment, text, k, walkend, fastsegments)
+                    if k < 0:
+                        if walkend < endidx and segstart + len(node.segment) >= walkend:
+                            budget.exceeded.add("max_walk_depth")
+                        break
+                if node.value is not _NOVALUE:
                     # we found a match
-                    cur_len = k+1
-                    if matchmaker:
-                        match = matchmaker(i, i + k + 1, text[i:i+k+1], thisorthat(node.value, self.defaultdata), self.matcherdata)
-                    else:
-                        match = Match(i, i + k + 1, text[i:i+k+1], thisorthat(node.value, self.defaultdata), self.matcherdata)
                     if all:
-                        matches.append(match)
+                        if hitcounts is not None:
+                            hitcounts[node] = hitcounts.get(node, 0) + 1
+                        yield matchmaker(i, k + 1, text[i:k+1], thisorthat(node.value, defaultdata), matcherdata)
                     else:
                         # NOTE: only one longest match is possible, but it can have a list of data if append=True
-                        if cur_len > longest_len:
-                            longest_len = cur_len
-                            longest_match = match
-                while True:
-                    k += 1
-                    if i+k >= len(text):
-                        break
-                    chr = text[i+k]
-                    if self.ignorefunc and self.ignorefunc(chr):
-                        continue
-                    if self.mapfunc:
-                        chr = self.mapfunc(chr)
-                    node = node.children.get(chr)
+                        longest_node = node
+                    longest_end = k + 1
+                if not node.children:
+                    break
+                k += 1
+                if ignorefunc:
+                    while k < walkend and ignorefunc(text[k]):
+                        k += 1
+                if k >= walkend:
+                    if walkend < endidx:
+                        budget.exceeded.add("max_walk_depth")
                     break
-                if i+k >= len(text):
+                chr = text[k]
+                if mapfunc:
+                    chr = mapfunc(chr)
+                node = node.children.get(chr)
+                if node is None:
                     break
-            if not all and longest_match is not None:
-                matches.append(longest_match)
-            if skip:
-                i += max(k,1)
+            if longest_node is not None:
+                if hitcounts is not None:
+                    hitcounts[longest_node] = hitcounts.get(longest_node, 0) + 1
+                yield matchmaker(i, longest_end, text[i:longest_end], thisorthat(longest_node.value, defaultdata),
+                                 matcherdata)
+            if skip and longest_end:
+                i = longest_end
             else:
                 i += 1
+
+    def find(self, text, all=False, skip=True, fromidx=None, toidx=None, matchmaker=None,
+             resolve=None, priority=None, max_matches=None, max_walk_depth=None, deadline=None):
+        """
+        Find gazetteer entries in text.
+        :param text: string to search, or bytes-like object in bytes mode
+        :param all: return all matches, if False only return longest match
+        :param skip: skip forward over longest match (do not return contained/overlapping matches)
+        :param fromidx: index where to start finding in text
+        :param toidx: index where to stop finding in text (this is the last index actually used)
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :param resolve: if not None, the strategy to use for returning only non-overlapping matches, one of
+          "leftmost-longest", "longest", "priority" (see utils.resolve_overlaps). If specified, the parameters
+          all and skip are ignored. The objects created by the matchmaker must have start, end and entrydata
+          attributes.
+        :param priority: function that returns the priority for the entry data of a match for the
+          "priority" strategy
+        :param max_matches: if not None, stop after finding that many matches (before resolving overlaps)
+        :param max_walk_depth: if not None, examine at most that many characters for the matches at each
+          start position, so longer entries are not found
+        :param deadline: if not None, the time.monotonic() time after which to stop finding
+        :return: a list of Match. The start/end fields of each Match are the character offsets of the match
+        in the text (byte offsets in bytes mode). If any of max_matches, max_walk_depth, deadline is given,
+        a utils.MatchList whose partial attribute is True if the result is incomplete because of them.
+        """
+        if max_matches is not None or max_walk_depth is not None or deadline is not None:
+            return self._find_budgeted(text, all, skip, fromidx, toidx, matchmaker, resolve, priority,
+                                       max_matches, max_walk_depth, deadline)
+        if self.resultcache is not None:
+            key = ("find", content_key(text), all, skip, fromidx, toidx, matchmaker, resolve, priority)
+            return cached(self.resultcache, key,
+                          lambda: self._find(text, all, skip, fromidx, toidx, matchmaker, resolve, priority), self)
+        return self._find(text, all, skip, fromidx, toidx, matchmaker, resolve, priority)
+
+    def _find_budgeted(self, text, all, skip, fromidx, toidx, matchmaker, resolve, priority,
+                       max_matches, max_walk_depth, deadline):
+        # results depend on the deadline, so they are never cached
+        if resolve == RESOLVE_LEFTMOST_LONGEST:
+            all, skip = False, True
+        elif resolve is not None:
+            all, skip = True, False
+        budget = Budget(max_walk_depth)
+        matches = collect_matches(
+            lambda **kwargs: self.finditer(text, all=all, skip=skip, matchmaker=matchmaker, budget=budget, **kwargs),
+            len(text), skip, fromidx, toidx, max_matches, deadline, budget)
+        for name in matches.exceeded:
+            self.budgets_exceeded[name] += 1
+        if resolve is not None and resolve != RESOLVE_LEFTMOST_LONGEST:
+            return MatchList(resolve_overlaps(matches, resolve, priority=priority), matches.exceeded)
         return matches
 
+    def count(self, text, all=False, skip=True, fromidx=None, toidx=None, key=None):
+        """
+        Count the matches in the text without creating match objects.
+        :param text: the text to search
+        :param all: count all matches, if False only the longest match
+        :param skip: skip forward over longest match (do not count contained/overlapping matches)
+        :param fromidx: index where to start finding
+        :param toidx: index where to stop finding (this is the last index actually used)
+        :param key: a function that takes start, end, match, entrydata, matcherdata of a match and returns the
+          hashable key to count, if None the entry data with dicts, lists (e.g. the data of entries added
+          with append=True) and sets as frozensets of their items, tuples and frozensets
+        :return: a collections.Counter mapping each key to the number of matches
+        """
+        return count_matches(
+            lambda matchmaker: self.finditer(text, all=all, skip=skip, fromidx=fromidx, toidx=toidx,
+                                             matchmaker=matchmaker),
+            key)
+
+    def contains_any(self, text, fromidx=None, toidx=None):
+        """
+        Check if there is any match in the text, stopping at the first one found.
+        :param text: the text to search
+        :param fromidx: index where to start finding
+        :param toidx: index where to stop finding (this is the last index actually used)
+        :return: True if there is a match
+        """
+        for _ in self.finditer(text, all=True, skip=False, fromidx=fromidx, toidx=toidx, matchmaker=_nomatch):
+            return True
+        return False
+
+    def first(self, text, all=False, fromidx=None, toidx=None, matchmaker=None):
+        """
+        Return the match with the smallest start offset, without looking for further matches.
+        :param text: the text to search
+        :param all: if True, the shortest match at the smallest start offset, otherwise the longest
+        :param fromidx: index where to start finding
+        :param toidx: index where to stop finding (this is the last index actually used)
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :return: the match or None if there is no match
+        """
+        for match in self.finditer(text, all=all, fromidx=fromidx, toidx=toidx, matchmaker=matchmaker):
+            return match
+        return None
+
+    def afinditer(self, text, all=False, skip=True, fromidx=None, toidx=None, matchmaker=None, slicesize=65536):
+        """
+        Asynchronous version of finditer for use in an event loop: the text is processed in slices of at
+        most slicesize start positions and control is given back to the event loop between slices.
+        See finditer for the other parameters.
+        :param slicesize: maximum number of start positions processed without giving back control
+        :return: an asynchronous generator of Match
+        """
+        return async_finditer(
+            lambda **kwargs: self.finditer(text, all=all, skip=skip, matchmaker=matchmaker, **kwargs),
+            len(text), skip, fromidx, toidx, slicesize)
+
+    async def afind(self, text, all=False, skip=True, fromidx=None, toidx=None, matchmaker=None, slicesize=65536,
+                    executor_threshold=None, executor=None):
+        """
+        Asynchronous version of find for use in an event loop, see afinditer. Texts of length
+        executor_threshold or more are processed with find in an executor instead.
+        :param slicesize: maximum number of start positions processed without giving back control
+        :param executor_threshold: if not None, the minimum length of a text to process in the executor
+        :param executor: the executor to use, if None the default executor of the event loop
+        :return: a list of Match
+        """
+        return await async_find(
+            lambda: self.afinditer(text, all=all, skip=skip, fromidx=fromidx, toidx=toidx, matchmaker=matchmaker,
+                                   slicesize=slicesize),
+            lambda: self.find(text, all=all, skip=skip, fromidx=fromidx, toidx=toidx, matchmaker=matchmaker),
+            len(text), executor_threshold, executor)
+
+    def refind(self, text, matches, offset, removed, inserted, all=False, skip=True, matchmaker=None):
+        """
+        Update the matches of a text after an edit instead of finding all matches again: only the part of the
+        text which can be affected by the edit (at most maxdepth characters before it) is scanned again, the
+        matches after it are shifted. The result is the same as for find(text, all=all, skip=skip).
+        The old matches are left unchanged, shifted matches are copies.
+        :param text: the text after the edit
+        :param matches: the list of matches found with find(oldtext, all=all, skip=skip, matchmaker=matchmaker)
+          for the text before the edit
+        :param offset: the index where the edit happened
+        :param removed: the number of characters removed at offset
+        :param inserted: the inserted string or the number of characters inserted at offset
+        :param all: return all matches, if False only return longest match
+        :param skip: skip forward over longest match (do not return contained/overlapping matches)
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :return: the list of matches for the text after the edit
+        """
+        if not isinstance(inserted, int):
+            inserted = len(inserted)
+        if self.ignorefunc is None:
+            ignored = None
+        else:
+            ignorefunc = self.ignorefunc
+
+            def ignored(idx):
+                return ignorefunc(text[idx])
+        return refind_matches(
+            lambda **kwargs: self.finditer(text, all=all, skip=skip, matchmaker=matchmaker, **kwargs),
+            matches, len(text), offset, removed, inserted, self.maxdepth, skip, ignored)
+
+    def _find(self, text, all, skip, fromidx, toidx, matchmaker, resolve, priority):
+        if resolve is None:
+            return list(self.finditer(text, all=all, skip=skip, fromidx=fromidx, toidx=toidx, matchmaker=matchmaker))
+        if resolve == RESOLVE_LEFTMOST_LONGEST:
+            # the longest match at each position, skipping over it, is exactly the leftmost-longest
+            # solution, so we get it directly from the scan
+            return list(self.finditer(text, all=False, skip=True, fromidx=fromidx, toidx=toidx,
+                                      matchmaker=matchmaker))
+        matches = list(self.finditer(text, all=True, skip=False, fromidx=fromidx, toidx=toidx,
+                                     matchmaker=matchmaker))
+        return resolve_overlaps(matches, resolve, priority=priority)
+
     def __setitem__(self, key, value):
+        if self.resultcache is not None:
+            self.resultcache.clear()
         node = self._get_node(key, create=True)
+        if self.datatable is not None:
+            value = self.datatable.intern(value)
         node.value = value
 
     def __getitem__(self, item):
         node = self._get_node(item, create=False, raise_error=True)
-        if node.value == _NOVALUE:
+        if node.value is _NOVALUE:
             raise KeyError(item)
+        if self.datatable is not None:
+            return self.datatable.resolve(node.value)
         return node.value
 
     def get(self, item, default=None):
         node = self._get_node(item, create=False, raise_error=False)
         if node is None:
             return default
-        if node.value == _NOVALUE:
+        if node.value is _NOVALUE:
             return default
+        if self.datatable is not None:
+            return self.datatable.resolve(node.value)
         return node.value
 
+    def cache_stats(self):
+        """
+        Return a dictionary mapping the name of each enabled cache to its statistics (size, hits, misses, etc.)
+        """
+        stats = dict()
+        if self.resultcache is not None:
+            stats["resultcache"] = self.resultcache.stats()
+        return stats
+
+    def _match_segment(self, segment, text, k, endidx, fast):
+        """
+        Match the segment of a radix node against the text after index k, the index of the element of the edge
+        leading to the node.
+        :return: the index of the last element of the text matched by the segment or -1 if it does not match
+        """
+        n = len(segment)
+        if fast:
+            if k + n >= endidx:
+                return -1
+            if isinstance(text, str):
+                return k + n if text.startswith(segment, k + 1) else -1
+            return k + n if text[k+1:k+1+n] == segment else -1
+        ignorefunc = self.ignorefunc
+        mapfunc = self.mapfunc
+        for el in segment:
+            k += 1
+            if ignorefunc:
+                while k < endidx and ignorefunc(text[k]):
+                    k += 1
+            if k >= endidx:
+                return -1
+            chr = text[k]
+            if mapfunc:
+                chr = mapfunc(chr)
+            if chr != el:
+                return -1
+        return k
+
+    def _make_segment(self, elements):
+        """
+        Return the segment for a list of elements: a str or bytes if possible, otherwise a tuple.
+        """
+        if not elements:
+            return ""
+        if self.bytesmode and all(isinstance(el, int) and 0 <= el < 256 for el in elements):
+            return bytes(elements)
+        if all(isinstance(el, str) and len(el) == 1 for el in elements):
+            return "".join(elements)
+        return tuple(elements)
+
     def _get_node(self, item, create=False, raise_error=True):
         """
         Returns the node corresponding to the last character in key or raises a KeyError if create is False
@@ -200,7 +589,13 @@ class StringMatcher:
         :param raise_error: if True and create is False, raises an error if not found, if False, returns None
         :return: the node corresponding to the key or None if no node found and raise_error is False
         """
+        if self.bytesmode and isinstance(item, str):
+            item = item.encode("utf-8")
+        if self.radix:
+            return self._get_radix_node(item, create, raise_error)
         node = self._root
+        depth = 0
+        first = second = None
         for el in item:
             if self.ignorefunc and self.ignorefunc(el):
                 continue
@@ -208,6 +603,11 @@ class StringMatcher:
                 el = self.mapfunc(el)
             if create:
                 node = node.children.setdefault(el, _Node())
+                if depth == 0:
+                    first = el
+                elif depth == 1:
+                    second = el
+                depth += 1
             else:
                 node = node.children.get(el)
                 if not node:
@@ -215,12 +615,191 @@ class StringMatcher:
                         raise KeyError(item)
                     else:
                         return None
+        if create and depth > 0:
+            self._update_prefilter(first, second, depth)
+        return node
+
+    def _get_radix_node(self, item, create, raise_error):
+        """
+        Same as _get_node for a radix trie: when creating, a new node gets all remaining elements as its
+        segment and a node whose segment only partly matches gets split.
+        """
+        elements = []
+        for el in item:
+            if self.ignorefunc and self.ignorefunc(el):
+                continue
+            if self.mapfunc:
+                el = self.mapfunc(el)
+            elements.append(el)
+        n = len(elements)
+        node = self._root
+        i = 0
+        while i < n:
+            el = elements[i]
+            child = node.children.get(el)
+            if child is None:
+                if not create:
+                    break
+                child = _Node()
+                child.segment = self._make_segment(elements[i+1:])
+                node.children[el] = child
+                node = child
+                i = n
+                break
+            segment = child.segment
+            j = 0
+            for a, b in zip(segment, elements[i+1:]):
+                if a != b:
+                    break
+                j += 1
+            if j < len(segment):
+                if not create:
+                    break
+                # split the node: the new node gets the common part of the segment
+                split = _Node()
+                split.segment = self._make_segment(list(segment[:j]))
+                split.children[segment[j]] = child
+                child.segment = self._make_segment(list(segment[j+1:]))
+                node.children[el] = split
+                child = split
+            node = child
+            i += 1 + j
+        if i < n:
+            if raise_error:
+                raise KeyError(item)
+            return None
+        if create and n > 0:
+            self._update_prefilter(elements[0], elements[1] if n > 1 else None, n)
         return node
 
+    def _update_prefilter(self, first, second, depth):
+        if depth > self.maxdepth:
+            self.maxdepth = depth
+        if self.prefilter:
+            if depth == 1:
+                self._singles.add(first)
+            else:
+                self._bigrams.setdefault(first, set()).add(second)
+            self._prefilter_regex = None
+
+    def _get_prefilter_regex(self):
+        """
+        Return the compiled regular expression that finds all positions where the first two characters of
+        an entry (or a single character entry) occur, or None if it cannot be used.
+        """
+        if self._prefilter_regex is None:
+            if not self._bigrams and not self._singles:
+                return None
+            import re
+            parts = [re.escape(first) + "[" + "".join(re.escape(c) for c in sorted(seconds)) + "]"
+                     for first, seconds in self._bigrams.items()]
+            if self._singles:
+                parts.append("[" + "".join(re.escape(c) for c in sorted(self._singles)) + "]")
+            self._prefilter_regex = re.compile("(?=" + "|".join(parts) + ")", re.DOTALL)
+        return self._prefilter_regex
+
+    def _iter_entries(self):
+        """
+        Generate tuples (key, node) for all entries, where key is the string of mapped characters (bytes in
+        bytes mode) of the entry.
+        """
+        join = bytes if self.bytesmode else "".join
+        stack = [(self._root, ())]
+        while stack:
+            node, path = stack.pop()
+            if node.value is not _NOVALUE:
+                yield join(path), node
+            for el, child in node.children.items():
+                stack.append((child, path + (el,) + tuple(child.segment)))
+
+    def stats(self, memory=True):
+        """
+        Return statistics about the trie: number of nodes (including the root), number of edges, number of
+        entries, maximum entry depth, a histogram of entry depths (number of characters), a histogram of the
+        number of children per node and, if memory is True, the estimated deep memory size of the trie and
+        data in bytes (this can take a while for big tries).
+        :param memory: if True, estimate the memory size
+        :return: dictionary with keys nodes, edges, entries, maxdepth, depth_histogram, branching_histogram, memory
+        """
+        nnodes = 0
+        depths = dict()
+        branching = dict()
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            nnodes += 1
+            nchildren = len(node.children)
+            branching[nchildren] = branching.get(nchildren, 0) + 1
+            if node.value is not _NOVALUE:
+                depths[depth] = depths.get(depth, 0) + 1
+            for child in node.children.values():
+                stack.append((child, depth + 1 + len(child.segment)))
+        stats = dict(nodes=nnodes, edges=nnodes - 1, entries=sum(depths.values()), maxdepth=max(depths, default=0),
+                     depth_histogram=dict(sorted(depths.items())), branching_histogram=dict(sorted(branching.items())))
+        if memory:
+            stats["memory"] = deep_sizeof((self._root, self.datatable))
+        return stats
+
+    def hit_counts(self, include_unused=False):
+        """
+        Return the number of times each entry was returned in a match by find since hit counting was
+        enabled or reset. Entries which were never found can be included with a count of 0 to find entries
+        which could be removed.
+        :param include_unused: if True, include entries with a count of 0
+        :return: dictionary mapping the entry (mapped characters) to the count
+        """
+        if self.hitcounts is None:
+            raise ValueError("Hit counting is not enabled, use hitcounts=True")
+        counts = dict()
+        for key, node in self._iter_entries():
+            n = self.hitcounts.get(node, 0)
+            if n or include_unused:
+                counts[key] = n
+        return counts
+
+    def reset_hitcounts(self):
+        """
+        Reset all hit counts to 0 and enable hit counting.
+        """
+        self.hitcounts = dict()
+
+    def prefilter_stats(self):
+        """
+        Return statistics about the entries which are used or could be used for prefiltering start positions:
+        maxdepth (the maximum number of mapped, not ignored characters of an entry), nfirst (number of
+        different first characters) and if prefilter is enabled, nbigrams (number of different first two
+        characters), nsingles (number of single character entries) and regex (True if the regex
+        prefilter is used by find).
+        """
+        stats = dict(maxdepth=self.maxdepth, nfirst=len(self._root.children))
+        if self.prefilter:
+            stats["nbigrams"] = sum(len(s) for s in self._bigrams.values())
+            stats["nsingles"] = len(self._singles)
+            stats["regex"] = not (self.mapfunc or self.ignorefunc or self.bytesmode)
+        return stats
+
     def replace(self,  text, fromidx=None, toidx=None, getter=None, replacer=None, matchmaker=None):
-        matches = self.find(text, fromidx=fromidx, toidx=toidx, all=False, skip=True, matchmaker=matchmaker)
+        """
+        Replace any longest match found in the text. By default the string representation of the data of the
+        match is used.
+        :param text: the text where to replace matches
+        :param fromidx: index where to start finding in text
+        :param toidx: index where to stop finding in text
+        :param getter: not used
+        :param replacer: a function that takes a match and returns the replacement string (bytes in bytes mode)
+        :param matchmaker: a function to create a match object, passed on to the finder.
+        :return: the text with all replacements carried out (bytes in bytes mode)
+        """
+        if self.resultcache is not None:
+            key = ("replace", content_key(text), fromidx, toidx, replacer, matchmaker)
+            return cached(self.resultcache, key, lambda: self._replace(text, fromidx, toidx, replacer, matchmaker),
+                          self)
+        return self._replace(text, fromidx, toidx, replacer, matchmaker)
+
+    def _replace(self, text, fromidx, toidx, replacer, matchmaker):
+        matches = self._find(text, False, True, fromidx, toidx, matchmaker, None, None)
         if len(matches) == 0:
-            return text
+            return bytes(text) if self.bytesmode else text
         parts = []
         last = 0
         for match in matches:
@@ -231,8 +810,25 @@ class StringMatcher:
                     rep = replacer(match)
                 else:
                     rep = str(match.entrydata)
+                    if self.bytesmode:
+                        rep = rep.encode("utf-8")
                 parts.append(rep)
                 last = match.end
         if last < len(text):
             parts.append(text[last:])
-        return "".join(parts)
\ No newline at end of file
+        if self.bytesmode:
+            return b"".join(parts)
+        return "".join(parts)
+
+    def to_char_offsets(self, data, matches):
+        """
+        Convert the byte offsets of matches found in bytes mode to character offsets. This only looks at the
+        parts of data up to the last match offset and does not decode the data.
+        The matches are left unchanged.
+        :param data: the bytes-like object, valid UTF-8, the matches were found in
+        :param matches: list of matches with byte offsets
+        :return: a new list of copies of the matches with character offsets
+        """
+        offsets = [m.start for m in matches] + [m.end for m in matches]
+        charoffsets = dict(zip(offsets, utf8_char_offsets(data, offsets)))
+        return [moved_match(m, charoffsets[m.start], charoffsets[m.end]) for m in matches]
\ No newline at end of file
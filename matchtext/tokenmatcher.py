@@ -13,11 +13,14 @@ data and append on each add for the same sequence instead of overwriting existin
 parameter.
 """
 
+import re
 import sys
+from array import array
 from collections import defaultdict
-from matchtext.utils import thisorthat
+from matchtext.utils import thisorthat, resolve_overlaps, RESOLVE_LEFTMOST_LONGEST, LRUCache, content_key, cached, \
+    DataTable, interned_matchmaker, deep_sizeof, async_finditer, async_find, refind_matches, \
+    count_matches, _nomatch, Budget, MatchList, BUDGETS, collect_matches
 from dataclasses import dataclass
-from matchtext.runutils import ensurelogger, set_logger
 
 
 @dataclass(unsafe_hash=True, order=True)
@@ -30,25 +33,181 @@ class Match:
     matcherdata: object
 
 
+class LazyMatch(Match):
+    """
+    A Match where the entry data is only looked up in the data table of the matcher when it is accessed.
+    """
+    __slots__ = ("_ref", "_table", "_default")
+
+    def __init__(self, start, end, match, ref, matcherdata, table, default=None):
+        self.start = start
+        self.end = end
+        self.match = match
+        self.matcherdata = matcherdata
+        self._ref = ref
+        self._table = table
+        self._default = default
+
+    @property
+    def entrydata(self):
+        return thisorthat(self._table.resolve(self._ref), self._default)
+
+    def __copy__(self):
+        return type(self)(self.start, self.end, self.match, self._ref, self.matcherdata, self._table, self._default)
+
+    def __eq__(self, other):
+        # equal to a Match or LazyMatch with the same fields, so that the results of interned and plain
+        # matchers can be compared
+        if not isinstance(other, Match):
+            return NotImplemented
+        return (self.start, self.end, self.match, self.entrydata, self.matcherdata) == \
+            (other.start, other.end, other.match, other.entrydata, other.matcherdata)
+
+    __hash__ = Match.__hash__
+
+
+class PreparedTokens:
+    """
+    A sequence of tokens for which the getter, mapfunc and ignorefunc have already been applied: keys contains
+    the mapped string for each token and ignored a mask which is 1 for each ignored token.
+    A prepared sequence can be passed to the find/replace methods of all TokenMatchers which use the same
+    mapfunc and ignorefunc, so that the tokens only get normalized once for several matchers.
+    Create with TokenMatcher.prepare().
+    """
+    __slots__ = ("tokens", "keys", "ignored", "ignoredkeys", "mapfunc", "ignorefunc")
+
+    def __init__(self, tokens, getter=None, mapfunc=None, ignorefunc=None):
+        """
+        Prepare the tokens.
+        :param tokens: sequence of tokens (strings or something where getter retrieves a string)
+        :param getter: get the string from a token object, if None, assumes each token already is a string
+        :param mapfunc: the mapfunc of the matchers
+        :param ignorefunc: the ignorefunc of the matchers
+        """
+        self.tokens = tokens
+        self.mapfunc = mapfunc
+        self.ignorefunc = ignorefunc
+        keys = tokens if getter is None else [getter(t) for t in tokens]
+        if mapfunc is not None:
+            keys = [mapfunc(k) for k in keys]
+        elif keys is tokens:
+            keys = list(keys)
+        self.keys = keys
+        self.ignored = bytearray(len(keys))
+        self.ignoredkeys = set()
+        if ignorefunc is not None:
+            for idx, k in enumerate(keys):
+                if ignorefunc(k):
+                    self.ignored[idx] = 1
+                    self.ignoredkeys.add(k)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, item):
+        return self.keys[item]
+
+    def __iter__(self):
+        return iter(self.keys)
+
+
+class TokenizedText:
+    """
+    The tokens of a raw text and the character offsets of each token: the token with index i is
+    text[starts[i]:ends[i]]. Can be passed to the find methods of a TokenMatcher like a list of tokens.
+    Create with Tokenizer.tokenize().
+    """
+    __slots__ = ("text", "tokens", "starts", "ends")
+
+    def __init__(self, text, tokens, starts, ends):
+        self.text = text
+        self.tokens = tokens
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, item):
+        return self.tokens[item]
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def char_span(self, start, end):
+        """
+        Return the tuple of character offsets (start, end) for the tokens start to end (exclusive).
+        """
+        return self.starts[start], self.ends[end - 1]
+
+
+class Tokenizer:
+    """
+    Split raw text into tokens and record the character offsets of the tokens in compact arrays.
+    """
+
+    def __init__(self, pattern=None):
+        """
+        Create a Tokenizer.
+        :param pattern: if None, the tokens are the whitespace separated parts of the text (as with str.split),
+          otherwise a regular expression (string or compiled) which matches each token
+        """
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+
+    def tokenize(self, text):
+        """
+        Tokenize the text.
+        :param text: the string to tokenize
+        :return: TokenizedText
+        """
+        starts = array("l")
+        ends = array("l")
+        if self.pattern is None:
+            tokens = text.split()
+            find = text.find
+            pos = 0
+            for token in tokens:
+                pos = find(token, pos)
+                starts.append(pos)
+                pos += len(token)
+                ends.append(pos)
+        else:
+            tokens = []
+            for m in self.pattern.finditer(text):
+                tokens.append(m.group())
+                start, end = m.span()
+                starts.append(start)
+                ends.append(end)
+        return TokenizedText(text, tokens, starts, ends)
+
+
+# the tokenizer used by find_text and finditer_text if none is specified
+DEFAULT_TOKENIZER = Tokenizer()
+
+
 class Node(object):
     """
     Represent an entry in the hash map of entry first tokens.
     If is_match is True, that token is already a match and data contains the entry data.
     The continuations attribute contains None or a list of multi token matches that
     start with the first token and the entry data if we have a match (all tokens match).
+    The classes attribute contains None or a list of (class name, predicate, node) for continuations
+    with a token class.
     """
-    __slots__ = ("is_match", "data", "nodes")
+    __slots__ = ("is_match", "data", "nodes", "classes")
 
-    def __init__(self, is_match=None, data=None, nodes=None):
+    def __init__(self, is_match=None, data=None, nodes=None, classes=None):
         """
 
         :param is_match: this node is a match
         :param data: data associated with the match
         :param nodes:
+        :param classes: list of (class name, predicate, node) for the token class continuations
         """
         self.is_match = is_match
         self.data = data
         self.nodes = nodes
+        self.classes = classes
 
     @staticmethod
     def dict_repr(nodes):
@@ -60,21 +219,69 @@ class Node(object):
         return f"Node(is_match={self.is_match},data={self.data},nodes={nodes})"
 
 
+def _class_predicate(tokenclass):
+    """
+    Return the predicate for a token class given as a predicate, a regular expression string or a compiled
+    regular expression, which must match the whole token.
+    """
+    if isinstance(tokenclass, str):
+        return re.compile(tokenclass).fullmatch
+    if isinstance(tokenclass, re.Pattern):
+        return tokenclass.fullmatch
+    if callable(tokenclass):
+        return tokenclass
+    raise TypeError(f"A token class must be a predicate or a regular expression, not {type(tokenclass)}")
+
+
 class TokenMatcher:
 
-    def __init__(self, ignorefunc=None, mapfunc=None, matcherdata=None, defaultdata=None):
+    def __init__(self, ignorefunc=None, mapfunc=None, matcherdata=None, defaultdata=None, tokencache=0,
+                 resultcache=0, resultcache_maxbytes=None, datatable=None, hitcounts=False, tokenclasses=None):
         """
         Create a TokenMatcher.
         :param ignorefunc: a predicate that returns True for any token that should be ignored.
         :param mapfunc: a function that returns the string to use for each token.
         :param matcherdata: data to add to all matches in the matcherdata field
         :param defaultdata: data to add to matches when the entry data is None
+        :param tokencache: if > 0, the maximum number of tokens for which to cache the result of mapfunc and
+          ignorefunc when finding matches. This helps if mapfunc/ignorefunc are expensive, since the frequencies
+          of tokens in natural language are very skewed. The tokens must be hashable.
+        :param resultcache: if > 0, the maximum number of find/replace results to cache, keyed by a digest
+          of the tokens and the parameters of the call. The cache is cleared whenever the matcher is modified.
+          Each call gets its own copy of the cached matches. replace results are not cached when a getter
+          or PreparedTokens are used.
+        :param resultcache_maxbytes: if not None, also limit the result cache to approximately that many bytes
+        :param datatable: if True, store the entry data deduplicated in a new DataTable, if a DataTable, store
+          the entry data in that (possibly shared) table. The nodes then only hold integer handles and
+          the entry data of the matches is looked up when it is accessed.
+        :param hitcounts: if True, count for each entry how often it was returned in a match by find,
+          see hit_counts(). Results taken from the result cache are counted as well.
+        :param tokenclasses: if not None, a dictionary mapping class names to token classes, each a predicate
+          or a regular expression (string or compiled) which must match the whole token. A token of an entry
+          which is a class name (e.g. "<NUM>") matches any (mapped) token of that class, so pattern-like entries
+          such as ["Section", "<NUM>"] do not need to be expanded. The matches are the same as with the entries
+          expanded into all the token sequences they match; if several entries match the same tokens, the data
+          of the entry using the token itself instead of a class at the first difference is used.
         """
         self.nodes = defaultdict(Node)
+        self.tokenclasses = dict(tokenclasses) if tokenclasses else None
+        self._predicates = {name: _class_predicate(tc) for name, tc in tokenclasses.items()} \
+            if tokenclasses else None
+        # list of (class name, predicate, node) for entries starting with a token class
+        self.classes = None
         self.ignorefunc = ignorefunc
         self.mapfunc = mapfunc
         self.defaultdata = defaultdata
         self.matcherdata = matcherdata
+        self.tokencache = LRUCache(tokencache) if tokencache > 0 else None
+        self.datatable = DataTable() if datatable is True else datatable
+        self.resultcache = LRUCache(resultcache, resultcache_maxbytes) if resultcache > 0 else None
+        # maximum number of (mapped, not ignored) tokens of an entry
+        self.maxdepth = 0
+        # node -> number of matches returned for the entry of the node
+        self.hitcounts = dict() if hitcounts else None
+        # how often find stopped early or cut walks short because of each budget
+        self.budgets_exceeded = dict.fromkeys(BUDGETS, 0)
 
     def add(self, entry, data=None, append=False, listdata=None):
         """
@@ -89,9 +296,16 @@ class TokenMatcher:
         """
         if isinstance(entry, str):
             entry = [entry]
+        if self.resultcache is not None:
+            self.resultcache.clear()
         node = None
         i = 0
+        predicates = self._predicates
         for token in entry:
+            if predicates is not None and token in predicates:
+                node = self._add_class(node, token)
+                i += 1
+                continue
             if self.mapfunc is not None:
                 token = self.mapfunc(token)
             if self.ignorefunc is not None and self.ignorefunc(token):
@@ -107,7 +321,23 @@ class TokenMatcher:
                 else:
                     node = node.nodes[token]
             i += 1
-        if append and data is not None:
+        if node is None:
+            # all tokens were ignored
+            return
+        if i > self.maxdepth:
+            self.maxdepth = i
+        table = self.datatable
+        if table is not None:
+            if append and data is not None:
+                handle = table.intern(data)
+                if node.is_match and isinstance(node.data, array):
+                    node.data.append(handle)
+                else:
+                    node.data = table.new_list(handle)
+            else:
+                node.data = table.intern(data)
+            node.is_match = True
+        elif append and data is not None:
             if node.data:
                 node.data.append(data)
             else:
@@ -117,113 +347,582 @@ class TokenMatcher:
             node.data = data
             node.is_match = True
 
-    def find(self, tokens, all=False, skip=True, fromidx=None, toidx=None, getter=None, matchmaker=None):
+    def _add_class(self, node, name):
         """
-        Find gazetteer entries in text. Text is either a string or an iterable of strings or
-        an iterable of elements where a string can be retrieved using the getter.
+        Return the node for the continuation of node with the token class name, creating it if needed.
+        If node is None, the continuation of the root.
+        """
+        classes = self.classes if node is None else node.classes
+        if classes is None:
+            classes = []
+            if node is None:
+                self.classes = classes
+            else:
+                node.classes = classes
+        for cname, _, child in classes:
+            if cname == name:
+                return child
+        child = Node()
+        classes.append((name, self._predicates[name], child))
+        return child
+
+    def finditer(self, tokens, all=False, skip=True, fromidx=None, toidx=None, getter=None, matchmaker=None,
+                 maxstart=None, budget=None):
+        """
+        Find gazetteer entries in a sequence of tokens and generate the matches in order of their start
+        offset (and for the same start offset, in order of increasing length).
         Note: if fromidx or toidx are bigger than the length of the tokens allows, this is silently
         ignored.
-        :param tokens: iterable of tokens (string or something where getter retrieves a string)
+        :param tokens: iterable of tokens (string or something where getter retrieves a string) or PreparedTokens
         :param all: return all matches, if False only return longest match
         :param skip: skip forward over longest match (do not return contained/overlapping matches)
         :param fromidx: index where to start finding in tokens
         :param toidx: index where to stop finding in tokens (this is the last index actually used)
         :param getter: get the string from a token object, if None, assumes each token already is a string
-        :return: an iterable of Match. The start/end fields of each Match are the character offsets if
-        text is a string, otherwise are the token offsets.
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :param maxstart: if not None, the last index where a match can start, the match can still extend up to
+          toidx
+        :param budget: if not None, a utils.Budget limiting the number of tokens examined for the matches at
+          each start position, "max_walk_depth" is added to budget.exceeded if a walk was cut short
+        :return: a generator of Match. The start/end fields of each Match are the token offsets.
         """
-        logger = ensurelogger()
-        logger.debug("CALL")
-        matches = []
         l = len(tokens)
         if fromidx is None:
             fromidx = 0
-        if toidx is None:
-            toidx = l-1
-        if fromidx >= l:
-            return matches
-        if toidx >= l:
+        if toidx is None or toidx >= l:
             toidx = l-1
         if fromidx > toidx:
-            return matches
+            return
+        if self.datatable is not None:
+            matchmaker = interned_matchmaker(self.datatable, self.defaultdata, matchmaker, LazyMatch)
+        elif matchmaker is None:
+            matchmaker = Match
+        ignorefunc = self.ignorefunc
+        mapfunc = self.mapfunc
+        defaultdata = self.defaultdata
+        matcherdata = self.matcherdata
+        rootnodes = self.nodes
+        hitcounts = self.hitcounts
+        normalize = self._normalize if self.tokencache is not None else None
+        if isinstance(tokens, PreparedTokens):
+            self._check_prepared(tokens)
+            # the keys are already mapped and whether a token is ignored only depends on its key
+            ignorefunc = tokens.ignoredkeys.__contains__ if tokens.ignoredkeys else None
+            tokens = tokens.keys
+            getter = mapfunc = normalize = None
+        laststart = toidx if maxstart is None else min(maxstart, toidx)
+        maxwalk = budget.max_walk_depth if budget is not None else None
+        walkto = toidx
+        # with token classes, there can be several paths through the tree for the same tokens
+        classroot = Node(None, None, rootnodes, self.classes) if self._predicates is not None else None
         i = fromidx
-        logger.debug(f"From index {i} to index {toidx} for {tokens}")
-        while i <= toidx:
-            token_obj = tokens[i]
+        while i <= laststart:
+            if maxwalk is not None:
+                walkto = min(toidx, i + maxwalk - 1)
+            if classroot is not None:
+                hits, cut = self._class_walk(classroot, tokens, i, walkto, getter, mapfunc, normalize, ignorefunc)
+                if cut and walkto < toidx:
+                    budget.exceeded.add("max_walk_depth")
+                if not hits:
+                    i += 1
+                    continue
+                if all:
+                    for end, node, thistokens in hits:
+                        if hitcounts is not None:
+                            hitcounts[node] = hitcounts.get(node, 0) + 1
+                        yield matchmaker(i, end, thistokens, thisorthat(node.data, defaultdata), matcherdata)
+                else:
+                    end, node, thistokens = hits[-1]
+                    if hitcounts is not None:
+                        hitcounts[node] = hitcounts.get(node, 0) + 1
+                    yield matchmaker(i, end, thistokens, thisorthat(node.data, defaultdata), matcherdata)
+                if skip:
+                    i = hits[-1][0]
+                else:
+                    i += 1
+                continue
+            token = tokens[i]
             if getter:
-                token = getter(token_obj)
+                token = getter(token)
+            if normalize:
+                token = normalize(token)[0]
+            elif mapfunc:
+                token = mapfunc(token)
+            node = rootnodes.get(token)  # only possible if the token was not ignored!
+            if node is None:
+                i += 1
+                continue
+            longest_end = 0
+            longest_node = None
+            thistokens = [token]
+            if node.is_match:
+                longest_end = i + 1
+                longest_node = node
+                longest_ntokens = 1
+                if all:
+                    if hitcounts is not None:
+                        hitcounts[node] = hitcounts.get(node, 0) + 1
+                    yield matchmaker(i, i+1, thistokens.copy(), thisorthat(node.data, defaultdata), matcherdata)
+            j = i+1  # index into text tokens
+            while j <= walkto and node.nodes:
+                tok = tokens[j]
+                if getter:
+                    tok = getter(tok)
+                if normalize:
+                    tok, ignored = normalize(tok)
+                    if ignored:
+                        j += 1
+                        continue
+                else:
+                    if mapfunc:
+                        tok = mapfunc(tok)
+                    if ignorefunc and ignorefunc(tok):
+                        j += 1
+                        continue
+                node = node.nodes.get(tok)
+                if node is None:
+                    break
+                thistokens.append(tok)
+                j += 1
+                if node.is_match:
+                    longest_end = j
+                    longest_node = node
+                    longest_ntokens = len(thistokens)
+                    if all:
+                        if hitcounts is not None:
+                            hitcounts[node] = hitcounts.get(node, 0) + 1
+                        yield matchmaker(i, j, thistokens.copy(), thisorthat(node.data, defaultdata), matcherdata)
+            if j > walkto and walkto < toidx and node is not None and node.nodes:
+                budget.exceeded.add("max_walk_depth")
+            if not all and longest_node is not None:
+                # only create the match object for the longest match
+                if hitcounts is not None:
+                    hitcounts[longest_node] = hitcounts.get(longest_node, 0) + 1
+                yield matchmaker(i, longest_end, thistokens[:longest_ntokens],
+                                 thisorthat(longest_node.data, defaultdata), matcherdata)
+            if skip and longest_end:
+                i = longest_end
             else:
-                token = token_obj
-            logger.debug(f"Check token {i}={token}")
-            if self.mapfunc:
-                token = self.mapfunc(token)
-            if token in self.nodes:  # only possible if the token was not ignored!
-                longest = 0
-                node = self.nodes[token]
-                logger.debug(f"Got a first token match for {token}")
-                thismatches = []
-                thistokens = [token]
+                i += 1
+
+    @staticmethod
+    def _class_walk(root, tokens, i, walkto, getter, mapfunc, normalize, ignorefunc):
+        """
+        Walk the tree from the root for the tokens starting at i, following all continuations with the token
+        itself and with the token classes it belongs to, so that the result is the same as if the entries
+        with token classes were expanded into all the token sequences they match. If several entries match the
+        same tokens, the one which uses the token itself rather than a class at the first difference is used.
+        Return the list of (end, node, list of mapped tokens) of the matches in order of increasing length and
+        whether the walk was cut short at walkto.
+        """
+        active = [root]
+        thistokens = []
+        hits = []
+        j = i
+        while j <= walkto:
+            tok = tokens[j]
+            if getter:
+                tok = getter(tok)
+            if normalize:
+                tok, ignored = normalize(tok)
+            else:
+                if mapfunc:
+                    tok = mapfunc(tok)
+                ignored = ignorefunc and ignorefunc(tok)
+            if ignored:
+                if j == i:
+                    # matches never start at an ignored token
+                    return hits, False
+                j += 1
+                continue
+            nextactive = []
+            for node in active:
+                if node.nodes:
+                    child = node.nodes.get(tok)
+                    if child is not None and child not in nextactive:
+                        nextactive.append(child)
+                if node.classes:
+                    for _, predicate, child in node.classes:
+                        if child not in nextactive and predicate(tok):
+                            nextactive.append(child)
+            if not nextactive:
+                return hits, False
+            active = nextactive
+            thistokens.append(tok)
+            j += 1
+            for node in active:
                 if node.is_match:
-                    logger.debug(f"First token match is also entry match")
-                    longest = 1
-                    if matchmaker:
-                        match = matchmaker(i, i+1, thistokens.copy(), thisorthat(node.data, self.defaultdata), self.matcherdata)
-                    else:
-                        match = Match(i, i+1, thistokens.copy(), thisorthat(node.data, self.defaultdata), self.matcherdata)
-                    thismatches.append(match)
-                j = i+1  # index into text tokens
-                nignored = 0
-                while j <= toidx:
-                    logger.debug(f"j={j}")
-                    if node.nodes:
-                        tok = tokens[j]
-                        if self.mapfunc:
-                            tok = self.mapfunc(tok)
-                        if self.ignorefunc and self.ignorefunc(tok):
-                            j += 1
-                            nignored += 1
-                            continue
-                        if tok in node.nodes:
-                            logger.debug(f"Found token {tok}")
-                            node = node.nodes[tok]
-                            thistokens.append(tok)
-                            if node.is_match:
-                                logger.debug(f"Also is entry match")
-                                if matchmaker:
-                                    match = matchmaker(i, i + len(thistokens)+nignored,
-                                          thistokens.copy(),
-                                          thisorthat(node.data, self.defaultdata), self.matcherdata)
-                                else:
-                                    match = Match(i, i + len(thistokens)+nignored,
-                                          thistokens.copy(),
-                                          thisorthat(node.data, self.defaultdata), self.matcherdata)
-                                # TODO: should LONGEST get calculated including ignored tokens or not?
-                                if all:
-                                    thismatches.append(match)
-                                    if len(thistokens) > longest:
-                                        longest = len(thistokens)
-                                else:
-                                    if len(thistokens) > longest:
-                                        thismatches = [match]
-                                        longest = len(thistokens)
-                            j += 1
-                            continue
-                        else:
-                            logger.debug(f"Breaking: {tok} does not match, j={j}")
-                            break
-                    else:
-                        logger.debug("Breaking: no nodes")
-                        break
-                logger.debug(f"Going through thismatches: {thismatches}")
-                for m in thismatches:
-                    matches.append(m)
-                if thismatches and skip:
-                    i += longest - 1  # we will increment by 1 right after!
-            i += 1
-            logger.debug(f"Incremented i to {i}")
+                    hits.append((j, node, thistokens.copy()))
+                    break
+            if not any(node.nodes or node.classes for node in active):
+                return hits, False
+        return hits, True
+
+    def _normalize(self, token):
+        """
+        Return the tuple (mapped token, is ignored) for the token, using the token cache.
+        """
+        cache = self.tokencache
+        ret = cache.get(token)
+        if ret is None:
+            mapped = self.mapfunc(token) if self.mapfunc else token
+            ret = (mapped, bool(self.ignorefunc and self.ignorefunc(mapped)))
+            cache.put(token, ret)
+        return ret
+
+    def prepare(self, tokens, getter=None):
+        """
+        Apply getter, mapfunc and ignorefunc to all tokens once and return a PreparedTokens instance that
+        can be used instead of the tokens with the find/replace methods of this matcher and all other
+        matchers which use the same mapfunc and ignorefunc.
+        :param tokens: sequence of tokens (strings or something where getter retrieves a string)
+        :param getter: get the string from a token object, if None, assumes each token already is a string
+        :return: PreparedTokens
+        """
+        return PreparedTokens(tokens, getter=getter, mapfunc=self.mapfunc, ignorefunc=self.ignorefunc)
+
+    def _check_prepared(self, prepared):
+        if prepared.mapfunc is not self.mapfunc or prepared.ignorefunc is not self.ignorefunc:
+            raise ValueError("Prepared tokens were created with a different mapfunc or ignorefunc than used "
+                             "by this matcher")
+
+    def prefilter_stats(self):
+        """
+        Return statistics about the entries: maxdepth (the maximum number of mapped, not ignored tokens of
+        an entry) and nfirst (the number of different first tokens).
+        """
+        return dict(maxdepth=self.maxdepth, nfirst=len(self.nodes))
+
+    def _iter_entries(self):
+        """
+        Generate tuples (key, node) for all entries, where key is the tuple of mapped tokens and token class
+        names of the entry.
+        """
+        stack = [(node, (token,)) for token, node in self.nodes.items()]
+        if self.classes:
+            stack.extend((node, (name,)) for name, _, node in self.classes)
+        while stack:
+            node, path = stack.pop()
+            if node.is_match:
+                yield path, node
+            if node.nodes:
+                for token, child in node.nodes.items():
+                    stack.append((child, path + (token,)))
+            if node.classes:
+                for name, _, child in node.classes:
+                    stack.append((child, path + (name,)))
+
+    def stats(self, memory=True):
+        """
+        Return statistics about the hash tree: number of nodes, number of edges, number of entries, maximum
+        entry depth, a histogram of entry depths (number of tokens), a histogram of the number of
+        children per node and, if memory is True, the estimated deep memory size of the tree and data in bytes
+        (this can take a while for big trees). The root map counts as a node, token class continuations count
+        as edges.
+        :param memory: if True, estimate the memory size
+        :return: dictionary with keys nodes, edges, entries, maxdepth, depth_histogram, branching_histogram, memory
+        """
+        nnodes = 1
+        depths = dict()
+        rootclasses = self.classes or []
+        branching = {len(self.nodes) + len(rootclasses): 1}
+        stack = [(node, 1) for node in self.nodes.values()]
+        stack.extend((node, 1) for _, _, node in rootclasses)
+        while stack:
+            node, depth = stack.pop()
+            nnodes += 1
+            children = list(node.nodes.values()) if node.nodes else []
+            if node.classes:
+                children.extend(child for _, _, child in node.classes)
+            branching[len(children)] = branching.get(len(children), 0) + 1
+            if node.is_match:
+                depths[depth] = depths.get(depth, 0) + 1
+            for child in children:
+                stack.append((child, depth + 1))
+        stats = dict(nodes=nnodes, edges=nnodes - 1, entries=sum(depths.values()), maxdepth=max(depths, default=0),
+                     depth_histogram=dict(sorted(depths.items())), branching_histogram=dict(sorted(branching.items())))
+        if memory:
+            stats["memory"] = deep_sizeof((self.nodes, self.classes, self.datatable))
+        return stats
+
+    def hit_counts(self, include_unused=False):
+        """
+        Return the number of times each entry was returned in a match by find since hit counting was
+        enabled or reset. Entries which were never found can be included with a count of 0 to find entries
+        which could be removed.
+        :param include_unused: if True, include entries with a count of 0
+        :return: dictionary mapping the entry (tuple of mapped tokens) to the count
+        """
+        if self.hitcounts is None:
+            raise ValueError("Hit counting is not enabled, use hitcounts=True")
+        counts = dict()
+        for key, node in self._iter_entries():
+            n = self.hitcounts.get(node, 0)
+            if n or include_unused:
+                counts[key] = n
+        return counts
+
+    def reset_hitcounts(self):
+        """
+        Reset all hit counts to 0 and enable hit counting.
+        """
+        self.hitcounts = dict()
+
+    def cache_stats(self):
+        """
+        Return a dictionary mapping the name of each enabled cache ("tokencache", "resultcache") to its
+        statistics (size, hits, misses, hitrate etc.)
+        """
+        stats = dict()
+        if self.tokencache is not None:
+            stats["tokencache"] = self.tokencache.stats()
+        if self.resultcache is not None:
+            stats["resultcache"] = self.resultcache.stats()
+        return stats
+
+    def find(self, tokens, all=False, skip=True, fromidx=None, toidx=None, getter=None, matchmaker=None,
+             resolve=None, priority=None, max_matches=None, max_walk_depth=None, deadline=None):
+        """
+        Find gazetteer entries in text. Text is either a string or an iterable of strings or
+        an iterable of elements where a string can be retrieved using the getter.
+        Note: if fromidx or toidx are bigger than the length of the tokens allows, this is silently
+        ignored.
+        :param tokens: iterable of tokens (string or something where getter retrieves a string) or PreparedTokens
+        :param all: return all matches, if False only return longest match
+        :param skip: skip forward over longest match (do not return contained/overlapping matches)
+        :param fromidx: index where to start finding in tokens
+        :param toidx: index where to stop finding in tokens (this is the last index actually used)
+        :param getter: get the string from a token object, if None, assumes each token already is a string
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :param resolve: if not None, the strategy to use for returning only non-overlapping matches, one of
+          "leftmost-longest", "longest", "priority" (see utils.resolve_overlaps). If specified, the parameters
+          all and skip are ignored. The objects created by the matchmaker must have start, end and entrydata
+          attributes.
+        :param priority: function that returns the priority for the entry data of a match for the
+          "priority" strategy
+        :param max_matches: if not None, stop after finding that many matches (before resolving overlaps)
+        :param max_walk_depth: if not None, examine at most that many tokens for the matches at each start
+          position, so longer entries are not found
+        :param deadline: if not None, the time.monotonic() time after which to stop finding
+        :return: a list of Match. The start/end fields of each Match are the token offsets. If any of
+        max_matches, max_walk_depth, deadline is given, a utils.MatchList whose partial attribute is True if
+        the result is incomplete because of them.
+        """
+        if max_matches is not None or max_walk_depth is not None or deadline is not None:
+            return self._find_budgeted(tokens, all, skip, fromidx, toidx, getter, matchmaker, resolve, priority,
+                                       max_matches, max_walk_depth, deadline)
+        if self.resultcache is not None:
+            key = ("find", content_key(tokens, getter), all, skip, fromidx, toidx, getter, matchmaker, resolve,
+                   priority)
+            return cached(self.resultcache, key,
+                          lambda: self._find(tokens, all, skip, fromidx, toidx, getter, matchmaker, resolve, priority),
+                          self)
+        return self._find(tokens, all, skip, fromidx, toidx, getter, matchmaker, resolve, priority)
+
+    def _find_budgeted(self, tokens, all, skip, fromidx, toidx, getter, matchmaker, resolve, priority,
+                       max_matches, max_walk_depth, deadline):
+        # results depend on the deadline, so they are never cached
+        if resolve == RESOLVE_LEFTMOST_LONGEST:
+            all, skip = False, True
+        elif resolve is not None:
+            all, skip = True, False
+        budget = Budget(max_walk_depth)
+        matches = collect_matches(
+            lambda **kwargs: self.finditer(tokens, all=all, skip=skip, getter=getter, matchmaker=matchmaker,
+                                           budget=budget, **kwargs),
+            len(tokens), skip, fromidx, toidx, max_matches, deadline, budget)
+        for name in matches.exceeded:
+            self.budgets_exceeded[name] += 1
+        if resolve is not None and resolve != RESOLVE_LEFTMOST_LONGEST:
+            return MatchList(resolve_overlaps(matches, resolve, priority=priority), matches.exceeded)
         return matches
 
-    def replace(self,  tokens, fromidx=None, toidx=None, getter=None, replacer=None, matchmaker=None):
+    def count(self, tokens, all=False, skip=True, fromidx=None, toidx=None, getter=None, key=None):
+        """
+        Count the matches in the tokens without creating match objects.
+        :param tokens: the tokens to search
+        :param all: count all matches, if False only the longest match
+        :param skip: skip forward over longest match (do not count contained/overlapping matches)
+        :param fromidx: index where to start finding
+        :param toidx: index where to stop finding (this is the last index actually used)
+        :param getter: get the string from a token object, if None, assumes each token already is a string
+        :param key: a function that takes start, end, match, entrydata, matcherdata of a match and returns the
+          hashable key to count, if None the entry data with dicts, lists (e.g. the data of entries added
+          with append=True) and sets as frozensets of their items, tuples and frozensets
+        :return: a collections.Counter mapping each key to the number of matches
+        """
+        return count_matches(
+            lambda matchmaker: self.finditer(tokens, all=all, skip=skip, fromidx=fromidx, toidx=toidx, getter=getter,
+                                             matchmaker=matchmaker),
+            key)
+
+    def contains_any(self, tokens, fromidx=None, toidx=None, getter=None):
+        """
+        Check if there is any match in the tokens, stopping at the first one found.
+        :param tokens: the tokens to search
+        :param fromidx: index where to start finding
+        :param toidx: index where to stop finding (this is the last index actually used)
+        :param getter: get the string from a token object, if None, assumes each token already is a string
+        :return: True if there is a match
+        """
+        for _ in self.finditer(tokens, all=True, skip=False, fromidx=fromidx, toidx=toidx, getter=getter,
+                               matchmaker=_nomatch):
+            return True
+        return False
+
+    def first(self, tokens, all=False, fromidx=None, toidx=None, getter=None, matchmaker=None):
+        """
+        Return the match with the smallest start offset, without looking for further matches.
+        :param tokens: the tokens to search
+        :param all: if True, the shortest match at the smallest start offset, otherwise the longest
+        :param fromidx: index where to start finding
+        :param toidx: index where to stop finding (this is the last index actually used)
+        :param getter: get the string from a token object, if None, assumes each token already is a string
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :return: the match or None if there is no match
+        """
+        for match in self.finditer(tokens, all=all, fromidx=fromidx, toidx=toidx, getter=getter, matchmaker=matchmaker):
+            return match
+        return None
+
+    def afinditer(self, tokens, all=False, skip=True, fromidx=None, toidx=None, getter=None, matchmaker=None,
+                  slicesize=16384):
+        """
+        Asynchronous version of finditer for use in an event loop: the tokens are processed in slices of at
+        most slicesize start positions and control is given back to the event loop between slices.
+        See finditer for the other parameters.
+        :param slicesize: maximum number of start positions processed without giving back control
+        :return: an asynchronous generator of Match
+        """
+        return async_finditer(
+            lambda **kwargs: self.finditer(tokens, all=all, skip=skip, getter=getter, matchmaker=matchmaker,
+                                           **kwargs),
+            len(tokens), skip, fromidx, toidx, slicesize)
+
+    async def afind(self, tokens, all=False, skip=True, fromidx=None, toidx=None, getter=None, matchmaker=None,
+                    slicesize=16384, executor_threshold=None, executor=None):
+        """
+        Asynchronous version of find for use in an event loop, see afinditer. Token sequences of length
+        executor_threshold or more are processed with find in an executor instead.
+        :param slicesize: maximum number of start positions processed without giving back control
+        :param executor_threshold: if not None, the minimum number of tokens to process in the executor
+        :param executor: the executor to use, if None the default executor of the event loop
+        :return: a list of Match
+        """
+        return await async_find(
+            lambda: self.afinditer(tokens, all=all, skip=skip, fromidx=fromidx, toidx=toidx, getter=getter,
+                                   matchmaker=matchmaker, slicesize=slicesize),
+            lambda: self.find(tokens, all=all, skip=skip, fromidx=fromidx, toidx=toidx, getter=getter,
+                              matchmaker=matchmaker),
+            len(tokens), executor_threshold, executor)
+
+    def refind(self, tokens, matches, offset, removed, inserted, all=False, skip=True, getter=None,
+               matchmaker=None):
+        """
+        Update the matches of a token sequence after an edit instead of finding all matches again: only the
+        part of the tokens which can be affected by the edit (at most maxdepth tokens before it) is scanned
+        again, the matches after it are shifted. The result is the same as for find(tokens, all=all, skip=skip).
+        The old matches are left unchanged, shifted matches are copies.
+        :param tokens: the tokens after the edit
+        :param matches: the list of matches found with find(oldtokens, all=all, skip=skip, ...) for the
+          tokens before the edit
+        :param offset: the index where the edit happened
+        :param removed: the number of tokens removed at offset
+        :param inserted: the list of inserted tokens or the number of tokens inserted at offset
+        :param all: return all matches, if False only return longest match
+        :param skip: skip forward over longest match (do not return contained/overlapping matches)
+        :param getter: get the string from a token object, if None, assumes each token already is a string
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :return: the list of matches for the tokens after the edit
+        """
+        if not isinstance(inserted, int):
+            inserted = len(inserted)
+        if isinstance(tokens, PreparedTokens):
+            self._check_prepared(tokens)
+            ignored = tokens.ignored.__getitem__
+        elif self.ignorefunc is not None:
+            ignorefunc = self.ignorefunc
+            mapfunc = self.mapfunc
+
+            def ignored(idx):
+                token = tokens[idx]
+                if getter:
+                    token = getter(token)
+                if mapfunc:
+                    token = mapfunc(token)
+                return ignorefunc(token)
+        else:
+            ignored = None
+        return refind_matches(
+            lambda **kwargs: self.finditer(tokens, all=all, skip=skip, getter=getter, matchmaker=matchmaker,
+                                           **kwargs),
+            matches, len(tokens), offset, removed, inserted, self.maxdepth, skip, ignored)
+
+    def _find(self, tokens, all, skip, fromidx, toidx, getter, matchmaker, resolve, priority):
+        if resolve is None:
+            return list(self.finditer(tokens, all=all, skip=skip, fromidx=fromidx, toidx=toidx, getter=getter,
+                                      matchmaker=matchmaker))
+        if resolve == RESOLVE_LEFTMOST_LONGEST:
+            # the longest match at each position, skipping over it, is exactly the leftmost-longest
+            # solution, so we get it directly from the scan
+            return list(self.finditer(tokens, all=False, skip=True, fromidx=fromidx, toidx=toidx, getter=getter,
+                                      matchmaker=matchmaker))
+        matches = list(self.finditer(tokens, all=True, skip=False, fromidx=fromidx, toidx=toidx, getter=getter,
+                                     matchmaker=matchmaker))
+        return resolve_overlaps(matches, resolve, priority=priority)
+
+    @staticmethod
+    def _char_matchmaker(tokenized, matchmaker):
+        """
+        Return a matchmaker which converts the token offsets of a match to the character offsets of the
+        tokenized text and uses the text of the match as the match.
+        """
+        starts = tokenized.starts
+        ends = tokenized.ends
+        text = tokenized.text
+        if matchmaker is None:
+            matchmaker = Match
+
+        def charmatchmaker(start, end, match, entrydata, matcherdata):
+            start = starts[start]
+            end = ends[end - 1]
+            return matchmaker(start, end, text[start:end], entrydata, matcherdata)
+        return charmatchmaker
+
+    def finditer_text(self, text, tokenizer=None, all=False, skip=True, matchmaker=None):
+        """
+        Tokenize raw text and generate the matches with character offsets.
+        :param text: the string to search or TokenizedText
+        :param tokenizer: the Tokenizer to use, if None DEFAULT_TOKENIZER which splits on whitespace
+        :param all: return all matches, if False only return longest match
+        :param skip: skip forward over longest match (do not return contained/overlapping matches)
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :return: a generator of Match. The start/end fields of each Match are the character offsets of
+          the first and after the last token of the match in the text, the match field is that part of the text.
+        """
+        tokenized = text if isinstance(text, TokenizedText) else (tokenizer or DEFAULT_TOKENIZER).tokenize(text)
+        return self.finditer(tokenized.tokens, all=all, skip=skip,
+                             matchmaker=self._char_matchmaker(tokenized, matchmaker))
+
+    def find_text(self, text, tokenizer=None, all=False, skip=True, matchmaker=None, resolve=None, priority=None):
+        """
+        Tokenize raw text and find the matches with character offsets, see finditer_text. Results are not cached.
+        :param text: the string to search or TokenizedText
+        :param tokenizer: the Tokenizer to use, if None DEFAULT_TOKENIZER which splits on whitespace
+        :param all: return all matches, if False only return longest match
+        :param skip: skip forward over longest match (do not return contained/overlapping matches)
+        :param matchmaker: a function to create the match object from start, end, match, entrydata, matcherdata
+        :param resolve: if not None, the strategy to use for returning only non-overlapping matches, see find
+        :param priority: function that returns the priority for the entry data of a match for the
+          "priority" strategy
+        :return: a list of Match. The start/end fields of each Match are character offsets.
+        """
+        tokenized = text if isinstance(text, TokenizedText) else (tokenizer or DEFAULT_TOKENIZER).tokenize(text)
+        return self._find(tokenized.tokens, all, skip, None, None, None,
+                          self._char_matchmaker(tokenized, matchmaker), resolve, priority)
+
+    def replace(self,  tokens, fromidx=None, toidx=None, getter=None, replacer=None, matchmaker=None,
+                alignment=False):
         """
         Replace any longest sequence of tokens we find. By default the data found for the match is
         used as is.
@@ -234,22 +933,70 @@ class TokenMatcher:
         match and returns a list of replacement tokens. If the replacer is a list, that list is always used
         as a replacement. If the replacer is a string, it is used as a single token string that is always used.
 
-        :param tokens: the sequence of tokens where to find and replace matches. The parameter is left unchanged.
+        The result is built in a single pass over the tokens and the matches, see also ireplace().
+
+        :param tokens: the sequence of tokens or PreparedTokens where to find and replace matches. The parameter
+          is left unchanged.
         :param fromidx:
         :param toidx:
         :param getter: a function that takes a token from tokens and returns the corresponding string
         :param replacer: a function that takes a match and returns a list of tokens to replace the matched tokens with
         :param matchmaker: a function to create a match object, passed on to the finder.
-        :return: the tokens with all replacements carried out
+        :param alignment: if True, return a tuple of the tokens and the alignment list which contains, for each
+          output token, the index of the input token it came from (the start of the match for replacement tokens)
+        :return: the tokens with all replacements carried out, or a tuple (tokens, alignment)
+        """
+        # with a getter or prepared tokens, the result contains the original tokens, which can differ between
+        # documents with the same strings or keys, so it is not cached
+        if self.resultcache is not None and getter is None and not isinstance(tokens, PreparedTokens):
+            key = ("replace", content_key(tokens, getter), fromidx, toidx, getter, replacer, matchmaker, alignment)
+            return cached(self.resultcache, key,
+                          lambda: self._replace(tokens, fromidx, toidx, getter, replacer, matchmaker, alignment), self)
+        return self._replace(tokens, fromidx, toidx, getter, replacer, matchmaker, alignment)
+
+    @staticmethod
+    def _replacement(replacer, match):
+        if replacer is None:
+            return [match.entrydata]
+        if isinstance(replacer, str):
+            return [replacer]
+        if isinstance(replacer, list):
+            return replacer
+        return replacer(match)
+
+    def ireplace(self, tokens, fromidx=None, toidx=None, getter=None, replacer=None, matchmaker=None):
+        """
+        Like replace, but generate the output tokens lazily while the matches are found.
+        :return: a generator of output tokens
         """
-        tokens = tokens.copy()
-        matches = self.find(tokens, fromidx=fromidx, toidx=toidx, all=False, skip=True, getter=getter, matchmaker=matchmaker)
-        # to make it easier to replace slices in the tokens, replace from the end
-        matches = sorted(matches, key=lambda x: x.start, reverse=True)
+        matches = self.finditer(tokens, all=False, skip=True, fromidx=fromidx, toidx=toidx, getter=getter,
+                                matchmaker=matchmaker)
+        if isinstance(tokens, PreparedTokens):
+            tokens = tokens.tokens
+        last = 0
         for match in matches:
-            if replacer:
-                rep = replacer(match)
-            else:
-                rep = [match.entrydata]
-            tokens[match.start:match.end] = rep
-        return tokens
+            yield from tokens[last:match.start]
+            yield from self._replacement(replacer, match)
+            last = match.end
+        yield from tokens[last:]
+
+    def _replace(self, tokens, fromidx, toidx, getter, replacer, matchmaker, alignment):
+        if not alignment:
+            return list(self.ireplace(tokens, fromidx, toidx, getter, replacer, matchmaker))
+        matches = self.finditer(tokens, all=False, skip=True, fromidx=fromidx, toidx=toidx, getter=getter,
+                                matchmaker=matchmaker)
+        if isinstance(tokens, PreparedTokens):
+            tokens = tokens.tokens
+        out = []
+        align = []
+        last = 0
+        for match in matches:
+            out.extend(tokens[last:match.start])
+            align.extend(range(last, match.start))
+            rep = self._replacement(replacer, match)
+            out.extend(rep)
+            align.extend([match.start] * len(rep))
+            last = match.end
+        out.extend(tokens[last:])
+        align.extend(range(last, len(tokens)))
+        return out, align
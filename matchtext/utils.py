@@ -1,3 +1,11 @@
+import sys
+import copy
+import types
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict, Counter
+
 
 def thisorthat(this, that):
     """
@@ -10,3 +18,705 @@ def thisorthat(this, that):
         return that
     else:
         return this
+
+
+# The overlap resolution strategies supported by the find methods of the matchers
+RESOLVE_LEFTMOST_LONGEST = "leftmost-longest"
+RESOLVE_LONGEST = "longest"
+RESOLVE_PRIORITY = "priority"
+RESOLVE_STRATEGIES = (RESOLVE_LEFTMOST_LONGEST, RESOLVE_LONGEST, RESOLVE_PRIORITY)
+
+
+def resolve_overlaps(matches, strategy, priority=None):
+    """
+    Select a set of non-overlapping matches from a list of possibly overlapping matches.
+    Matches must have start and end attributes, the end offset is exclusive.
+
+    Strategies:
+    * "leftmost-longest": scan from left to right, at each start offset take the longest match and
+      continue after it
+    * "longest": greedily take the longest match anywhere, then the longest of the remaining ones that
+      does not overlap with any match already taken etc. Ties are broken by the smaller start offset.
+    * "priority": like "longest" but take matches in order of decreasing priority(match.entrydata),
+      ties are broken by length and then start offset.
+
+    This runs in O(n log n + l) for n matches with a total length of l (for the sorting and checking the
+    offsets of each match).
+
+    :param matches: list of matches
+    :param strategy: one of the strategy names
+    :param priority: function that returns a sortable priority for the entry data of a match, required
+      for strategy "priority"
+    :return: list of selected matches, sorted by start offset
+    """
+    if strategy == RESOLVE_LEFTMOST_LONGEST:
+        ret = []
+        last = None
+        for m in sorted(matches, key=lambda m: (m.start, -m.end)):
+            if last is None or m.start >= last:
+                ret.append(m)
+                last = m.end
+        return ret
+    if strategy == RESOLVE_LONGEST:
+        ordered = sorted(matches, key=lambda m: (m.start - m.end, m.start))
+    elif strategy == RESOLVE_PRIORITY:
+        if priority is None:
+            raise ValueError("A priority function is required for overlap resolution strategy 'priority'")
+        # stable sorts: first by length and start, then by priority
+        ordered = sorted(matches, key=lambda m: (m.start - m.end, m.start))
+        ordered.sort(key=lambda m: priority(m.entrydata), reverse=True)
+    else:
+        raise ValueError(f"Unknown overlap resolution strategy {strategy}, must be one of {RESOLVE_STRATEGIES}")
+    if not ordered:
+        return []
+    # mark the offsets covered by the selected matches, a match can be selected if none of its offsets is
+    # marked yet
+    base = min(m.start for m in ordered)
+    covered = bytearray(max(m.end for m in ordered) - base)
+    selected = []
+    for m in ordered:
+        start = m.start - base
+        end = m.end - base
+        if covered.find(1, start, end) >= 0:
+            continue
+        covered[start:end] = b"\x01" * (end - start)
+        selected.append(m)
+    selected.sort(key=lambda m: m.start)
+    return selected
+
+
+class LRUCache:
+    """
+    A simple bounded cache which evicts the least recently used entries and counts hits and misses.
+    The cache can be bounded by the number of entries and optionally by the total weight of the entries,
+    e.g. their approximate size in bytes.
+    The cache can be used from several threads, e.g. by a matcher used from an executor, see async_find, only the
+    hit and miss counts may then be inexact.
+    """
+
+    def __init__(self, maxsize, maxweight=None):
+        """
+        Create the cache.
+        :param maxsize: maximum number of entries to keep
+        :param maxweight: if not None, the maximum total weight of all entries to keep
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the value for key and mark it as recently used, or default if not in the cache.
+        """
+        # no lock for the frequent lookups: each dict operation is atomic, the entry may just get evicted by
+        # another thread in between
+        try:
+            value, _ = self._data[key]
+            self._data.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value, weight=1):
+        """
+        Add or replace the value for key, evicting least recently used entries while the cache is too big.
+        A value with a weight bigger than maxweight is not stored at all.
+        :param key: the key
+        :param value: the value
+        :param weight: the weight of the value
+        """
+        with self._lock:
+            data = self._data
+            old = data.pop(key, None)
+            if old is not None:
+                self.weight -= old[1]
+            if self.maxweight is not None and weight > self.maxweight:
+                return
+            data[key] = (value, weight)
+            self.weight += weight
+            while len(data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+                _, (_, w) = data.popitem(last=False)
+                self.weight -= w
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all entries, keep the hit and miss counts.
+        """
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self):
+        """
+        Return a dictionary with the cache statistics: size, maxsize, weight, maxweight, hits, misses,
+        evictions, hitrate.
+        """
+        lookups = self.hits + self.misses
+        return dict(size=len(self._data), maxsize=self.maxsize, weight=self.weight, maxweight=self.maxweight,
+                    hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    hitrate=self.hits / lookups if lookups else 0.0)
+
+
+def content_key(doc, getter=None):
+    """
+    Return a digest of the content of a document, which is either a string, a bytes-like object or a sequence
+    of tokens.
+    For a sequence of tokens, the digest is calculated from the types and strings of all tokens, retrieved with
+    the getter if it is not None, so that e.g. the tokens 1 and "1" give different digests.
+    :param doc: a string, bytes-like object or sequence of tokens
+    :param getter: function to get the string from a token
+    :return: the digest as bytes
+    """
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(doc, str):
+        h.update(b"s")
+        h.update(doc.encode("utf-8", "surrogatepass"))
+        return h.digest()
+    try:
+        # bytes-like objects
+        view = memoryview(doc)
+    except TypeError:
+        h.update(b"t")
+        for token in doc:
+            if getter is not None:
+                token = getter(token)
+            if type(token) is str:
+                h.update(b"s")
+                token = token.encode("utf-8", "surrogatepass")
+            else:
+                # tokens of different types can have the same string
+                h.update(b"o")
+                tokentype = type(token)
+                token = f"{tokentype.__module__}.{tokentype.__qualname__}:{token}".encode("utf-8", "surrogatepass")
+            # prefix each token with its length so that token boundaries are part of the digest
+            h.update(len(token).to_bytes(4, "little"))
+            h.update(token)
+    else:
+        h.update(b"b")
+        h.update(view)
+    return h.digest()
+
+
+def estimate_size(result):
+    """
+    Return the approximate size in bytes of a find or replace result: a string or a list of matches or tokens.
+    Only the list, its elements and the match strings are counted, not any shared data.
+    :param result: the result
+    :return: approximate size in bytes
+    """
+    size = sys.getsizeof(result)
+    if isinstance(result, list):
+        for el in result:
+            size += sys.getsizeof(el)
+            match = getattr(el, "match", None)
+            if match is not None:
+                size += sys.getsizeof(match)
+    return size
+
+
+_MISSING = object()
+
+# objects not counted by deep_sizeof
+_NOT_SIZED = (type, types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.ModuleType)
+
+
+def cached(cache, key, func, counter=None):
+    """
+    Return the value cached for key or call func, cache its result for key and return it.
+    If the cache has a maximum weight, the weight of a result is its estimated size in bytes.
+    The cached value itself is never returned, only a copy (see _copy_result), so that callers can modify
+    the result without changing what later calls get.
+    :param cache: a LRUCache
+    :param key: the key
+    :param func: function without parameters that calculates the value
+    :param counter: if not None, a matcher whose hitcounts dict, if not None, gets updated by func: the counts
+      added by func are cached together with the value and added again each time the cached value is used
+    :return: a copy of the value
+    """
+    if counter is not None and counter.hitcounts is not None:
+        value, counts = cached(cache, key, lambda: _counted(counter, func))
+        hitcounts = counter.hitcounts
+        for entry, n in counts.items():
+            hitcounts[entry] = hitcounts.get(entry, 0) + n
+        return value
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = func()
+        cache.put(key, value, estimate_size(value) if cache.maxweight is not None else 1)
+    return _copy_result(value)
+
+
+def _counted(counter, func):
+    """
+    Call func with empty hitcounts of counter and return the result and the hits counted by func.
+    """
+    hitcounts = counter.hitcounts
+    counter.hitcounts = dict()
+    try:
+        value = func()
+    finally:
+        counts = counter.hitcounts
+        counter.hitcounts = hitcounts
+    return value, counts
+
+
+def _copy_result(result):
+    """
+    Return a copy of a find or replace result: lists and tuples get copied, matches (objects with start and end
+    attributes) in them get copied, including a list in their match field. Anything else is shared.
+    """
+    if isinstance(result, tuple):
+        return tuple(_copy_result(el) for el in result)
+    if isinstance(result, list):
+        return [_copy_match(el) for el in result]
+    return result
+
+
+def _copy_match(obj):
+    if not (hasattr(obj, "start") and hasattr(obj, "end")):
+        return obj
+    obj = copy.copy(obj)
+    if isinstance(obj.match, list):
+        obj.match = list(obj.match)
+    return obj
+
+
+def _freeze(obj):
+    """
+    Return a hashable key representing the value of obj, including the types, so that e.g. 1 and True or
+    [1] and (1,) get different keys. Raises TypeError if obj contains something unhashable that cannot be frozen.
+    """
+    if isinstance(obj, dict):
+        return dict, frozenset((_freeze(k), _freeze(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj), tuple(_freeze(x) for x in obj)
+    if isinstance(obj, (set, frozenset)):
+        return type(obj), frozenset(_freeze(x) for x in obj)
+    hash(obj)
+    return type(obj), obj
+
+
+class DataTable:
+    """
+    Table of deduplicated entry data: data that is equal is stored only once and referred to by a small
+    integer handle. Lists of handles (for entries added with append=True) are stored as compact arrays.
+
+    Dicts, lists, tuples and sets are compared by value, other data must be hashable to get deduplicated,
+    unhashable data is stored without deduplication. Note that since equal data is shared, modifying the data
+    of one match modifies it for all entries with equal data.
+
+    A table can be shared by several matchers.
+    """
+
+    def __init__(self):
+        self.items = []
+        self._index = dict()
+        self.ninterned = 0
+
+    def intern(self, data):
+        """
+        Return the handle for data, adding data to the table if no equal data is stored already.
+        :param data: the data
+        :return: integer handle
+        """
+        self.ninterned += 1
+        try:
+            key = _freeze(data)
+        except TypeError:
+            key = None
+        if key is not None:
+            handle = self._index.get(key)
+            if handle is not None:
+                return handle
+        handle = len(self.items)
+        self.items.append(data)
+        if key is not None:
+            self._index[key] = handle
+        return handle
+
+    @staticmethod
+    def new_list(handle):
+        """
+        Return a new compact list of handles containing the given handle.
+        """
+        return array("l", (handle,))
+
+    def resolve(self, ref):
+        """
+        Return the data for a handle or a list of data for a compact list of handles.
+        :param ref: handle or list of handles
+        :return: data or list of data
+        """
+        if isinstance(ref, int):
+            return self.items[ref]
+        items = self.items
+        return [items[h] for h in ref]
+
+    def __getitem__(self, handle):
+        return self.items[handle]
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self):
+        """
+        Return a dictionary with the number of stored items and the number of intern calls.
+        """
+        return dict(size=len(self.items), interned=self.ninterned)
+
+
+def interned_matchmaker(table, defaultdata, matchmaker, lazymatchclass):
+    """
+    Return a matchmaker for a matcher that stores data handles from a DataTable instead of the entry data.
+    The returned matchmaker gets called with the data handle instead of the entry data: if matchmaker
+    is None, it creates instances of lazymatchclass, which only look up the entry data when it is accessed,
+    otherwise it resolves the entry data and calls matchmaker.
+    :param table: the DataTable
+    :param defaultdata: the data to use if the entry data is None
+    :param matchmaker: the original matchmaker or None
+    :param lazymatchclass: the lazy match class to use
+    :return: matchmaker function
+    """
+    if matchmaker is None:
+        def lazymatchmaker(start, end, match, ref, matcherdata):
+            return lazymatchclass(start, end, match, ref, matcherdata, table, defaultdata)
+        return lazymatchmaker
+
+    def resolvingmatchmaker(start, end, match, ref, matcherdata):
+        return matchmaker(start, end, match, thisorthat(table.resolve(ref), defaultdata), matcherdata)
+    return resolvingmatchmaker
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Return the approximate deep size in bytes of obj: the size of obj and all objects reachable from it through
+    dicts, lists, tuples, sets, instance dictionaries and slots. Each object is only counted once, classes,
+    functions and modules are not counted. This does not use recursion, so deeply nested structures are fine.
+    :param obj: the object
+    :param seen: a set of ids of objects already counted, will be updated
+    :return: size in bytes
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _NOT_SIZED):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        else:
+            d = getattr(o, "__dict__", None)
+            if d is not None:
+                stack.append(d)
+            for cls in type(o).__mro__:
+                slots = cls.__dict__.get("__slots__", ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                for slot in slots:
+                    value = getattr(o, slot, _MISSING)
+                    if value is not _MISSING:
+                        stack.append(value)
+    return size
+
+
+async def async_finditer(finditer, length, skip, fromidx, toidx, slicesize):
+    """
+    Generate the matches of finditer asynchronously: the start positions from fromidx to toidx are processed
+    in slices of slicesize positions and control is given back to the event loop after each slice. A match
+    may extend beyond the end of its slice, if skip is True the next slice starts after the end of the last match.
+    :param finditer: a function that takes the keyword arguments fromidx, toidx and maxstart and returns the
+      generator of matches of the matcher's finditer. The matches must have an end attribute.
+    :param length: the length of the text or token sequence
+    :param skip: the skip parameter passed to finditer
+    :param fromidx: index where to start finding
+    :param toidx: index where to stop finding (the last index actually used)
+    :param slicesize: maximum number of start positions processed without giving back control
+    :return: an asynchronous generator of matches
+    """
+    import asyncio
+    if slicesize < 1:
+        raise ValueError("slicesize must be at least 1")
+    if fromidx is None:
+        fromidx = 0
+    if toidx is None or toidx >= length:
+        toidx = length - 1
+    start = fromidx
+    while start <= toidx:
+        maxstart = min(start + slicesize - 1, toidx)
+        nextstart = maxstart + 1
+        for match in finditer(fromidx=start, toidx=toidx, maxstart=maxstart):
+            if skip and match.end > nextstart:
+                nextstart = match.end
+            yield match
+        start = nextstart
+        await asyncio.sleep(0)
+
+
+async def async_find(afinditer, find, length, executor_threshold, executor):
+    """
+    Return the list of matches, either collected from the asynchronous generator afinditer or, if
+    executor_threshold is not None and length is at least executor_threshold, from running find in the executor.
+    :param afinditer: function without parameters returning the asynchronous generator of matches
+    :param find: function without parameters returning the list of matches
+    :param length: the length of the text or token sequence
+    :param executor_threshold: minimum length for running find in the executor, if None never
+    :param executor: the executor to use, if None the default executor of the event loop
+    :return: list of matches
+    """
+    # find may run in a thread of the executor while the event loop uses the same matcher: the caches of the
+    # matchers are thread-safe (see LRUCache), the hit counts are only exact if nothing else runs concurrently
+    if executor_threshold is not None and length >= executor_threshold:
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(executor, find)
+    return [match async for match in afinditer()]
+
+
+def refind_matches(finditer, matches, length, offset, removed, inserted, maxdepth, skip, ignored=None):
+    """
+    Update the matches found in a text or token sequence after an edit, re-scanning only the part
+    which can be affected by the edit.
+
+    Matches starting so far before the edit that even an entry of maxdepth elements cannot reach the edit
+    are kept. From there the new text is scanned up to the end of the edit and then, if skip is True, until the
+    scan arrives at a position which was also visited by the scan of the old text. All following old matches
+    are still valid and get shifted by the change in length. The old matches are left unchanged (they may be
+    shared with a result cache), shifted matches are copies, see moved_match.
+
+    :param finditer: a function that takes the keyword arguments fromidx and maxstart and returns the generator
+      of matches of the matcher's finditer on the new text. The matches must have start and end attributes.
+    :param matches: the list of matches of the old text, found with the same parameters
+    :param length: the length of the new text
+    :param offset: the index of the edit
+    :param removed: the number of elements removed at offset from the old text
+    :param inserted: the number of elements inserted at offset in the new text
+    :param maxdepth: the maximum number of (not ignored) elements of an entry
+    :param skip: the skip parameter passed to finditer
+    :param ignored: if not None, a function that returns True if the element at the given index is ignored
+    :return: the list of matches of the new text
+    """
+    delta = inserted - removed
+    editend = offset + inserted
+    # go back maxdepth-1 not ignored elements from the edit: a match starting before that cannot reach it
+    windowstart = offset
+    nelements = 0
+    while windowstart > 0:
+        if ignored is None or not ignored(windowstart - 1):
+            if nelements >= maxdepth - 1:
+                break
+            nelements += 1
+        windowstart -= 1
+    # binary search for the first match starting in the window
+    idx = 0
+    hi = len(matches)
+    while idx < hi:
+        mid = (idx + hi) // 2
+        if matches[mid].start < windowstart:
+            idx = mid + 1
+        else:
+            hi = mid
+    newmatches = matches[:idx]
+    i = windowstart
+    if skip and newmatches:
+        i = max(i, newmatches[-1].end)
+    if i < editend:
+        for match in finditer(fromidx=i, maxstart=editend - 1):
+            newmatches.append(match)
+            if skip and match.end > i:
+                i = match.end
+        i = max(i, editend)
+    old = matches
+    maxend = -1
+    while True:
+        oldpos = i - delta
+        while idx < len(old) and old[idx].start < oldpos:
+            maxend = max(maxend, old[idx].end)
+            idx += 1
+        if not skip or maxend <= oldpos or i >= length:
+            break
+        # the old scan skipped this position, so the following matches may differ: scan one more position
+        nexti = i + 1
+        for match in finditer(fromidx=i, maxstart=i):
+            newmatches.append(match)
+            nexti = max(nexti, match.end)
+        i = nexti
+    if delta:
+        newmatches.extend(moved_match(match, match.start + delta, match.end + delta) for match in old[idx:])
+    else:
+        newmatches.extend(old[idx:])
+    return newmatches
+
+
+def moved_match(match, start, end):
+    """
+    Return a copy of the match with different start and end offsets, the match itself is left unchanged.
+    :param match: the match object, must have start and end attributes and support copy.copy
+    :param start: the new start offset
+    :param end: the new end offset
+    :return: the new match object
+    """
+    match = copy.copy(match)
+    match.start = start
+    match.end = end
+    return match
+
+
+def _datakey(start, end, match, entrydata, matcherdata):
+    """
+    Default key for count_matches: the entry data made hashable with _hashable, e.g. a list of data (entries
+    added with append=True) as a tuple.
+    """
+    return _hashable(entrydata)
+
+
+def _hashable(obj):
+    """
+    Return obj with all dicts, lists and sets in it replaced by frozensets of their items, tuples and frozensets,
+    so that it can be used as a key.
+    """
+    if isinstance(obj, dict):
+        return frozenset((k, _hashable(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return tuple(_hashable(x) for x in obj)
+    if isinstance(obj, set):
+        return frozenset(obj)
+    return obj
+
+
+def count_matches(finditer, key=None):
+    """
+    Count the matches generated by finditer without creating match objects.
+    :param finditer: a function that takes the keyword argument matchmaker and returns the generator of
+      matches of the matcher's finditer
+    :param key: a function that takes start, end, match, entrydata, matcherdata of a match and returns the
+      hashable key to count, if None the entry data with dicts, lists and sets as frozensets of their items,
+      tuples and frozensets
+    :return: a Counter mapping each key to the number of matches
+    """
+    if key is None:
+        key = _datakey
+    counts = Counter()
+
+    def counter(start, end, match, entrydata, matcherdata):
+        counts[key(start, end, match, entrydata, matcherdata)] += 1
+
+    for _ in finditer(matchmaker=counter):
+        pass
+    return counts
+
+
+def _nomatch(start, end, match, entrydata, matcherdata):
+    return True
+
+
+class Budget:
+    """
+    Limit for the walks of a finditer call: the maximum number of elements (including ignored elements) examined
+    for the matches at a start position. The names of the budgets which were exceeded get added to exceeded.
+    """
+    __slots__ = ("max_walk_depth", "exceeded")
+
+    def __init__(self, max_walk_depth=None):
+        self.max_walk_depth = max_walk_depth
+        self.exceeded = set()
+
+
+class MatchList(list):
+    """
+    The list of matches returned by find when a budget was given. If partial is True, finding was stopped
+    or walks were cut short because a budget was exceeded, exceeded contains the names of the budgets.
+    """
+
+    def __init__(self, matches=(), exceeded=()):
+        super().__init__(matches)
+        self.exceeded = frozenset(exceeded)
+
+    @property
+    def partial(self):
+        return bool(self.exceeded)
+
+
+BUDGETS = ("max_matches", "max_walk_depth", "deadline")
+
+
+# number of matches collected between checks of the deadline, see collect_matches
+DEADLINE_CHECK_MATCHES = 256
+
+
+def collect_matches(finditer, length, skip, fromidx, toidx, max_matches, deadline, budget, slicesize=4096):
+    """
+    Collect the matches of finditer until max_matches matches are found or the deadline has passed. The
+    deadline is checked after each slice of slicesize start positions, see async_finditer, and after every
+    DEADLINE_CHECK_MATCHES matches.
+    :param finditer: a function that takes the keyword arguments fromidx, toidx and maxstart and returns the
+      generator of matches of the matcher's finditer. The matches must have an end attribute.
+    :param length: the length of the text or token sequence
+    :param skip: the skip parameter passed to finditer
+    :param fromidx: index where to start finding
+    :param toidx: index where to stop finding (the last index actually used)
+    :param max_matches: if not None, the maximum number of matches to return
+    :param deadline: if not None, the time.monotonic() time after which no further slice is processed
+    :param budget: the Budget passed to finditer, the exceeded budgets are added to it
+    :param slicesize: the number of start positions between checks of the deadline
+    :return: MatchList
+    """
+    import time
+    if fromidx is None:
+        fromidx = 0
+    if toidx is None or toidx >= length:
+        toidx = length - 1
+    matches = []
+    start = fromidx
+    while start <= toidx:
+        if deadline is not None:
+            if time.monotonic() > deadline:
+                budget.exceeded.add("deadline")
+                break
+            maxstart = min(start + slicesize - 1, toidx)
+        else:
+            maxstart = toidx
+        nextstart = maxstart + 1
+        for match in finditer(fromidx=start, toidx=toidx, maxstart=maxstart):
+            if max_matches is not None and len(matches) >= max_matches:
+                budget.exceeded.add("max_matches")
+                return MatchList(matches, budget.exceeded)
+            if skip and match.end > nextstart:
+                nextstart = match.end
+            matches.append(match)
+            # with all=True and skip=False, a slice can have very many matches
+            if deadline is not None and not len(matches) % DEADLINE_CHECK_MATCHES and time.monotonic() > deadline:
+                budget.exceeded.add("deadline")
+                return MatchList(matches, budget.exceeded)
+        start = nextstart
+    return MatchList(matches, budget.exceeded)
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import random
+import pytest
+
+
+def _random_data(seed=1, nentries=300, maxlen=6):
+    rnd = random.Random(seed)
+    alphabet = "abcdeABC "
+    entries = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, maxlen))).strip() or "a"
+               for _ in range(nentries)]
+    text = "".join(rnd.choice(alphabet) for _ in range(2000))
+    return entries, text
+
+
+@pytest.fixture
+def random_data():
+    """
+    Function to create random entries and a random text to find them in: random_data(seed, nentries, maxlen)
+    returns the list of entries and the text.
+    """
+    return _random_data
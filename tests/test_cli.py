@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import json
+from matchtext.cli import get_args, run
+
+GAZ = "New York\tCITY\nYork\tNAME\nnew\n"
+TEXTS = ["I live in New York", "nothing here", "new York is new"]
+
+
+def _run(tmp_path, extra, texts=TEXTS, jsonl=False):
+    gaz = tmp_path / "gaz.tsv"
+    gaz.write_text(GAZ, encoding="utf-8")
+    infile = tmp_path / "in.txt"
+    if jsonl:
+        infile.write_text("".join(json.dumps(dict(id=i, text=t)) + "\n" for i, t in enumerate(texts)), encoding="utf-8")
+    else:
+        infile.write_text("".join(t + "\n" for t in texts), encoding="utf-8")
+    outfile = tmp_path / "out.txt"
+    args = get_args(["-g", str(gaz), "-o", str(outfile), str(infile)] + extra)
+    with open(str(outfile), "wt", encoding="utf-8") as outfp:
+        timer = run(args, outfp)
+    assert timer.stats("annotate")["count"] == 1
+    return outfile.read_text(encoding="utf-8").splitlines()
+
+
+def test_cli_find1(tmp_path):
+    lines = _run(tmp_path, [])
+    assert len(lines) == 3
+    ms = json.loads(lines[0])["matches"]
+    assert ms == [dict(start=10, end=18, match="New York", data="CITY")]
+    assert json.loads(lines[1])["matches"] == []
+
+
+def test_cli_replace1(tmp_path):
+    lines = _run(tmp_path, ["--replace", "--tokens", "--mapfunc", "lower"])
+    assert lines == ["I live in CITY", "nothing here", "CITY is new"]
+
+
+def test_cli_parallel1(tmp_path):
+    texts = [f"{i} York new" for i in range(50)]
+    lines = _run(tmp_path, ["--jsonl", "--workers", "2", "--batchsize", "3", "--maxpending", "2"], texts=texts,
+                 jsonl=True)
+    assert len(lines) == 50
+    for i, line in enumerate(lines):
+        obj = json.loads(line)
+        assert obj["id"] == i
+        assert [m["data"] for m in obj["matches"]] == ["NAME", "new"]
+
+
+def test_cli_save1(tmp_path):
+    saved = str(tmp_path / "matcher.pickle")
+    for extra in ([], ["--tokens", "--mapfunc", "lower", "--all"]):
+        lines = _run(tmp_path, extra + ["--save", saved])
+        assert _run(tmp_path, extra + ["-g", saved, "--gazformat", "pickle"]) == lines
+
+
+def test_cli_jsonl1(tmp_path):
+    gaz = tmp_path / "gaz.tsv"
+    gaz.write_text(GAZ, encoding="utf-8")
+    infile = tmp_path / "in.jsonl"
+    infile.write_text(json.dumps(dict(text=TEXTS[0])) + "\n\n  \n" + json.dumps(dict(text=TEXTS[2])) + "\n\n",
+                      encoding="utf-8")
+    outfile = tmp_path / "out.jsonl"
+    args = get_args(["-g", str(gaz), "-o", str(outfile), "--jsonl", str(infile)])
+    with open(str(outfile), "wt", encoding="utf-8") as outfp:
+        run(args, outfp)
+    lines = outfile.read_text(encoding="utf-8").splitlines()
+    assert [[m["data"] for m in json.loads(line)["matches"]] for line in lines] == [["CITY"], ["new", "NAME", "new"]]
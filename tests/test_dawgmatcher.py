@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from matchtext.dawgmatcher import DawgMatcher
+from matchtext.stringmatcher import StringMatcher
+
+
+def test_dm_find1(random_data):
+    entries, text = random_data()
+    for kwargs in (dict(), dict(mapfunc=str.lower), dict(ignorefunc=str.isspace)):
+        sm = StringMatcher(**kwargs)
+        for i, e in enumerate(entries):
+            sm.add(e, data=i, append=True)
+        dm = DawgMatcher.build(((e, i) for i, e in enumerate(entries)), append=True, **kwargs)
+        for all in (False, True):
+            for skip in (False, True):
+                assert dm.find(text, all=all, skip=skip) == sm.find(text, all=all, skip=skip)
+        assert dm.replace(text) == sm.replace(text)
+        for e in entries:
+            assert dm[e] == sm[e]
+        assert dm.get("xyz") is None
+
+
+def test_dm_suffixes1():
+    names = ["Acme", "Bolt", "Crane", "Delta", "Echo"]
+    entries = [n + s for n in names for s in (" Inc.", " GmbH", " Ltd")]
+    dm = DawgMatcher(hitcounts=True)
+    sm = StringMatcher()
+    for e in sorted(entries):
+        dm.add(e, data=e.upper())
+        sm.add(e, data=e.upper())
+    assert dm.stats()["nodes"] < sm.stats()["nodes"] / 2
+    assert dm.stats(memory=False)["entries"] == 15
+    assert dm["Crane GmbH"] == "CRANE GMBH"
+    assert dm.find("see Bolt Ltd and Echo Inc.") == sm.find("see Bolt Ltd and Echo Inc.")
+    assert dm.hit_counts() == {"Bolt Ltd": 1, "Echo Inc.": 1}
+    with pytest.raises(ValueError):
+        dm.add("Zeta Inc.")
+
+
+def test_dm_sorted1():
+    dm = DawgMatcher()
+    dm.add("b", data=1)
+    with pytest.raises(ValueError):
+        dm.add("a", data=2)
+    dm.add("b", data=3)
+    assert dm["b"] == 3
+    dm = DawgMatcher(bytesmode=True)
+    dm.add("Zürich", data=1)
+    assert dm.find("in Zürich".encode("utf-8"))[0].start == 3
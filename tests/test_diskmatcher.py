@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from matchtext.diskmatcher import DiskMatcher
+from matchtext.stringmatcher import StringMatcher
+from matchtext.tokenmatcher import TokenMatcher
+
+
+def test_dim_string1(tmp_path, random_data):
+    entries, text = random_data()
+    sm = StringMatcher(mapfunc=str.lower)
+    for i, e in enumerate(entries):
+        sm.add(e, data=i, append=True)
+    path = str(tmp_path / "gaz.db")
+    DiskMatcher.build(path, ((e, i) for i, e in enumerate(entries)), append=True, mapfunc=str.lower).close()
+    with DiskMatcher(path, cachesize=5, mapfunc=str.lower) as dm:
+        for all in (False, True):
+            for skip in (False, True):
+                assert dm.find(text, all=all, skip=skip) == sm.find(text, all=all, skip=skip)
+        assert dm.replace(text) == sm.replace(text)
+        assert dm.matcher.get("a") == sm.get("a")
+        stats = dm.cache_stats()["pages"]
+        assert stats["size"] <= 5
+        assert stats["hits"] > 0
+        assert stats["loaded"] > stats["size"]
+
+
+def test_dim_token1(tmp_path, random_data):
+    entries, text = random_data(2)
+    entries = [e.split() for e in entries]
+    tokens = text.split()
+    for pagedepth in (1, 2):
+        tm = TokenMatcher()
+        for i, e in enumerate(entries):
+            tm.add(e, data=i)
+        path = str(tmp_path / f"gaz{pagedepth}.db")
+        with DiskMatcher.build(path, ((e, i) for i, e in enumerate(entries)), matcher="token",
+                               pagedepth=pagedepth) as dm:
+            assert dm.find(tokens, all=True, skip=False) == tm.find(tokens, all=True, skip=False)
+            assert dm.matcher.stats(memory=False) == tm.stats(memory=False)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import subprocess
+
+# generous upper bound for importing the package and both matchers in a fresh interpreter, in microseconds
+IMPORT_BUDGET_US = 100000
+
+
+def _import_times(statement):
+    """
+    Run statement in a fresh interpreter with -X importtime, return a dict mapping each module to a tuple
+    (nesting level, cumulative microseconds).
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        cumulative = cumulative.strip()
+        if cumulative.isdigit():
+            level = (len(module) - len(module.lstrip()) - 1) // 2
+            times[module.strip()] = (level, int(cumulative))
+    return times
+
+
+def test_import_budget1():
+    times = _import_times("import matchtext.stringmatcher, matchtext.tokenmatcher")
+    assert "pkg_resources" not in times
+    total = sum(t for m, (level, t) in times.items() if level == 0 and m.startswith("matchtext"))
+    assert total < IMPORT_BUDGET_US
+
+
+def test_import_lazy1():
+    times = _import_times("import matchtext")
+    assert "matchtext.stringmatcher" not in times
+    assert "matchtext.tokenmatcher" not in times
+    import matchtext
+    assert matchtext.StringMatcher is matchtext.stringmatcher.StringMatcher
+    assert isinstance(matchtext.__version__, str)
@@ -0,0 +1,64 @@
+import random
+import pytest
+from matchtext import ngrammatcher
+from matchtext.tokenmatcher import TokenMatcher
+from matchtext.ngrammatcher import NgramMatcher
+
+
+def _matchers(**kwargs):
+    rnd = random.Random(1)
+    words = ["a", "b", "c", "D", "e", ","]
+    tm = TokenMatcher(**kwargs)
+    nm = NgramMatcher(**kwargs)
+    for i in range(60):
+        entry = [rnd.choice(words) for _ in range(rnd.randint(1, 4))]
+        tm.add(entry, data=i, append=True)
+        nm.add(entry, data=i, append=True)
+    tokens = [rnd.choice(words + ["x"]) for _ in range(300)]
+    return tm, nm, tokens
+
+
+def test_nm_same1():
+    for kwargs in [{}, dict(mapfunc=str.lower, ignorefunc=lambda t: t == ","), dict(datatable=True)]:
+        tm, nm, tokens = _matchers(**kwargs)
+        for all in (False, True):
+            for skip in (False, True):
+                assert nm.find(tokens, all=all, skip=skip) == tm.find(tokens, all=all, skip=skip)
+        assert nm.find(tokens, fromidx=7, toidx=40) == tm.find(tokens, fromidx=7, toidx=40)
+        assert list(nm.finditer(tokens, maxstart=20)) == list(tm.finditer(tokens, maxstart=20))
+        assert nm.find(nm.prepare(tokens), all=True) == tm.find(tokens, all=True)
+        # short texts are matched by the tree walk, the hash tables are not even built
+        assert nm.tables is None
+
+
+def test_nm_budget1():
+    tm, nm, tokens = _matchers()
+    assert nm.find(tokens, max_walk_depth=2) == tm.find(tokens, max_walk_depth=2)
+    assert nm.find(tokens, deadline=1e12) == tm.find(tokens)
+    assert nm.find([]) == []
+
+
+def test_nm_numpy1(monkeypatch):
+    pytest.importorskip("numpy")
+    for kwargs in [{}, dict(mapfunc=str.lower, ignorefunc=lambda t: t == ","), dict(datatable=True)]:
+        tm, nm, tokens = _matchers(**kwargs)
+        nm.usenumpy = True
+        for slicestarts in (7, ngrammatcher.SLICE_STARTS):
+            monkeypatch.setattr(ngrammatcher, "SLICE_STARTS", slicestarts)
+            for all in (False, True):
+                for skip in (False, True):
+                    assert nm.find(tokens, all=all, skip=skip) == tm.find(tokens, all=all, skip=skip)
+            assert nm.find(tokens, fromidx=7, toidx=40) == tm.find(tokens, fromidx=7, toidx=40)
+            assert list(nm.finditer(tokens, maxstart=20)) == list(tm.finditer(tokens, maxstart=20))
+            assert nm.find(nm.prepare(tokens), all=True) == tm.find(tokens, all=True)
+            assert nm.first(tokens) == tm.first(tokens)
+            assert nm.count(tokens) == tm.count(tokens)
+
+
+def test_nm_nonumpy1(monkeypatch):
+    monkeypatch.setattr(ngrammatcher, "_HAVE_NUMPY", False)
+    tm, nm, tokens = _matchers()
+    tokens = tokens * 10
+    assert len(tokens) >= ngrammatcher.NUMPY_MIN_TOKENS
+    assert nm.find(tokens, all=True) == tm.find(tokens, all=True)
+    assert nm.tables is None
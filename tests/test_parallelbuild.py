@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from matchtext.parallelbuild import build_parallel
+from matchtext.stringmatcher import StringMatcher
+from matchtext.tokenmatcher import TokenMatcher
+
+
+def test_pb_string1(random_data):
+    entries, text = random_data(maxlen=5)
+    sm = StringMatcher(mapfunc=str.lower, prefilter=True)
+    for i, e in enumerate(entries):
+        sm.add(e, data=i, append=True)
+    for processes in (1, 2):
+        psm = build_parallel(StringMatcher(mapfunc=str.lower, prefilter=True),
+                             ((e, i) for i, e in enumerate(entries)), append=True, processes=processes)
+        assert psm.maxdepth == sm.maxdepth
+        assert psm.prefilter_stats() == sm.prefilter_stats()
+        for all in (False, True):
+            assert psm.find(text, all=all) == sm.find(text, all=all)
+
+
+def test_pb_token1(random_data):
+    entries, text = random_data(2, maxlen=5)
+    entries = [e.split() for e in entries]
+    tokens = text.split()
+    tm = TokenMatcher(ignorefunc=lambda x: x == "b", datatable=True)
+    for i, e in enumerate(entries):
+        tm.add(e, data=dict(n=i % 7))
+    ptm = build_parallel(TokenMatcher(ignorefunc=lambda x: x == "b", datatable=True),
+                         ((e, dict(n=i % 7)) for i, e in enumerate(entries)), processes=2, npartitions=5)
+    assert len(ptm.datatable) == 7
+    assert ptm.find(tokens, all=True) == tm.find(tokens, all=True)
+    assert ptm.stats(memory=False) == tm.stats(memory=False)
+
+
+def test_pb_radix1(random_data):
+    entries, text = random_data(3, maxlen=5)
+    sm = StringMatcher(radix=True)
+    for i, e in enumerate(entries):
+        sm.add(e, data=i)
+    psm = build_parallel(StringMatcher(radix=True), ((e, i) for i, e in enumerate(entries)), processes=1)
+    assert psm.stats(memory=False) == sm.stats(memory=False)
+    assert psm.find(text, all=True) == sm.find(text, all=True)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+from matchtext.runutils import StageTimer, run_start, run_stop, set_logger
+
+
+def test_ru_stagetimer1():
+    timer = StageTimer()
+    with timer.stage("outer"):
+        for i in range(3):
+            with timer.stage("inner"):
+                pass
+    stats = timer.stats()
+    assert stats["outer"]["count"] == 1
+    assert stats["inner"]["count"] == 3
+    assert stats["outer"]["total"] >= stats["inner"]["total"]
+    assert stats["inner"]["p50"] <= stats["inner"]["p99"] <= stats["inner"]["max"]
+    assert json.loads(timer.to_json())["inner"]["count"] == 3
+
+
+def test_ru_stagetimer2():
+    timer = StageTimer(maxsamples=5)
+
+    @timer.timed("work")
+    def work(x):
+        return x * 2
+
+    def run():
+        for i in range(100):
+            assert work(i) == i * 2
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = timer.stats("work")
+    assert stats["count"] == 400
+    timer.reset()
+    assert timer.stats() == {}
+
+
+def test_ru_stagetimer3():
+    timer = StageTimer()
+    with timer.stage("alloc", profile=True, tracemem=True):
+        data = [str(i) for i in range(10000)]
+    stats = timer.stats("alloc")
+    assert stats["mem_peak"] > 0
+    assert timer.profile_stats("alloc") is not None
+    assert len(data) == 10000
+
+
+def test_ru_stagetimer4():
+    timer = StageTimer()
+    with timer.stage("outer", tracemem=True):
+        data = bytearray(1000000)
+        del data
+        with timer.stage("inner", tracemem=True):
+            small = bytearray(1000)
+    assert timer.stats("outer")["mem_peak"] >= 1000000
+    assert timer.stats("inner")["mem_peak"] < 1000000
+    assert len(small) == 1000
+
+
+def test_ru_stagetimer5():
+    import tracemalloc
+    timer = StageTimer()
+    started = threading.Event()
+    finish = threading.Event()
+
+    def run():
+        with timer.stage("thread", tracemem=True):
+            started.set()
+            finish.wait()
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    with timer.stage("main", tracemem=True):
+        finish.set()
+        thread.join()
+        # the stage which started tracing has ended, but this one is still active
+        assert tracemalloc.is_tracing()
+        data = bytearray(100000)
+    assert not tracemalloc.is_tracing()
+    assert timer.stats("main")["mem_diff"] >= 100000
+    assert len(data) == 100000
+
+
+def test_ru_run1():
+    logger1 = set_logger(name="test_runutils")
+    logger2 = set_logger(name="test_runutils")
+    assert logger1 is logger2
+    outer = run_start()
+    inner = run_start()
+    _, delta_inner = run_stop(inner)
+    _, delta_outer = run_stop(outer)
+    assert delta_outer >= delta_inner >= 0
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from matchtext.shardedmatcher import ShardedMatcher
+from matchtext.stringmatcher import StringMatcher, Match
+from matchtext.tokenmatcher import TokenMatcher
+
+
+def test_shm_string1(random_data):
+    entries, text = random_data(nentries=200, maxlen=5)
+    sm = StringMatcher(mapfunc=str.lower)
+    for i, e in enumerate(entries):
+        sm.add(e, data=i, append=True)
+    with ShardedMatcher(3, processes=False, batchsize=7, mapfunc=str.lower) as shm:
+        for i, e in enumerate(entries):
+            shm.add(e, data=i, append=True)
+        assert sum(shm.stats()["nentries"]) == len(entries)
+        for all in (False, True):
+            for skip in (False, True):
+                assert shm.find(text, all=all, skip=skip) == sm.find(text, all=all, skip=skip)
+
+
+def test_shm_token1(random_data):
+    entries, text = random_data(2, nentries=200, maxlen=5)
+    entries = [e.split() for e in entries]
+    tokens = text.split()
+    tm = TokenMatcher(ignorefunc=lambda x: x == "b")
+    with ShardedMatcher(2, matcher="token", ignorefunc=tm.ignorefunc) as shm:
+        for i, e in enumerate(entries):
+            tm.add(e, data=i)
+            shm.add(e, data=i)
+        for all in (False, True):
+            for skip in (False, True):
+                assert shm.find(tokens, all=all, skip=skip) == tm.find(tokens, all=all, skip=skip)
+        assert shm.find([[t] for t in tokens], getter=lambda t: t[0]) == tm.find(tokens)
+
+
+def _failing_matchmaker(start, end, match, entrydata, matcherdata):
+    if entrydata == "bad":
+        raise ValueError("bad match")
+    return Match(start, end, match, entrydata, matcherdata)
+
+
+def test_shm_error1():
+    for processes in (False, True):
+        with ShardedMatcher(4, processes=processes) as shm:
+            for i, e in enumerate("abcdefgh"):
+                shm.add(e, data=i)
+            # the first shard fails, the replies of the others must not be taken for the next find
+            bad = [e for e in "abcdefgh" if shm.shard4key(e) == 0][0]
+            shm.add(bad, data="bad")
+            with pytest.raises(ValueError):
+                shm.find("abcdefgh", matchmaker=_failing_matchmaker)
+            assert [m.match for m in shm.find("hgfe")] == ["h", "g", "f", "e"]
+            assert [m.match for m in shm.find("hgfe")] == ["h", "g", "f", "e"]
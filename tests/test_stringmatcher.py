@@ -2,6 +2,7 @@
 
 from matchtext.stringmatcher import StringMatcher
 import sys
+import pytest
 
 
 def test_sm_find1():
@@ -151,3 +152,339 @@ def test_sm_replace1():
     rep = sm.replace(t1)
     assert rep == "3 a 1"
 
+
+
+def test_sm_find7():
+    # skipping continues after the longest match, not after the longest partial walk
+    sm = StringMatcher()
+    for i, e in enumerate(["ab", "abcd", "cx", "bc"]):
+        sm.add(e, data=i)
+    ms = sm.find("abcx")
+    assert [(m.start, m.end, m.match) for m in ms] == [(0, 2, "ab"), (2, 4, "cx")]
+    # a match can start at the last character
+    sm.add("x", data=4)
+    ms = sm.find("bx")
+    assert [(m.start, m.end) for m in ms] == [(1, 2)]
+    assert [m.match for m in sm.finditer("abcx", all=True, skip=False)] == ["ab", "bc", "cx", "x"]
+
+
+def test_sm_resolve1():
+    sm = StringMatcher()
+    for e, prio in [("abc", 1), ("cdefg", 2), ("gh", 3), ("fgh", 1)]:
+        sm.add(e, data=prio)
+    t1 = "abcdefgh"
+    ms = sm.find(t1, resolve="leftmost-longest")
+    assert [m.match for m in ms] == ["abc", "fgh"]
+    ms = sm.find(t1, resolve="longest")
+    assert [m.match for m in ms] == ["cdefg"]
+    ms = sm.find(t1, resolve="priority", priority=lambda d: d)
+    assert [m.match for m in ms] == ["abc", "gh"]
+
+
+def test_sm_resultcache1():
+    sm = StringMatcher(resultcache=10, resultcache_maxbytes=100000)
+    sm.add("word", data=1)
+    t1 = "this is a word"
+    assert sm.replace(t1) == "this is a 1"
+    assert sm.replace(t1) == "this is a 1"
+    ms1 = sm.find(t1)
+    assert sm.find(t1) == ms1
+    stats = sm.cache_stats()["resultcache"]
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert 0 < stats["weight"] <= 100000
+    sm["is"] = 2
+    assert sm.replace(t1) == "th2 2 a 1"
+    assert sm.cache_stats()["resultcache"]["size"] == 1
+
+
+def test_sm_datatable1():
+    sm = StringMatcher(datatable=True)
+    for e in ["this", "word", "words", "thisis", "his"]:
+        sm.add(e, data=dict(type="X", source="test"), append=True)
+    sm.add("word", data=dict(type="Y"), append=True)
+    sm.add("word", data=dict(source="test", type="X"), append=True)
+    assert sm.datatable.stats()["size"] == 2
+    assert sm["his"] == [dict(type="X", source="test")]
+    ms = sm.find("thisis a word")
+    assert ms[0].entrydata == [dict(type="X", source="test")]
+    assert ms[1].entrydata == [dict(type="X", source="test"), dict(type="Y"), dict(type="X", source="test")]
+    assert ms[1].match == "word"
+    assert ms[0] == ms[0]
+    plain = StringMatcher()
+    for e in ["this", "word", "words", "thisis", "his"]:
+        plain.add(e, data=dict(type="X", source="test"), append=True)
+    plain.add("word", data=dict(type="Y"), append=True)
+    plain.add("word", data=dict(source="test", type="X"), append=True)
+    assert plain.find("thisis a word") == ms
+    assert ms == plain.find("thisis a word")
+    assert ms[0] != plain.find("thisis a word")[1]
+    sm["his"] = None
+    sm.defaultdata = "DEFAULT"
+    ms = sm.find("his", matchmaker=lambda *args: args)
+    assert ms == [(0, 3, "his", "DEFAULT", None)]
+
+
+def test_sm_bytes1(tmp_path):
+    import mmap
+    sm = StringMatcher(bytesmode=True)
+    for i, e in enumerate(["Wien", "Zürich", "Genève", "Zürichsee"]):
+        sm.add(e, data=i)
+    assert sm["Zürich"] == 1
+    text = "Von Zürich über Genève nach Wien"
+    data = text.encode("utf-8")
+    ms = sm.find(data)
+    assert [(m.match, m.entrydata) for m in ms] == [("Zürich".encode("utf-8"), 1), ("Genève".encode("utf-8"), 2),
+                                                   (b"Wien", 0)]
+    assert ms[0].start == 4 and ms[0].end == 11
+    chars = sm.to_char_offsets(data, ms)
+    assert [text[m.start:m.end] for m in chars] == ["Zürich", "Genève", "Wien"]
+    assert ms[0].start == 4 and ms[0].end == 11
+    assert sm.replace(data) == "Von 1 über 2 nach 0".encode("utf-8")
+    path = tmp_path / "text.txt"
+    path.write_bytes(data)
+    with open(str(path), "rb") as infp:
+        with mmap.mmap(infp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ms = sm.find(mm)
+            assert [m.entrydata for m in ms] == [1, 2, 0]
+            ms = sm.find(memoryview(mm))
+            assert [bytes(m.match) for m in ms] == [m.encode("utf-8") for m in ["Zürich", "Genève", "Wien"]]
+            del ms
+    with pytest.raises(TypeError):
+        sm.find(text)
+
+
+def test_sm_prefilter1():
+    entries = ["New York", "New Jersey", "Ne", "X", "Yo"]
+    sm1 = StringMatcher()
+    sm2 = StringMatcher(prefilter=True)
+    for i, e in enumerate(entries):
+        sm1.add(e, data=i)
+        sm2.add(e, data=i)
+    assert sm2.prefilter_stats() == dict(maxdepth=10, nfirst=3, nbigrams=2, nsingles=1, regex=True)
+    t1 = "from New York via Nevada to New Jersey, X and Yonkers: NeX"
+    for all in (False, True):
+        for skip in (False, True):
+            assert sm1.find(t1, all=all, skip=skip) == sm2.find(t1, all=all, skip=skip)
+    assert sm2.find(t1, fromidx=6, toidx=12) == sm1.find(t1, fromidx=6, toidx=12)
+    assert StringMatcher(prefilter=True).find(t1) == []
+
+
+def test_sm_stats1():
+    sm = StringMatcher(hitcounts=True)
+    for i, e in enumerate(["ab", "abc", "x", "yz"]):
+        sm.add(e, data=i)
+    st = sm.stats()
+    assert st["nodes"] == 7
+    assert st["edges"] == 6
+    assert st["entries"] == 4
+    assert st["maxdepth"] == 3
+    assert st["depth_histogram"] == {1: 1, 2: 2, 3: 1}
+    assert st["branching_histogram"] == {0: 3, 1: 3, 3: 1}
+    assert st["memory"] > 0
+    sm.find("abc x abx")
+    sm.find("x", all=True)
+    assert sm.hit_counts() == {"abc": 1, "ab": 1, "x": 3}
+    assert sm.hit_counts(include_unused=True)["yz"] == 0
+    sm.reset_hitcounts()
+    assert sm.hit_counts() == {}
+    with pytest.raises(ValueError):
+        StringMatcher().hit_counts()
+
+
+def test_sm_stats2():
+    sm = StringMatcher(hitcounts=True, resultcache=10)
+    for i, e in enumerate(["ab", "abc", "x", "yz"]):
+        sm.add(e, data=i)
+    for _ in range(3):
+        sm.find("abc x abx")
+    sm.replace("x yz")
+    sm.replace("x yz")
+    assert sm.hit_counts() == {"abc": 3, "ab": 3, "x": 8, "yz": 2}
+
+
+def test_sm_pickle1():
+    import pickle
+    sm = StringMatcher()
+    sm.add("abc", data=1)
+    sm.add("ab", data=2)
+    sm2 = pickle.loads(pickle.dumps(sm))
+    assert sm2.find("abd abc", all=True) == sm.find("abd abc", all=True)
+    assert sm2.get("a") is None
+
+
+def test_sm_radix1():
+    import random
+    rnd = random.Random(3)
+    alphabet = "abcAB -"
+    entries = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 8))) for _ in range(300)]
+    text = "".join(rnd.choice(alphabet) for _ in range(3000))
+    for kwargs in (dict(), dict(mapfunc=str.lower), dict(ignorefunc=lambda c: c == "-")):
+        sm = StringMatcher(**kwargs)
+        rm = StringMatcher(radix=True, **kwargs)
+        for i, e in enumerate(entries):
+            sm.add(e, data=i, append=True)
+            rm.add(e, data=i, append=True)
+        assert rm.stats(memory=False)["nodes"] < sm.stats(memory=False)["nodes"]
+        assert rm.stats(memory=False)["depth_histogram"] == sm.stats(memory=False)["depth_histogram"]
+        for all in (False, True):
+            for skip in (False, True):
+                assert rm.find(text, all=all, skip=skip) == sm.find(text, all=all, skip=skip)
+        assert rm.find(text, fromidx=10, toidx=50) == sm.find(text, fromidx=10, toidx=50)
+        rm.reset_hitcounts()
+        nmatches = len(rm.find(text))
+        assert sum(rm.hit_counts().values()) == nmatches
+        for e in entries:
+            assert rm.get(e) == sm.get(e)
+        assert rm.get("abcabcabcabc") is None
+
+
+def test_sm_radix2():
+    sm = StringMatcher(radix=True)
+    sm.add("international", data=1)
+    assert sm.stats(memory=False)["nodes"] == 2
+    sm["intern"] = 2
+    sm.add("internet", data=3)
+    assert sm.stats(memory=False)["nodes"] == 4
+    assert sm.get("inter") is None
+    ms = sm.find("internet international intern", all=True)
+    assert [(m.match, m.entrydata) for m in ms] == [("intern", 2), ("internet", 3), ("intern", 2),
+                                                     ("international", 1), ("intern", 2)]
+    bm = StringMatcher(radix=True, bytesmode=True)
+    bm.add("Zürich", data=1)
+    bm.add("Zürs", data=2)
+    assert [m.entrydata for m in bm.find("Zürs, Zürich".encode("utf-8"))] == [2, 1]
+
+
+def test_sm_async1():
+    import asyncio
+    import random
+    rnd = random.Random(5)
+    entries = ["".join(rnd.choice("abc -") for _ in range(rnd.randint(1, 6))) for _ in range(100)]
+    text = "".join(rnd.choice("abc -") for _ in range(1000))
+    sm = StringMatcher(ignorefunc=lambda c: c == "-")
+    for i, e in enumerate(entries):
+        sm.add(e, data=i)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.ensure_future(ticker())
+        for all in (False, True):
+            for skip in (False, True):
+                ms = await sm.afind(text, all=all, skip=skip, slicesize=7)
+                assert ms == sm.find(text, all=all, skip=skip)
+        assert ticks > 100
+        assert [m async for m in sm.afinditer(text, fromidx=10, toidx=200, slicesize=3)] == \
+            sm.find(text, fromidx=10, toidx=200)
+        assert await sm.afind(text, executor_threshold=100) == sm.find(text)
+        task.cancel()
+
+    asyncio.run(run())
+
+
+def test_sm_refind1():
+    import random
+    rnd = random.Random(7)
+    alphabet = "abc -"
+    entries = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 5))) for _ in range(60)]
+    for kwargs in (dict(), dict(ignorefunc=lambda c: c == "-")):
+        sm = StringMatcher(**kwargs)
+        for i, e in enumerate(entries):
+            sm.add(e, data=i)
+        text = "".join(rnd.choice(alphabet) for _ in range(300))
+        for _ in range(100):
+            offset = rnd.randint(0, len(text))
+            removed = rnd.randint(0, min(4, len(text) - offset))
+            inserted = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 4)))
+            newtext = text[:offset] + inserted + text[offset+removed:]
+            for all in (False, True):
+                for skip in (False, True):
+                    old = sm.find(text, all=all, skip=skip)
+                    assert sm.refind(newtext, old, offset, removed, inserted, all=all, skip=skip) == \
+                        sm.find(newtext, all=all, skip=skip)
+            text = newtext
+
+
+def test_sm_refind2():
+    for kwargs in (dict(resultcache=10), dict(resultcache=10, datatable=True)):
+        sm = StringMatcher(**kwargs)
+        sm.add("ab", data=1)
+        sm.add("cd", data=2)
+        text = "xxab cd"
+        old = sm.find(text)
+        new = sm.refind("xxxxab cd", old, 0, 0, 2)
+        assert [(m.start, m.end, m.entrydata) for m in new] == [(4, 6, 1), (7, 9, 2)]
+        assert [(m.start, m.end) for m in old] == [(2, 4), (5, 7)]
+        assert [(m.start, m.end) for m in sm.find(text)] == [(2, 4), (5, 7)]
+
+
+def test_sm_count1():
+    sm = StringMatcher(datatable=True)
+    sm.add("ab", data="AB")
+    sm.add("abc", data="ABC")
+    sm.add("x", data=1, append=True)
+    sm.add("x", data=2, append=True)
+    text = "abc ab x abx"
+    assert sm.count(text) == {"ABC": 1, "AB": 2, (1, 2): 2}
+    assert sm.count(text, all=True) == {"ABC": 1, "AB": 3, (1, 2): 2}
+    assert sm.count(text, key=lambda start, end, match, data, mdata: match) == {"abc": 1, "ab": 2, "x": 2}
+    assert sm.contains_any(text)
+    assert not sm.contains_any("yyy")
+    assert not sm.contains_any(text, fromidx=3, toidx=3)
+    assert sm.first(text) == sm.find(text)[0]
+    assert sm.first(text, all=True).match == "ab"
+    assert sm.first("yyy") is None
+
+
+def test_sm_count2():
+    for kwargs in (dict(), dict(datatable=True)):
+        sm = StringMatcher(**kwargs)
+        sm.add("ab", data=dict(type="X", ids=[1, 2]))
+        sm.add("cd", data=dict(type="X", ids=[1, 2]))
+        sm.add("x", data=dict(type="Y"), append=True)
+        sm.add("x", data=dict(type="Z"), append=True)
+        counts = sm.count("ab cd x x")
+        assert counts == {frozenset([("type", "X"), ("ids", (1, 2))]): 2,
+                          (frozenset([("type", "Y")]), frozenset([("type", "Z")])): 2}
+
+
+def test_sm_budget1():
+    import time
+    sm = StringMatcher()
+    for n in range(1, 6):
+        sm.add("a" * n, data=n)
+    text = "a" * 20
+    ms = sm.find(text, all=True, skip=False)
+    assert len(ms) == 90
+    ms = sm.find(text, all=True, skip=False, max_matches=10)
+    assert len(ms) == 10
+    assert ms.partial and ms.exceeded == {"max_matches"}
+    ms = sm.find(text, max_walk_depth=2)
+    assert [m.match for m in ms] == ["aa"] * 10
+    assert ms.exceeded == {"max_walk_depth"}
+    ms = sm.find(text, deadline=time.monotonic() - 1)
+    assert ms == [] and ms.exceeded == {"deadline"}
+    ms = sm.find(text, deadline=time.monotonic() + 60, max_walk_depth=5)
+    assert len(ms) == 4 and not ms.partial
+    assert sm.budgets_exceeded == {"max_matches": 1, "max_walk_depth": 1, "deadline": 1}
+
+
+def test_sm_budget2():
+    import time
+    sm = StringMatcher()
+    for n in range(1, 1001):
+        sm.add("a" * n, data=n)
+    text = "a" * 100000
+    starttime = time.monotonic()
+    ms = sm.find(text, all=True, skip=False, deadline=starttime + 0.05)
+    elapsed = time.monotonic() - starttime
+    assert ms.partial and ms.exceeded == {"deadline"}
+    assert 0 < len(ms) < 4096000
+    assert elapsed < 0.5
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from matchtext.tokenmatcher import TokenMatcher, Node
+from matchtext.utils import DataTable
+import pytest
 
 ENTRIES =  ["Some", "word", "to", "add", ["some", "word"], ["some", "word"]]
 
@@ -180,4 +182,336 @@ def test_tmp_repr1():
     tm.add(["this", "and", "that"], "ENTRY1")
     tm.add(["she", "and", "he"], "ENTRY2")
     tm.add(["other", "stuff"], "ENTRY3")
-    assert Node.dict_repr(tm.nodes) == """[('this', Node(is_match=None,data=None,nodes=[('and', Node(is_match=None,data=None,nodes=[('that', Node(is_match=True,data=ENTRY1,nodes=None))]))])), ('she', Node(is_match=None,data=None,nodes=[('and', Node(is_match=None,data=None,nodes=[('he', Node(is_match=True,data=ENTRY2,nodes=None))]))])), ('other', Node(is_match=None,data=None,nodes=[('stuff', Node(is_match=True,data=ENTRY3,nodes=None))]))]"""
\ No newline at end of file
+    assert Node.dict_repr(tm.nodes) == """[('this', Node(is_match=None,data=None,nodes=[('and', Node(is_match=None,data=None,nodes=[('that', Node(is_match=True,data=ENTRY1,nodes=None))]))])), ('she', Node(is_match=None,data=None,nodes=[('and', Node(is_match=None,data=None,nodes=[('he', Node(is_match=True,data=ENTRY2,nodes=None))]))])), ('other', Node(is_match=None,data=None,nodes=[('stuff', Node(is_match=True,data=ENTRY3,nodes=None))]))]"""
+
+def test_tm_resolve1():
+    tm = TokenMatcher()
+    tm.add(["a", "b"], data=1)
+    tm.add(["b", "c", "d"], data=2)
+    tm.add(["d", "e"], data=3)
+    tm.add(["c"], data=0)
+    t1 = ["a", "b", "c", "d", "e"]
+    assert len(tm.find(t1, all=True, skip=False)) == 4
+    ms = tm.find(t1, resolve="leftmost-longest")
+    assert [m.entrydata for m in ms] == [1, 0, 3]
+    ms = tm.find(t1, resolve="longest")
+    assert [m.entrydata for m in ms] == [2]
+    ms = tm.find(t1, resolve="priority", priority=lambda d: d)
+    assert [(m.start, m.end, m.entrydata) for m in ms] == [(0, 2, 1), (2, 3, 0), (3, 5, 3)]
+
+
+def test_tm_find7():
+    # skip continues after the ignored tokens inside the longest match
+    tm = TokenMatcher(ignorefunc=lambda x: x == "and")
+    tm.add(["x", "y", "z"], "E1")
+    tm.add(["z"], "E2")
+    ms = tm.find(["x", "and", "y", "z", "z"])
+    assert [(m.start, m.end, m.entrydata) for m in ms] == [(0, 4, "E1"), (4, 5, "E2")]
+
+
+def test_tm_tokencache1():
+    calls = []
+
+    def lower(x):
+        calls.append(x)
+        return x.lower()
+    tm = TokenMatcher(mapfunc=lower, ignorefunc=lambda x: x == "and", tokencache=3)
+    tm.add(["this", "and", "that"], "ENTRY1")
+    tm.add(["that"], "ENTRY2")
+    ncalls = len(calls)
+    tokens = ["THIS", "And", "That", "this", "and", "THAT", "x"]
+    ms = tm.find(tokens, all=True, skip=False)
+    assert [(m.start, m.end, m.entrydata) for m in ms] == \
+        [(0, 3, "ENTRY1"), (2, 3, "ENTRY2"), (3, 6, "ENTRY1"), (5, 6, "ENTRY2")]
+    stats = tm.cache_stats()["tokencache"]
+    assert stats["size"] == 3
+    assert stats["hits"] > 0
+    assert stats["misses"] == len(calls) - ncalls
+    assert tm.find(tokens, all=True, skip=False) == ms
+    assert TokenMatcher().cache_stats() == {}
+
+
+def test_tm_resultcache1():
+    tm = TokenMatcher(resultcache=2)
+    tm.add(["some", "word"], "E1")
+    t1 = ["this", "is", "some", "word"]
+    ms1 = tm.find(t1)
+    ms2 = tm.find(list(t1))
+    assert ms1 == ms2 and ms1 is not ms2
+    assert tm.cache_stats()["resultcache"]["hits"] == 1
+    assert tm.replace(t1) == ["this", "is", "E1"]
+    assert tm.find(t1, all=True) == ms1
+    # the replace result got evicted
+    assert tm.cache_stats()["resultcache"]["evictions"] == 1
+    tm.add(["is"], "E2")
+    assert len(tm.find(t1)) == 2
+    assert tm.replace(t1) == ["this", "E2", "E1"]
+
+
+def test_tm_resultcache2():
+    class T:
+        def __init__(self, s, doc):
+            self.s = s
+            self.doc = doc
+
+    tm = TokenMatcher(resultcache=10)
+    tm.add(["b"], "X")
+    ms = tm.find(["a", "b"])
+    ms[0].start = 5
+    ms[0].match.append("c")
+    ms = tm.find(["a", "b"])
+    assert ms[0].start == 1 and ms[0].match == ["b"]
+    d1 = [T("a", 1), T("b", 1)]
+    d2 = [T("a", 2), T("b", 2)]
+    def getter(t):
+        return t.s
+
+    assert tm.replace(d1, getter=getter)[0].doc == 1
+    assert tm.replace(d2, getter=getter)[0].doc == 2
+
+
+def test_tm_resultcache3():
+    tm = TokenMatcher(resultcache=10)
+    tm.add([1], "INT")
+    assert len(tm.find(["1"])) == 0
+    assert len(tm.find([1])) == 1
+    assert len(tm.find(["1"])) == 0
+
+
+def test_tm_datatable1():
+    table = DataTable()
+    tm1 = TokenMatcher(datatable=table)
+    tm2 = TokenMatcher(datatable=table, mapfunc=str.lower)
+    for tm in (tm1, tm2):
+        tm.add(["some", "word"], dict(type="X"), append=True)
+        tm.add(["some", "word"], dict(type="Y"), append=True)
+        tm.add("other", dict(type="X"))
+    assert len(table) == 2
+    ms = tm2.find(["SOME", "word", "other"])
+    assert ms[0].entrydata == [dict(type="X"), dict(type="Y")]
+    assert ms[1].entrydata == dict(type="X")
+    assert ms[1].entrydata is ms[0].entrydata[0]
+    plain = TokenMatcher(mapfunc=str.lower)
+    plain.add(["some", "word"], [dict(type="X"), dict(type="Y")])
+    plain.add("other", dict(type="X"))
+    assert plain.find(["SOME", "word", "other"]) == ms
+    assert tm1.find(["SOME", "word", "other"], matchmaker=lambda *args: args) == [(2, 3, ["other"], dict(type="X"), None)]
+
+
+def test_tm_prefilter1():
+    tm = TokenMatcher(ignorefunc=lambda x: x == "and")
+    for i, e in enumerate(ENTRIES + [["this", "and", "that"]]):
+        tm.add(e, data=i)
+    assert tm.prefilter_stats() == dict(maxdepth=2, nfirst=6)
+
+
+def test_tm_prepared1():
+    def ign(x):
+        return x == "and"
+    tm1 = TokenMatcher(mapfunc=str.lower, ignorefunc=ign)
+    tm1.add(["this", "and", "that"], "ENTRY1")
+    tm2 = TokenMatcher(mapfunc=str.lower, ignorefunc=ign)
+    tm2.add(["that", "should"], "ENTRY2")
+    tokens = [dict(text=t) for t in ["because", "THIS", "And", "That", "should", "also"]]
+    prepared = tm1.prepare(tokens, getter=lambda t: t["text"])
+    assert prepared.keys == ["because", "this", "and", "that", "should", "also"]
+    assert list(prepared.ignored) == [0, 0, 1, 0, 0, 0]
+    ms1 = tm1.find(prepared)
+    assert [(m.start, m.end, m.match, m.entrydata) for m in ms1] == [(1, 4, ["this", "that"], "ENTRY1")]
+    # the getter is now also used for the tokens after the first one
+    assert tm1.find(tokens, getter=lambda t: t["text"]) == ms1
+    ms2 = tm2.find(prepared)
+    assert [(m.start, m.end) for m in ms2] == [(3, 5)]
+    assert tm2.replace(prepared, replacer=lambda m: [m.entrydata]) == tokens[:3] + ["ENTRY2"] + tokens[5:]
+    with pytest.raises(ValueError):
+        TokenMatcher(mapfunc=str.lower).find(prepared)
+
+
+def test_tm_prepared2():
+    tm = TokenMatcher(mapfunc=str.lower, resultcache=10)
+    tm.add(["new", "york"], "NY")
+    assert tm.replace(tm.prepare(["I", "love", "New", "York"])) == ["I", "love", "NY"]
+    assert tm.replace(tm.prepare(["i", "LOVE", "new", "york"])) == ["i", "LOVE", "NY"]
+
+
+def test_tm_replace5():
+    tm = TokenMatcher()
+    tm.add(["this", "and", "that"], "ENTRY1")
+    tm.add(["other", "stuff"], "ENTRY3")
+    tokens = ("because", "this", "and", "that", "other", "stuff", "also")
+    assert list(tm.ireplace(tokens)) == ["because", "ENTRY1", "ENTRY3", "also"]
+    out, align = tm.replace(tokens, replacer=lambda m: ["<", m.entrydata, ">"], alignment=True)
+    assert out == ["because", "<", "ENTRY1", ">", "<", "ENTRY3", ">", "also"]
+    assert align == [0, 1, 1, 1, 4, 4, 4, 6]
+    assert tm.replace(tokens, replacer="X") == ["because", "X", "X", "also"]
+    assert tm.replace(list(tokens), replacer=[], fromidx=2) == ["because", "this", "and", "that", "also"]
+
+
+def test_tm_stats1():
+    tm = TokenMatcher(hitcounts=True)
+    for i, e in enumerate(ENTRIES):
+        tm.add(e, data=i)
+    st = tm.stats()
+    assert st["nodes"] == 7
+    assert st["entries"] == 5
+    assert st["maxdepth"] == 2
+    assert st["depth_histogram"] == {1: 4, 2: 1}
+    assert st["branching_histogram"] == {0: 5, 1: 1, 5: 1}
+    tm.find(["some", "word", "to", "some", "thing"], all=True)
+    assert tm.hit_counts() == {("some", "word"): 1, ("to",): 1}
+    assert tm.hit_counts(include_unused=True)[("add",)] == 0
+
+
+def test_tm_stats2():
+    tm = TokenMatcher(hitcounts=True, resultcache=10)
+    for i, e in enumerate(ENTRIES):
+        tm.add(e, data=i)
+    for _ in range(3):
+        tm.find(["some", "word", "to", "some", "thing"], all=True)
+    assert tm.hit_counts() == {("some", "word"): 3, ("to",): 3}
+
+
+def test_tm_async1():
+    import asyncio
+    tm = TokenMatcher()
+    for i, e in enumerate(ENTRIES):
+        tm.add(e, data=i)
+    tokens = ["some", "word", "to", "add", "x", "some", "some", "word"] * 20
+
+    async def run():
+        for all in (False, True):
+            for skip in (False, True):
+                assert await tm.afind(tokens, all=all, skip=skip, slicesize=3) == tm.find(tokens, all=all, skip=skip)
+        assert await tm.afind(tokens, executor_threshold=10) == tm.find(tokens)
+
+    asyncio.run(run())
+
+
+def test_tm_async2():
+    import asyncio
+    import pickle
+    from concurrent.futures import ThreadPoolExecutor
+    tm = TokenMatcher(mapfunc=str.lower, tokencache=5, resultcache=3)
+    for i, e in enumerate(ENTRIES):
+        tm.add(e, data=i)
+    docs = [["Some", "word", "to", str(i), "add", "SOME", "word"] * 50 for i in range(20)]
+    expected = [tm.find(doc) for doc in docs]
+
+    async def run():
+        with ThreadPoolExecutor(4) as executor:
+            for _ in range(3):
+                results = await asyncio.gather(*[tm.afind(doc, executor_threshold=10, executor=executor)
+                                                 for doc in docs])
+                assert results == expected
+
+    asyncio.run(run())
+    tm2 = pickle.loads(pickle.dumps(tm))
+    assert tm2.find(docs[0]) == expected[0]
+
+
+def test_tm_refind1():
+    import random
+    rnd = random.Random(8)
+    vocab = ["some", "word", "to", "add", "Some", "x", "the"]
+    tm = TokenMatcher(ignorefunc=lambda t: t == "the")
+    for i, e in enumerate(ENTRIES + [["to", "add", "some"], ["add", "the", "x"]]):
+        tm.add(e, data=i)
+    tokens = [rnd.choice(vocab) for _ in range(200)]
+    for _ in range(100):
+        offset = rnd.randint(0, len(tokens))
+        removed = rnd.randint(0, min(3, len(tokens) - offset))
+        inserted = [rnd.choice(vocab) for _ in range(rnd.randint(0, 3))]
+        newtokens = tokens[:offset] + inserted + tokens[offset+removed:]
+        for all in (False, True):
+            for skip in (False, True):
+                old = tm.find(tokens, all=all, skip=skip)
+                assert tm.refind(newtokens, old, offset, removed, inserted, all=all, skip=skip) == \
+                    tm.find(newtokens, all=all, skip=skip)
+        tokens = newtokens
+
+
+def test_tm_count1():
+    tm = TokenMatcher()
+    for i, e in enumerate(ENTRIES):
+        tm.add(e, data=i, append=True)
+    tokens = ["some", "word", "to", "Some", "x", "to"]
+    assert tm.count(tokens) == {(4, 5): 1, (2,): 2, (0,): 1}
+    assert tm.count([[t] for t in tokens], getter=lambda t: t[0], key=lambda *args: "all") == {"all": 4}
+    assert tm.contains_any(tokens)
+    assert not tm.contains_any(["x", "y"])
+    assert tm.first(tokens).entrydata == [4, 5]
+    assert tm.first(["x"]) is None
+
+
+def test_tm_count2():
+    tm = TokenMatcher(datatable=True)
+    tm.add(["some", "word"], data=dict(type="X"))
+    tm.add(["other"], data=dict(type="X"))
+    assert tm.count(["some", "word", "other", "x"]) == {frozenset([("type", "X")]): 2}
+
+
+def test_tm_budget1():
+    tm = TokenMatcher()
+    for n in range(1, 4):
+        tm.add(["a"] * n, data=n)
+    tokens = ["a"] * 10
+    ms = tm.find(tokens, all=True, skip=False, max_matches=5)
+    assert len(ms) == 5 and ms.exceeded == {"max_matches"}
+    ms = tm.find(tokens, max_walk_depth=2)
+    assert [m.entrydata for m in ms] == [2] * 5
+    assert ms.partial
+    ms = tm.find(tokens, max_walk_depth=3, resolve="longest")
+    assert [m.entrydata for m in ms] == [3, 3, 3, 1]
+    assert not ms.partial
+    assert tm.budgets_exceeded["max_walk_depth"] == 1
+
+
+def test_tm_classes1():
+    tm = TokenMatcher(mapfunc=str.lower, tokenclasses={"<NUM>": r"\d+", "<ANY>": lambda t: True})
+    tm.add(["Section", "<NUM>"], data="section")
+    tm.add(["section", "1"], data="first")
+    tm.add(["<NUM>", "gmbh"], data="company")
+    tm.add(["see", "<ANY>", "<NUM>"], data="ref")
+    tokens = ["Section", "12", "and", "section", "1", "see", "page", "3", "42", "GmbH"]
+    assert [(m.start, m.end, m.entrydata) for m in tm.find(tokens)] == \
+        [(0, 2, "section"), (3, 5, "first"), (5, 8, "ref"), (8, 10, "company")]
+    assert tm.find(["section", "x"]) == []
+    assert [m.match for m in tm.find(["Section", "7"])] == [["section", "7"]]
+    stats = tm.stats(memory=False)
+    assert stats["entries"] == 4
+    assert stats["nodes"] == 9
+
+
+def test_tm_classes2():
+    tm = TokenMatcher(tokenclasses={"<NUM>": r"\d+"})
+    tm.add(["<NUM>"], data="num")
+    tm.add(["5", "x"], data="5x")
+    assert [(m.match, m.entrydata) for m in tm.find(["5", "y", "5", "x"])] == [(["5"], "num"), (["5", "x"], "5x")]
+    tm = TokenMatcher(tokenclasses={"<NUM>": r"\d+"})
+    tm.add(["Section", "<NUM>"], data="section")
+    tm.add(["Section", "5", "of", "law"], data="law")
+    tokens = ["Section", "5", "of", "Section", "5", "of", "law"]
+    assert [(m.start, m.end, m.entrydata) for m in tm.find(tokens)] == [(0, 2, "section"), (3, 7, "law")]
+    assert [(m.end, m.entrydata) for m in tm.find(tokens, all=True, fromidx=3)] == [(5, "section"), (7, "law")]
+    tm.add(["Section", "5"], data="five")
+    assert [m.entrydata for m in tm.find(["Section", "5", "Section", "6"])] == ["five", "section"]
+    assert tm.find(["Section", "5", "of", "law"], max_walk_depth=3).partial
+
+
+def test_tm_text1():
+    from matchtext.tokenmatcher import Tokenizer
+    tm = TokenMatcher(mapfunc=str.lower)
+    tm.add(["New", "York"], data="NY")
+    tm.add(["York"], data="Y")
+    tm.add(["section", "1"], data="S1")
+    text = "  I left new  York\tfor Section 1."
+    ms = tm.find_text(text)
+    assert [(m.start, m.end, m.match, m.entrydata) for m in ms] == [(9, 18, "new  York", "NY")]
+    assert [m.match for m in tm.find_text(text, all=True, skip=False)] == ["new  York", "York"]
+    tokenizer = Tokenizer(r"\w+")
+    tokenized = tokenizer.tokenize(text)
+    assert tokenized.char_span(5, 7) == (23, 32)
+    ms = tm.find_text(tokenized)
+    assert [(m.start, m.end, m.entrydata) for m in ms] == [(9, 18, "NY"), (23, 32, "S1")]
+    assert list(tm.finditer_text(text, tokenizer=tokenizer, all=True)) == tm.find_text(text, tokenizer, all=True)
+    assert tm.find_text("") == []